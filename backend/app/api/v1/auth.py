@@ -1,7 +1,15 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from app.models.schemas import UserCreate, UserLogin, Token
-from app.core.security import get_password_hash, verify_password, create_access_token, create_refresh_token
+from fastapi import APIRouter, HTTPException, Response, status, Depends
+from app.models.schemas import UserCreate, UserLogin, Token, TokenRefresh
+from app.core.security import (
+    get_password_hash, aget_password_hash, averify_password, create_access_token,
+    create_refresh_token, decode_token, revoke_token
+)
 from app.db.database import Database
+from app.core.concurrency import run_db, Overloaded
+from app.core.config import settings
+from app.api.v1.shell import k8s_service, start_provisioning
+from app.services.cache import command_activity
+import hashlib
 import logging
 import traceback
 from datetime import datetime
@@ -12,6 +20,31 @@ logger = logging.getLogger(__name__)
 # Set logging level to DEBUG for detailed logs
 logging.basicConfig(level=logging.DEBUG)
 
+# nginx hashes this cookie to send each user to the same backend replica
+ROUTE_COOKIE = "tempshell_route"
+
+def _predicts_shell_use(db_user: dict) -> bool:
+    """Whether to start the user's pod at login, per PREPROVISION_ON_LOGIN"""
+    if settings.PREPROVISION_ON_LOGIN == "always":
+        return True
+    if settings.PREPROVISION_ON_LOGIN == "recent":
+        # Ran a command after logging in last time
+        last_command_at = db_user['last_command_at']
+        return last_command_at is not None and (
+            db_user['last_login'] is None or last_command_at >= db_user['last_login']
+        )
+    return False
+
+def _set_route_cookie(response: Response, username: str):
+    """Pin the user's requests to one replica, keeping its per-user caches and sessions warm"""
+    response.set_cookie(
+        ROUTE_COOKIE,
+        hashlib.sha256(username.encode()).hexdigest()[:16],
+        max_age=settings.REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+        httponly=True,
+        samesite="strict"
+    )
+
 @router.post("/signup", status_code=status.HTTP_201_CREATED, response_model=dict)
 async def signup(user: UserCreate):
     """
@@ -21,16 +54,17 @@ async def signup(user: UserCreate):
     - **password**: Strong password (min 8 chars, upper, lower, digit, special)
     - **email**: Valid email address
     """
-    conn = Database.get_connection()
+    conn = await Database.acquire()
     cursor = conn.cursor(dictionary=True)
     
     try:
         # Check if user already exists
-        cursor.execute(
+        await run_db(
+            cursor.execute,
             "SELECT id FROM users WHERE username = %s OR email = %s",
             (user.username, user.email)
         )
-        existing_user = cursor.fetchone()
+        existing_user = await run_db(cursor.fetchone)
         
         if existing_user:
             raise HTTPException(
@@ -39,14 +73,15 @@ async def signup(user: UserCreate):
             )
         
         # Hash password with bcrypt
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await aget_password_hash(user.password)
         
         # Insert new user
-        cursor.execute(
+        await run_db(
+            cursor.execute,
             "INSERT INTO users (username, password, email) VALUES (%s, %s, %s)",
             (user.username, hashed_password, user.email)
         )
-        conn.commit()
+        await run_db(conn.commit)
         
         logger.info(f"New user registered: {user.username}")
         return {
@@ -54,7 +89,7 @@ async def signup(user: UserCreate):
             "username": user.username
         }
         
-    except HTTPException:
+    except (HTTPException, Overloaded):
         raise
     except Exception as e:
         error_trace = traceback.format_exc()
@@ -62,33 +97,35 @@ async def signup(user: UserCreate):
         logger.error(f"Error type: {type(e).__name__}")
         logger.error(f"Error message: {str(e)}")
         logger.error(f"Full traceback:\n{error_trace}")
-        conn.rollback()
+        await run_db(conn.rollback)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Registration failed: {str(e)}"
         )
     finally:
         cursor.close()
-        conn.close()
+        await run_db(conn.close)
 
 @router.post("/login", response_model=Token)
-async def login(user: UserLogin):
+async def login(user: UserLogin, response: Response):
     """
     Authenticate user and return JWT tokens
     
     - **username**: User's username
     - **password**: User's password
     """
-    conn = Database.get_connection()
+    conn = await Database.acquire()
     cursor = conn.cursor(dictionary=True)
     
     try:
         # Fetch user from database
-        cursor.execute(
-            "SELECT id, username, password, is_active, failed_login_attempts, locked_until FROM users WHERE username = %s",
+        await run_db(
+            cursor.execute,
+            "SELECT id, username, password, is_active, failed_login_attempts, locked_until, "
+            "last_login, last_command_at FROM users WHERE username = %s",
             (user.username,)
         )
-        db_user = cursor.fetchone()
+        db_user = await run_db(cursor.fetchone)
         
         # Check if user exists
         if not db_user:
@@ -105,14 +142,15 @@ async def login(user: UserLogin):
             )
         
         # Verify password
-        if not verify_password(user.password, db_user['password']):
+        if not await averify_password(user.password, db_user['password']):
             # Increment failed login attempts
             failed_attempts = db_user['failed_login_attempts'] + 1
-            cursor.execute(
+            await run_db(
+                cursor.execute,
                 "UPDATE users SET failed_login_attempts = %s WHERE id = %s",
                 (failed_attempts, db_user['id'])
             )
-            conn.commit()
+            await run_db(conn.commit)
             
             logger.warning(f"Failed login attempt for user: {user.username}")
             raise HTTPException(
@@ -128,11 +166,12 @@ async def login(user: UserLogin):
             )
         
         # Reset failed login attempts and update last login
-        cursor.execute(
+        await run_db(
+            cursor.execute,
             "UPDATE users SET last_login = %s, failed_login_attempts = 0, locked_until = NULL WHERE id = %s",
             (datetime.utcnow(), db_user['id'])
         )
-        conn.commit()
+        await run_db(conn.commit)
         
         # Create JWT tokens
         access_token = create_access_token(data={"sub": user.username})
@@ -140,12 +179,20 @@ async def login(user: UserLogin):
         
         logger.info(f"User logged in successfully: {user.username}")
         
+        # A new session: its first command records last_command_at again
+        await command_activity.adelete(user.username)
+        
+        # Overlap the pod start with the user opening the shell; this only schedules it
+        if k8s_service.enabled and _predicts_shell_use(db_user):
+            start_provisioning(user.username, speculative=True)
+        
+        _set_route_cookie(response, user.username)
         return Token(
             access_token=access_token,
             refresh_token=refresh_token
         )
         
-    except HTTPException:
+    except (HTTPException, Overloaded):
         raise
     except Exception as e:
         error_trace = traceback.format_exc()
@@ -159,7 +206,49 @@ async def login(user: UserLogin):
         )
     finally:
         cursor.close()
-        conn.close()
+        await run_db(conn.close)
+
+def _decode_refresh_token(token: str) -> dict:
+    """Decode a token and make sure it is a refresh token"""
+    payload = decode_token(token)
+    if payload.get("type") != "refresh" or not payload.get("sub") or not payload.get("jti"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token type"
+        )
+    return payload
+
+@router.post("/refresh", response_model=Token)
+async def refresh(body: TokenRefresh, response: Response):
+    """
+    Exchange a refresh token for a new access token
+    
+    The refresh token is rotated: the one presented is revoked and a new one
+    is returned, so a leaked refresh token stops working after one use.
+    """
+    payload = _decode_refresh_token(body.refresh_token)
+    
+    if not await revoke_token(payload):
+        logger.warning(f"Reuse of revoked refresh token for user: {payload['sub']}")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked"
+        )
+    
+    _set_route_cookie(response, payload["sub"])
+    return Token(
+        access_token=create_access_token(data={"sub": payload["sub"]}),
+        refresh_token=create_refresh_token(data={"sub": payload["sub"]})
+    )
+
+@router.post("/logout")
+async def logout(body: TokenRefresh, response: Response):
+    """Revoke a refresh token so it can no longer mint access tokens"""
+    payload = _decode_refresh_token(body.refresh_token)
+    await revoke_token(payload)
+    response.delete_cookie(ROUTE_COOKIE)
+    logger.info(f"User logged out: {payload['sub']}")
+    return {"message": "Logged out"}
 
 @router.get("/me")
 async def get_current_user_info(current_user: dict = Depends(get_password_hash)):
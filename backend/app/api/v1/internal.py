@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException, Request, status
+from app.services.cache import caches, LocalCache
+from app.services.invalidation import verify, SIGNATURE_HEADER
+import json
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+@router.post("/invalidate")
+async def invalidate(request: Request):
+    """
+    Drop keys from this replica's in-process caches at another replica's request
+
+    Only reachable inside the cluster (nginx proxies /api/ alone); the body
+    must be signed with the shared SECRET_KEY.
+    """
+    body = await request.body()
+    if not verify(body, request.headers.get(SIGNATURE_HEADER)):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid signature"
+        )
+
+    message = json.loads(body)
+    cache = caches.get(message.get("cache"))
+    if isinstance(cache, LocalCache):
+        for key in message.get("keys", []):
+            cache.discard(key)
+    return {"invalidated": len(message.get("keys", []))}
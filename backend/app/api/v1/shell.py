@@ -1,163 +1,621 @@
-from fastapi import APIRouter, HTTPException, status, Depends
-from app.models.schemas import CommandExecute, CommandResponse, ShellStatus
-from app.core.security import get_current_user
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from app.models.schemas import (
+    CommandExecute, CommandResponse, CommandBatch, CommandBatchResponse, ShellStatus, ProvisionResponse,
+    FileTransferResponse
+)
+from app.core.config import settings
+from app.core.security import get_current_user, authenticate_token
 from app.services.k8s_service import K8sService
-from app.db.database import Database
+from app.db.database import Database, UnitOfWork, get_uow
+from app.db.pool import PoolTimeout
+from app.core.concurrency import run_k8s, run_exec, AdmissionQueue, SingleFlight, Overloaded
+from app.core.rate_limit import rate_limiter, RateLimited
+from app.core.metrics import SPECULATIVE_PODS, FILE_TRANSFER_BYTES
+from app.services.cache import user_pod_cache, command_activity
+from app.services.provisioning import provisionings, Provisioning
+from app.services.file_transfer import transfers, Transfer, FileTransferError, single_file_framing
 from datetime import datetime
+from typing import Dict, List, Optional
+import asyncio
+import json
 import logging
+import posixpath
+import secrets
+import threading
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 k8s_service = K8sService()
 
+# Concurrent pod creations for the same user share one; all users share a bounded, fair queue
+pod_creations = SingleFlight()
+pod_create_admission = AdmissionQueue(
+    "pod_create",
+    settings.POD_CREATE_CONCURRENCY,
+    settings.POD_CREATE_MAX_QUEUE,
+    retry_after=5  # Roughly one pod start
+)
+
+# Provisionings started by /provision and background home restores, kept referenced until they finish
+_provision_tasks = set()
+
+# Seconds between keep-alive comments on idle provisioning event streams
+PROVISION_EVENTS_HEARTBEAT = 15
+
+# FILE_CHUNK_BYTES chunks buffered per file transfer between the client and the exec thread
+FILE_QUEUE_CHUNKS = 8
+
+def _failure_detail(error: Exception) -> str:
+    """Client-facing reason a pod could not be provided"""
+    if isinstance(error, RateLimited):
+        return "Rate limit exceeded, please retry later"
+    if isinstance(error, (Overloaded, PoolTimeout)):
+        return "Service is busy, please retry shortly"
+    if isinstance(error, HTTPException):
+        return error.detail
+    return "Failed to create shell environment"
+
+async def get_user_pod_id(username: str, db: UnitOfWork) -> Optional[str]:
+    """Look up the user's shell_pod_id, served from the user-pod cache when possible"""
+    cached = await user_pod_cache.aget(username)
+    if cached is not None:
+        return cached or None
+    
+    user_data = await db.fetchone(
+        "SELECT shell_pod_id FROM users WHERE username = %s",
+        (username,)
+    )
+    
+    if not user_data:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    pod_id = user_data.get('shell_pod_id')
+    await user_pod_cache.aset(username, pod_id or "")
+    return pod_id
+
+async def get_or_create_user_pod(username: str, db: UnitOfWork, speculative: bool = False) -> str:
+    """
+    Resolve the user's running shell pod, creating one if needed
+    
+    No database connection is held across the Kubernetes calls here, which
+    can take as long as a pod start. speculative marks a pod created before
+    the user asked for one (see start_provisioning).
+    """
+    pod_id = await get_user_pod_id(username, db)
+    
+    # Check if pod exists and is running (if pod_id is set)
+    if pod_id:
+        try:
+            pod_status = await run_k8s(k8s_service.get_pod_status, pod_id)
+            if pod_status["status"] == "not_found":
+                # Pod doesn't exist anymore, clear it from database
+                logger.warning(f"Pod {pod_id} not found for user {username}, creating new one")
+                stale_pod_id, pod_id = pod_id, None
+                await user_pod_cache.adelete(username)
+                await db.execute(
+                    "UPDATE users SET shell_pod_id = NULL WHERE username = %s AND shell_pod_id = %s",
+                    (username, stale_pod_id)
+                )
+        except Exception as e:
+            logger.error(f"Error checking pod status: {e}")
+            # Clear invalid pod_id
+            stale_pod_id, pod_id = pod_id, None
+            await user_pod_cache.adelete(username)
+            await db.execute(
+                "UPDATE users SET shell_pod_id = NULL WHERE username = %s AND shell_pod_id = %s",
+                (username, stale_pod_id)
+            )
+    
+    if pod_id and speculative:
+        SPECULATIVE_PODS.labels("reused").inc()
+    
+    # Create pod if it doesn't exist
+    if not pod_id:
+        try:
+            pod_id = await pod_creations.do(username, lambda: _create_user_pod(username, speculative))
+        except (Overloaded, PoolTimeout):
+            raise
+        except Exception as e:
+            logger.error(f"Failed to create pod for {username}: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to create shell environment"
+            )
+    
+    return pod_id
+
+async def _create_user_pod(username: str, speculative: bool = False) -> str:
+    """
+    Create a pod for the user and record it, unless another creation won the race.
+    
+    Runs once per user at a time through pod_creations, with its own
+    UnitOfWork since it can outlive the request that started it. The
+    conditional UPDATE keeps creations on other replicas from overwriting each
+    other; the loser deletes its pod and uses the winner's. Progress is
+    published to provisionings whether or not /provision started it.
+    """
+    provisionings.start(username)
+    try:
+        pod_id = await _start_user_pod(username, speculative)
+    except Exception as e:
+        provisionings.update(username, "Failed", detail=_failure_detail(e))
+        raise
+    provisionings.update(username, "Running", pod_id)
+    return pod_id
+
+async def _start_user_pod(username: str, speculative: bool) -> str:
+    loop = asyncio.get_running_loop()
+    
+    def on_phase(pod_id: str, phase: str):
+        # Running is published once the pod is recorded for the user
+        if phase != "Running":
+            loop.call_soon_threadsafe(provisionings.update, username, phase, pod_id)
+    
+    await rate_limiter.check("pod_create", username=username)
+    async with pod_create_admission:
+        pod_id = await run_k8s(k8s_service.create_user_pod, username, on_phase, speculative)
+    restore_pending = await _restore_home(username, pod_id)
+    
+    db = UnitOfWork()
+    updated = await db.execute(
+        "UPDATE users SET shell_pod_id = %s WHERE username = %s AND shell_pod_id IS NULL",
+        (pod_id, username)
+    )
+    if updated == 0:
+        user_data = await db.fetchone(
+            "SELECT shell_pod_id FROM users WHERE username = %s",
+            (username,)
+        )
+        existing_pod_id = user_data and user_data.get('shell_pod_id')
+        if existing_pod_id and existing_pod_id != pod_id:
+            logger.info(f"User {username} already got pod {existing_pod_id}, discarding {pod_id}")
+            await run_k8s(k8s_service.delete_pod, pod_id)
+            pod_id = existing_pod_id
+            restore_pending = False
+    
+    # Drop other replicas' cached "no pod" before recording the new one
+    await user_pod_cache.adelete(username)
+    await user_pod_cache.aset(username, pod_id)
+    logger.info(f"Created new pod {pod_id} for user {username}")
+    
+    if restore_pending:
+        task = asyncio.ensure_future(run_exec(k8s_service.hibernator.restore_remaining, pod_id, username))
+        _provision_tasks.add(task)
+        task.add_done_callback(_provision_tasks.discard)
+    return pod_id
+
+async def _restore_home(username: str, pod_id: str) -> bool:
+    """
+    Restore the directories and recently touched files of the user's hibernated home into a new pod
+    
+    Runs before the pod is handed out, so the first command finds the
+    user's working set; returns whether other files remain to be restored
+    in the background. A failed restore is logged and leaves the pod empty.
+    """
+    hibernator = k8s_service.hibernator
+    if not hibernator.enabled or not await run_exec(hibernator.has_snapshot, username):
+        return False
+    provisionings.update(username, "Restoring", pod_id)
+    try:
+        return await run_exec(hibernator.restore, pod_id, username)
+    except Exception as e:
+        logger.error(f"Failed to restore home of {username} into pod {pod_id}: {e}")
+        return False
+
+def detach_reaped_pods(reaped: Dict[str, str]):
+    """Clear shell_pod_id for pods deleted by the reaper, in one statement"""
+    pod_ids = list(reaped)
+    conn = Database.get_connection()
+    cursor = conn.cursor()
+    try:
+        # Only rows still pointing at a reaped pod; a user may have a new one already
+        placeholders = ", ".join(["%s"] * len(pod_ids))
+        cursor.execute(
+            f"UPDATE users SET shell_pod_id = NULL WHERE shell_pod_id IN ({placeholders})",
+            pod_ids
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    
+    for username in set(reaped.values()):
+        user_pod_cache.delete(username)
+
+async def _record_command_activity(username: str, db: UnitOfWork):
+    """
+    Note that the user ran commands this session, which login uses to predict shell use
+    
+    Best effort: a failed write is logged and retried with the next command
+    rather than failing the command.
+    """
+    if await command_activity.aget(username) is not None:
+        return
+    try:
+        await db.execute(
+            "UPDATE users SET last_command_at = %s WHERE username = %s",
+            (datetime.utcnow(), username)
+        )
+    except Exception as e:
+        logger.warning(f"Failed to record command activity for {username}: {e}")
+        return
+    await command_activity.aset(username, "1")
+
+async def _provision(username: str, speculative: bool):
+    """Resolve or create the user's pod in the background"""
+    try:
+        pod_id = await get_or_create_user_pod(username, UnitOfWork(), speculative)
+    except Exception as e:
+        provisionings.update(username, "Failed", detail=_failure_detail(e))
+        if not isinstance(e, (HTTPException, Overloaded, PoolTimeout)):
+            logger.error(f"Provisioning failed for {username}: {e}")
+        return
+    provisionings.update(username, "Running", pod_id)
+
+def start_provisioning(username: str, speculative: bool = False) -> Provisioning:
+    """
+    Provision the user's pod in the background, unless already in progress
+    
+    Used by /provision and, speculatively, by login before the user asked.
+    """
+    provisioning = provisionings.get(username)
+    if provisioning is None or provisioning.done:
+        provisioning = provisionings.start(username)
+        task = asyncio.ensure_future(_provision(username, speculative))
+        _provision_tasks.add(task)
+        task.add_done_callback(_provision_tasks.discard)
+    return provisioning
+
+@router.post("/provision", status_code=status.HTTP_202_ACCEPTED, response_model=ProvisionResponse)
+async def provision_shell(current_user: dict = Depends(get_current_user)):
+    """
+    Start provisioning the user's shell environment without waiting for it
+    
+    Returns at once with a provision ID. Progress (Pending, ContainerCreating,
+    Running or Failed) is pushed on /provision/events and reported by
+    /status; commands sent meanwhile wait for the same pod.
+    """
+    provisioning = start_provisioning(current_user["username"])
+    return ProvisionResponse(**provisioning.to_dict())
+
+@router.get("/provision/events")
+async def provision_events(token: str = Query(...)):
+    """
+    Server-sent events with the user's provisioning progress
+    
+    Authenticated with the access token as a query parameter, since
+    EventSource cannot set headers. Each `status` event carries the fields of
+    /provision's response; the stream ends after Running or Failed, or at once
+    with status `not_created` when nothing is being provisioned.
+    """
+    username = authenticate_token(token)["username"]
+    
+    async def events():
+        sent = False
+        async for state in provisionings.watch(username, PROVISION_EVENTS_HEARTBEAT):
+            if state is None:
+                yield ": keep-alive\n\n"
+                continue
+            sent = True
+            yield f"event: status\ndata: {json.dumps(state)}\n\n"
+        if not sent:
+            yield f"event: status\ndata: {json.dumps({'provision_id': None, 'status': 'not_created'})}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep nginx from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/execute", response_model=CommandResponse)
 async def execute_command(
     command: CommandExecute,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow)
 ):
     """
     Execute a command in the user's isolated shell environment
     
     - **command**: Shell command to execute (max 1000 characters)
     """
-    conn = Database.get_connection()
-    cursor = conn.cursor(dictionary=True)
-    
     try:
         username = current_user["username"]
         
         # Get or create user pod
-        cursor.execute(
-            "SELECT shell_pod_id FROM users WHERE username = %s",
-            (username,)
-        )
-        user_data = cursor.fetchone()
+        pod_id = await get_or_create_user_pod(username, db)
+        await _record_command_activity(username, db)
         
-        if not user_data:
+        # Execute command in pod
+        try:
+            result = await run_exec(
+                k8s_service.execute_command, pod_id, command.command, command.timeout,
+                command_id=command.command_id
+            )
+        except Exception as e:
+            logger.error(f"Command execution failed for {username}: {e}")
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Command execution failed"
             )
         
-        pod_id = user_data.get('shell_pod_id')
+        logger.info(f"Command executed for {username} in pod {pod_id}: exit_code={result['exit_code']}")
         
-        # Check if pod exists and is running (if pod_id is set)
-        if pod_id:
-            try:
-                pod_status = k8s_service.get_pod_status(pod_id)
-                if pod_status["status"] == "not_found":
-                    # Pod doesn't exist anymore, clear it from database
-                    logger.warning(f"Pod {pod_id} not found for user {username}, creating new one")
-                    pod_id = None
-                    cursor.execute(
-                        "UPDATE users SET shell_pod_id = NULL WHERE username = %s",
-                        (username,)
-                    )
-                    conn.commit()
-            except Exception as e:
-                logger.error(f"Error checking pod status: {e}")
-                # Clear invalid pod_id
-                pod_id = None
-                cursor.execute(
-                    "UPDATE users SET shell_pod_id = NULL WHERE username = %s",
-                    (username,)
-                )
-                conn.commit()
+        return CommandResponse(
+            **result,
+            executed_at=datetime.utcnow()
+        )
         
-        # Create pod if it doesn't exist
-        if not pod_id:
-            try:
-                pod_id = k8s_service.create_user_pod(username)
-                cursor.execute(
-                    "UPDATE users SET shell_pod_id = %s WHERE username = %s",
-                    (pod_id, username)
-                )
-                conn.commit()
-                logger.info(f"Created new pod {pod_id} for user {username}")
-            except Exception as e:
-                logger.error(f"Failed to create pod for {username}: {e}")
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to create shell environment"
-                )
+    except (HTTPException, Overloaded, PoolTimeout):
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error in execute_command: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An unexpected error occurred"
+        )
+
+@router.post("/execute/batch", response_model=CommandBatchResponse)
+async def execute_batch(
+    batch: CommandBatch,
+    current_user: dict = Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow)
+):
+    """
+    Execute several commands in order in the user's shell environment
+    
+    The pod is resolved once and all commands share one exec stream, so shell
+    state (working directory, variables) carries from one command to the next.
+    The batch as a whole stops after BATCH_TIMEOUT_SECONDS with status `timed_out`.
+    
+    - **commands**: Commands to execute, each validated like /execute
+    - **stop_on_error**: Stop after the first command with a non-zero exit code
+    """
+    try:
+        username = current_user["username"]
         
-        # Execute command in pod
+        # Get or create user pod
+        pod_id = await get_or_create_user_pod(username, db)
+        await _record_command_activity(username, db)
+        
+        # Execute commands in pod
         try:
-            output, exit_code = k8s_service.execute_command(pod_id, command.command)
+            results, batch_status = await run_exec(
+                k8s_service.execute_batch,
+                pod_id,
+                [(command.command, command.timeout, command.command_id) for command in batch.commands],
+                batch.stop_on_error
+            )
         except Exception as e:
-            logger.error(f"Command execution failed for {username}: {e}")
+            logger.error(f"Batch execution failed for {username}: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Command execution failed"
             )
         
-        logger.info(f"Command executed for {username} in pod {pod_id}: exit_code={exit_code}")
+        logger.info(
+            f"Batch executed for {username} in pod {pod_id}: "
+            f"{len(results)}/{len(batch.commands)} commands, {batch_status}"
+        )
         
-        return CommandResponse(
-            output=output,
-            exit_code=exit_code,
-            executed_at=datetime.utcnow()
+        executed_at = datetime.utcnow()
+        return CommandBatchResponse(
+            results=[CommandResponse(**result, executed_at=executed_at) for result in results],
+            completed=len(results) == len(batch.commands),
+            status=batch_status
         )
         
-    except HTTPException:
+    except (HTTPException, Overloaded, PoolTimeout):
         raise
     except Exception as e:
-        logger.error(f"Unexpected error in execute_command: {e}")
+        logger.error(f"Unexpected error in execute_batch: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An unexpected error occurred"
         )
-    finally:
-        cursor.close()
-        conn.close()
 
-@router.delete("/terminate")
-async def terminate_shell(current_user: dict = Depends(get_current_user)):
+async def _stream_to_websocket(websocket: WebSocket, pod_id: str, command: CommandExecute) -> int:
     """
-    Terminate the user's shell environment and delete the pod
+    Run a command in the pod and forward its output frames to the websocket.
+    
+    The exec thread hands frames over through a bounded queue and blocks while it
+    is full, so a slow client slows down reading from the pod instead of growing
+    backend memory.
     """
-    conn = Database.get_connection()
-    cursor = conn.cursor(dictionary=True)
+    loop = asyncio.get_running_loop()
+    frames = asyncio.Queue(maxsize=settings.STREAM_QUEUE_FRAMES)
+    abandoned = threading.Event()
+    command_id = command.command_id or secrets.token_hex(8)
+    
+    def on_output(channel: str, data: str):
+        if abandoned.is_set():
+            return  # Drop output until the cancelled command is killed
+        asyncio.run_coroutine_threadsafe(
+            frames.put({"type": channel, "data": data}), loop
+        ).result()
+    
+    def run():
+        try:
+            return k8s_service.stream_command(pod_id, command.command, on_output, command.timeout,
+                                              command_id=command_id)
+        finally:
+            asyncio.run_coroutine_threadsafe(frames.put(None), loop).result()
+    
+    execution = asyncio.ensure_future(run_exec(run))
+    try:
+        while True:
+            frame = await frames.get()
+            if frame is None:
+                break
+            await websocket.send_json(frame)
+    except BaseException:
+        # Stop the command and unblock the exec thread if the client went away mid-stream
+        abandoned.set()
+        k8s_service.cancel_command(pod_id, command_id)
+        while not execution.done():
+            try:
+                frames.get_nowait()
+            except asyncio.QueueEmpty:
+                await asyncio.sleep(0.05)
+        execution.exception()  # Already reported through the original error
+        raise
     
+    return await execution
+
+@router.websocket("/stream")
+async def stream_commands(websocket: WebSocket, token: str = Query(...), db: UnitOfWork = Depends(get_uow)):
+    """
+    Execute commands with output streamed as it is produced
+    
+    Authenticated with the access token as a query parameter. The client sends
+    `{"command": "..."}` messages one at a time; for each, the server sends
+    `stdout`/`stderr` frames with a `data` field as output arrives and finishes
+    with an `exit` frame carrying `exit_code`.
+    """
+    try:
+        current_user = authenticate_token(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    username = current_user["username"]
+    
+    try:
+        pod_id = await get_or_create_user_pod(username, db)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "detail": e.detail})
+        await websocket.close()
+        return
+    except (Overloaded, PoolTimeout) as e:
+        await websocket.send_json({
+            "type": "error",
+            "detail": "Service is busy, please retry shortly",
+            "retry_after": getattr(e, "retry_after", 1)
+        })
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                command = CommandExecute(**message)
+            except (ValidationError, TypeError) as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            
+            # Commands over the socket share the /execute budget
+            try:
+                await rate_limiter.check("execute", username, websocket.client and websocket.client.host)
+            except RateLimited as e:
+                await websocket.send_json({
+                    "type": "error",
+                    "detail": "Rate limit exceeded, please retry later",
+                    "retry_after": e.retry_after
+                })
+                continue
+            
+            try:
+                await _record_command_activity(username, db)
+                exit_code = await _stream_to_websocket(websocket, pod_id, command)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error(f"Streaming command failed for {username}: {e}")
+                await websocket.send_json({"type": "error", "detail": "Command execution failed"})
+                continue
+            
+            logger.info(f"Streamed command for {username} in pod {pod_id}: exit_code={exit_code}")
+            await websocket.send_json({"type": "exit", "exit_code": exit_code})
+    except WebSocketDisconnect:
+        logger.info(f"Stream closed for {username}")
+
+@router.post("/cancel")
+async def cancel_command(
+    command_id: Optional[str] = Query(None, max_length=64),
+    current_user: dict = Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow)
+):
+    """
+    Cancel one of the user's in-flight commands, killing its processes in the pod
+    
+    - **command_id**: The command_id the command was sent with; defaults to the most recently started command
+    """
     try:
         username = current_user["username"]
         
-        # Get user's pod ID
-        cursor.execute(
-            "SELECT shell_pod_id FROM users WHERE username = %s",
-            (username,)
+        pod_id = await get_user_pod_id(username, db)
+        cancelled = bool(pod_id) and k8s_service.cancel_command(pod_id, command_id)
+        
+        if cancelled:
+            logger.info(f"Cancelled in-flight command for {username} in pod {pod_id}")
+        
+        return {
+            "cancelled": cancelled,
+            "pod_id": pod_id
+        }
+        
+    except (HTTPException, Overloaded, PoolTimeout):
+        raise
+    except Exception as e:
+        logger.error(f"Error cancelling command for {username}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to cancel command"
         )
-        user_data = cursor.fetchone()
+
+@router.delete("/terminate")
+async def terminate_shell(
+    discard: bool = Query(False),
+    current_user: dict = Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow)
+):
+    """
+    Terminate the user's shell environment and delete the pod
+    
+    With hibernation enabled, the home directory is saved first and restored
+    into the next shell.
+    
+    - **discard**: Delete the saved home directory instead, so the next shell starts empty
+    """
+    try:
+        username = current_user["username"]
         
-        if not user_data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
+        pod_id = await get_user_pod_id(username, db)
         
-        pod_id = user_data.get('shell_pod_id')
+        if discard and k8s_service.hibernator.enabled:
+            await run_exec(k8s_service.hibernator.discard, username)
         
         if pod_id:
             try:
-                k8s_service.delete_pod(pod_id)
+                if discard:
+                    await run_k8s(k8s_service.delete_pod, pod_id)
+                else:
+                    await run_exec(k8s_service.hibernate_pod, pod_id)
                 logger.info(f"Terminated pod {pod_id} for user {username}")
             except Exception as e:
                 logger.error(f"Failed to delete pod {pod_id}: {e}")
                 # Continue anyway to clean up database
         
         # Clear pod ID from database
-        cursor.execute(
+        await db.execute(
             "UPDATE users SET shell_pod_id = NULL WHERE username = %s",
             (username,)
         )
-        conn.commit()
+        await user_pod_cache.adelete(username)
         
         return {
             "message": "Shell terminated successfully",
             "pod_id": pod_id
         }
         
-    except HTTPException:
+    except (HTTPException, Overloaded, PoolTimeout):
         raise
     except Exception as e:
         logger.error(f"Error terminating shell for {username}: {e}")
@@ -165,44 +623,39 @@ async def terminate_shell(current_user: dict = Depends(get_current_user)):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to terminate shell"
         )
-    finally:
-        cursor.close()
-        conn.close()
 
 @router.get("/status", response_model=ShellStatus)
-async def get_shell_status(current_user: dict = Depends(get_current_user)):
+async def get_shell_status(current_user: dict = Depends(get_current_user), db: UnitOfWork = Depends(get_uow)):
     """
     Get the status of the user's shell environment
     """
-    conn = Database.get_connection()
-    cursor = conn.cursor(dictionary=True)
-    
     try:
         username = current_user["username"]
         
-        cursor.execute(
-            "SELECT shell_pod_id FROM users WHERE username = %s",
-            (username,)
-        )
-        user_data = cursor.fetchone()
-        
-        if not user_data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
+        # Report startup steps while the pod is being provided
+        provisioning = provisionings.get(username)
+        if provisioning is not None and not provisioning.done:
+            return ShellStatus(
+                pod_id=provisioning.pod_id,
+                status=provisioning.status,
+                created_at=None,
+                provision_id=provisioning.id
             )
         
-        pod_id = user_data.get('shell_pod_id')
+        pod_id = await get_user_pod_id(username, db)
         
         if not pod_id:
+            failed = provisioning is not None and provisioning.status == "Failed"
             return ShellStatus(
                 pod_id=None,
-                status="not_created",
-                created_at=None
+                status="Failed" if failed else "not_created",
+                created_at=None,
+                provision_id=provisioning.id if failed else None,
+                detail=provisioning.detail if failed else None
             )
         
         # Get pod status from Kubernetes
-        pod_status = k8s_service.get_pod_status(pod_id)
+        pod_status = await run_k8s(k8s_service.get_pod_status, pod_id)
         
         return ShellStatus(
             pod_id=pod_id,
@@ -210,7 +663,7 @@ async def get_shell_status(current_user: dict = Depends(get_current_user)):
             created_at=pod_status["created_at"]
         )
         
-    except HTTPException:
+    except (HTTPException, Overloaded, PoolTimeout):
         raise
     except Exception as e:
         logger.error(f"Error getting shell status for {username}: {e}")
@@ -218,6 +671,262 @@ async def get_shell_status(current_user: dict = Depends(get_current_user)):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to get shell status"
         )
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that closes its body generator when the client disconnects.
+    
+    Starlette stops iterating on disconnect but leaves the generator suspended,
+    so its cleanup would otherwise wait for garbage collection.
+    """
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+def _transfer_path(path: str) -> str:
+    """Validate a /files path; relative paths are taken from the pod user's home directory"""
+    path = path.rstrip("/") or "/"
+    if "\0" in path:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid path")
+    return path
+
+async def _stream_request_to_pod(request: Request, pod_id: str, dest: str, transfer: Transfer,
+                                 framing: tuple, gzip: bool):
+    """
+    Stream the request body into a tar extraction in the pod.
+    
+    The body is cut into FILE_CHUNK_BYTES chunks and handed to the exec thread
+    through a bounded queue, so a slow pod slows down reading the request
+    instead of growing backend memory. framing is the (header, trailer) that
+    turns a single file into an archive, or empty bytes for archive bodies.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(maxsize=FILE_QUEUE_CHUNKS)
+    header, trailer = framing
+    
+    def next_chunk():
+        item = asyncio.run_coroutine_threadsafe(chunks.get(), loop).result()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+    
+    execution = asyncio.ensure_future(run_exec(
+        k8s_service.upload_archive,
+        pod_id, dest, len(header) + transfer.bytes_total + len(trailer), next_chunk, gzip
+    ))
+    
+    async def put(item):
+        # Give up if the extraction ended early (e.g. tar rejected the archive)
+        putting = asyncio.ensure_future(chunks.put(item))
+        await asyncio.wait((putting, execution), return_when=asyncio.FIRST_COMPLETED)
+        if not putting.done():
+            putting.cancel()
+            await execution
+            raise FileTransferError("Transfer ended before the whole body was sent")
+    
+    pending = bytearray(header)
+    try:
+        async for data in request.stream():
+            transfer.bytes_transferred += len(data)
+            if transfer.bytes_transferred > transfer.bytes_total:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Request body is longer than its Content-Length"
+                )
+            pending += data
+            while len(pending) >= settings.FILE_CHUNK_BYTES:
+                await put(bytes(pending[:settings.FILE_CHUNK_BYTES]))
+                del pending[:settings.FILE_CHUNK_BYTES]
+        if transfer.bytes_transferred < transfer.bytes_total:
+            raise FileTransferError("Request body is shorter than its Content-Length")
+        pending += trailer
+        while pending:
+            await put(bytes(pending[:settings.FILE_CHUNK_BYTES]))
+            del pending[:settings.FILE_CHUNK_BYTES]
+        await put(None)
+    except BaseException as e:
+        # Client went away or the body was wrong: make the exec thread abort the extraction
+        if not execution.done():
+            while not chunks.empty():
+                chunks.get_nowait()
+            chunks.put_nowait(e if isinstance(e, Exception) else FileTransferError("Upload aborted"))
+            try:
+                await execution
+            except Exception:
+                pass  # Already reported through the original error
+        raise
+    
+    await execution
+
+@router.put("/files", response_model=FileTransferResponse)
+async def upload_file(
+    request: Request,
+    path: str = Query(..., min_length=1, max_length=4096),
+    archive: bool = Query(False),
+    gzip: bool = Query(False),
+    current_user: dict = Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow)
+):
+    """
+    Upload a file, or a tar archive to extract, into the user's shell environment
+    
+    The request body is streamed into `tar -x` in the pod as it arrives and is
+    never held whole in the backend. Content-Length is required and capped at
+    MAX_UPLOAD_BYTES. Progress is reported by /files/progress.
+    
+    - **path**: Destination file, or with **archive** the directory to extract into; relative to the home directory
+    - **archive**: The body is a tar archive
+    - **gzip**: The archive is gzip-compressed
+    """
+    username = current_user["username"]
+    path = _transfer_path(path)
+    if gzip and not archive:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="gzip requires archive")
+    
+    try:
+        size = int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=status.HTTP_411_LENGTH_REQUIRED, detail="Content-Length is required")
+    if size > settings.MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Uploads are limited to {settings.MAX_UPLOAD_BYTES} bytes"
+        )
+    
+    if archive:
+        dest, framing = path, (b"", b"")
+    else:
+        dest, framing = posixpath.dirname(path) or ".", single_file_framing(posixpath.basename(path), size)
+    
+    pod_id = await get_or_create_user_pod(username, db)
+    await _record_command_activity(username, db)
+    
+    transfer = transfers.start(username, "upload", path, size)
+    try:
+        await _stream_request_to_pod(request, pod_id, dest, transfer, framing, gzip)
+        transfers.finish(transfer, "completed")
+    except FileTransferError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except (HTTPException, Overloaded, PoolTimeout):
+        raise
+    except Exception as e:
+        logger.error(f"Upload failed for {username}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="File transfer failed"
+        )
     finally:
-        cursor.close()
-        conn.close()
+        if transfer.status == "running":
+            transfers.finish(transfer, "failed")
+    
+    FILE_TRANSFER_BYTES.labels("upload").inc(size)
+    logger.info(f"Uploaded {size} bytes to {path} for {username} in pod {pod_id}")
+    return FileTransferResponse(**transfer.to_dict())
+
+@router.get("/files")
+async def download_file(
+    path: str = Query(..., min_length=1, max_length=4096),
+    gzip: bool = Query(False),
+    current_user: dict = Depends(get_current_user),
+    db: UnitOfWork = Depends(get_uow)
+):
+    """
+    Download a file or directory from the user's shell environment as a tar archive
+    
+    The archive is streamed out of `tar -c` in the pod as it is produced, so
+    Content-Length is unknown; X-Archive-Size-Estimate gives the source's
+    disk usage and X-Transfer-Id the transfer to follow on /files/progress.
+    Sources over MAX_DOWNLOAD_BYTES are refused.
+    
+    - **path**: File or directory, relative to the home directory
+    - **gzip**: Compress the archive in the pod
+    """
+    username = current_user["username"]
+    path = _transfer_path(path)
+    
+    pod_id = await get_user_pod_id(username, db)
+    if not pod_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No shell environment found")
+    
+    try:
+        size = await run_exec(k8s_service.measure_path, pod_id, path)
+    except FileTransferError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except (Overloaded, PoolTimeout):
+        raise
+    except Exception as e:
+        logger.error(f"Download failed for {username}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="File transfer failed"
+        )
+    if size > settings.MAX_DOWNLOAD_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Downloads are limited to {settings.MAX_DOWNLOAD_BYTES} bytes"
+        )
+    
+    transfer = transfers.start(username, "download", path, size)
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(maxsize=FILE_QUEUE_CHUNKS)
+    abandoned = threading.Event()
+    
+    def on_chunk(data: bytes):
+        if abandoned.is_set():
+            raise FileTransferError("Client disconnected")
+        asyncio.run_coroutine_threadsafe(chunks.put(data), loop).result()
+    
+    def run():
+        try:
+            k8s_service.download_archive(pod_id, path, on_chunk, gzip)
+        finally:
+            asyncio.run_coroutine_threadsafe(chunks.put(None), loop).result()
+    
+    async def body():
+        execution = asyncio.ensure_future(run_exec(run))
+        try:
+            while True:
+                data = await chunks.get()
+                if data is None:
+                    break
+                transfer.bytes_transferred += len(data)
+                FILE_TRANSFER_BYTES.labels("download").inc(len(data))
+                yield data
+            await execution
+        except BaseException as e:
+            # The client went away or tar failed mid-archive; the client sees a truncated body.
+            # After the queue is emptied the exec thread can finish at most one pending
+            # put, then stops at the next chunk, so nothing here needs to await (the
+            # response's cancel scope would interrupt it).
+            transfers.finish(transfer, "failed")
+            abandoned.set()
+            while not chunks.empty():
+                chunks.get_nowait()
+            execution.add_done_callback(lambda done: done.cancelled() or done.exception())
+            if isinstance(e, Exception):
+                logger.warning(f"Download of {path} failed for {username}: {e}")
+            raise
+        transfers.finish(transfer, "completed")
+        logger.info(f"Downloaded {path} ({transfer.bytes_transferred} bytes) for {username} from pod {pod_id}")
+    
+    filename = (posixpath.basename(path) or "root") + (".tar.gz" if gzip else ".tar")
+    return _ClosingStreamingResponse(
+        body(),
+        media_type="application/gzip" if gzip else "application/x-tar",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Archive-Size-Estimate": str(size),
+            "X-Transfer-Id": transfer.id,
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@router.get("/files/progress", response_model=List[FileTransferResponse])
+async def file_transfer_progress(current_user: dict = Depends(get_current_user)):
+    """
+    Progress of the user's running and recently finished file transfers
+    """
+    return [FileTransferResponse(**transfer.to_dict()) for transfer in transfers.list(current_user["username"])]
@@ -0,0 +1,175 @@
+from app.core.config import settings
+from typing import List, Optional
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Deny rules used when COMMAND_POLICY_FILE is not set
+DEFAULT_DENY_RULES = [
+    r'rm\s+-rf\s+/',  # Recursive force delete from root
+    r':\(\)\{.*\};:',  # Fork bomb
+    r'mkfs',  # Format filesystem
+    r'dd\s+if=/dev/zero',  # Disk wipe
+    r'>\s*/dev/sd',  # Write to disk
+    r'chmod\s+-R\s+777',  # Dangerous permissions
+]
+
+def load_rules(path: str) -> List[str]:
+    """Read deny rules from a file: one regex per line, blank lines and # comments ignored"""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+# Characters that end a rule's literal prefix
+_REGEX_SPECIAL = set(".^$*+?{}[]()|")
+_QUANTIFIERS = set("*?{")
+
+def literal_prefix(rule: str) -> str:
+    """
+    The literal text every match of rule starts with, lowercased ("" if none).
+
+    Stops at the first construct that is not a plain character; a character
+    made optional by a following quantifier is dropped.
+    """
+    if "|" in rule:
+        return ""  # An alternation may have no common prefix
+    prefix = []
+    i = 0
+    while i < len(rule):
+        ch = rule[i]
+        if ch == "\\":
+            # Escaped punctuation is literal; letters and digits are classes, anchors or references
+            if i + 1 >= len(rule) or rule[i + 1].isalnum():
+                break
+            ch, step = rule[i + 1], 2
+        elif ch in _REGEX_SPECIAL:
+            break
+        else:
+            step = 1
+        if rule[i + step:i + step + 1] in _QUANTIFIERS:
+            break
+        prefix.append(ch)
+        i += step
+    return "".join(prefix).lower()
+
+class RuleMatcher:
+    """
+    Finds whether any of a set of regex rules matches, in time independent of the rule count.
+
+    Rules are indexed by their literal prefix in a trie. A lookahead regex built
+    from the trie finds the positions where some prefix starts in one C-level
+    scan, costing at most the alphabet size per position; only rules whose
+    prefix occurs there are tried, anchored at that position. Rules without a
+    literal prefix share one alternation searched once.
+    """
+
+    def __init__(self, rules: List[str]):
+        self._trie = {}
+        fallback = []
+        for rule in rules:
+            prefix = literal_prefix(rule)
+            if not prefix:
+                fallback.append(rule)
+                continue
+            node = self._trie
+            for ch in prefix:
+                node = node.setdefault(ch, {})
+            node.setdefault(None, []).append(re.compile(rule, re.IGNORECASE))
+        self._starts = re.compile(f"(?={self._trie_pattern(self._trie)})") if self._trie else None
+        self._fallback = (
+            re.compile("|".join(f"(?:{rule})" for rule in fallback), re.IGNORECASE) if fallback else None
+        )
+        self._all = re.compile("|".join(f"(?:{rule})" for rule in rules), re.IGNORECASE) if rules else None
+
+    @classmethod
+    def _trie_pattern(cls, node: dict) -> str:
+        if None in node:
+            return ""  # A shorter prefix already ends here
+        branches = [re.escape(ch) + cls._trie_pattern(child) for ch, child in sorted(node.items())]
+        return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+    def search(self, command: str) -> bool:
+        text = command.lower()
+        if len(text) != len(command):
+            # Case folding changed offsets; match the plain alternation instead
+            return self._all is not None and self._all.search(command) is not None
+        if self._fallback is not None and self._fallback.search(text):
+            return True
+        if self._starts is None:
+            return False
+        for start in self._starts.finditer(text):
+            pos = start.start()
+            node = self._trie
+            for ch in text[pos:]:
+                node = node.get(ch)
+                if node is None:
+                    break
+                for rule in node.get(None, ()):
+                    if rule.match(text, pos):
+                        return True
+        return False
+
+def compile_rules(rules: List[str]) -> RuleMatcher:
+    """Validate deny rules, reporting a bad one by name, and build their matcher"""
+    for rule in rules:
+        try:
+            re.compile(rule)
+        except re.error as e:
+            raise ValueError(f"Invalid command policy rule {rule!r}: {e}")
+    return RuleMatcher(rules)
+
+class CommandPolicy:
+    """
+    Deny-list of command patterns, matched in a single pass.
+
+    Rules are compiled once into a RuleMatcher, so a check costs about the
+    same with hundreds of rules as with a handful. When loaded from a
+    file, the file's mtime is checked at most every reload_interval seconds
+    and the rules are recompiled when it changes; a file that fails to load
+    or compile leaves the previous rules in place.
+    """
+
+    def __init__(self, path: Optional[str] = None, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self.rules = DEFAULT_DENY_RULES
+        self._matcher = compile_rules(self.rules)
+        if path:
+            self._reload()
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return
+            rules = load_rules(self.path)
+            matcher = compile_rules(rules)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load command policy from {self.path}, keeping current rules: {e}")
+            return
+        self.rules, self._matcher, self._mtime = rules, matcher, mtime
+        logger.info(f"Loaded {len(rules)} command policy rules from {self.path}")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.reload_interval
+            self._reload()
+        finally:
+            self._lock.release()
+
+    def is_denied(self, command: str) -> bool:
+        """Whether any deny rule matches the command"""
+        if self.path:
+            self._maybe_reload()
+        return self._matcher.search(command)
+
+command_policy = CommandPolicy(settings.COMMAND_POLICY_FILE, settings.COMMAND_POLICY_RELOAD_SECONDS)
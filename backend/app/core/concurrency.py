@@ -0,0 +1,206 @@
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.core.config import settings
+from app.core.metrics import HASH_PENDING, HASH_REJECTIONS, ADMISSION_PENDING, ADMISSION_REJECTIONS
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+
+logger = logging.getLogger(__name__)
+
+# Kinds of blocking work, each with its own bounded pool so that a burst of
+# one kind (e.g. long exec streams) cannot starve the others. Password
+# hashing is CPU-bound, so it gets worker processes instead of threads.
+DB = "db"
+K8S = "k8s"
+EXEC = "exec"
+HASH = "hash"
+
+_pool_sizes = {
+    DB: lambda: settings.DB_THREADS,
+    K8S: lambda: settings.K8S_API_THREADS,
+    EXEC: lambda: settings.EXEC_THREADS,
+    HASH: lambda: settings.HASH_WORKERS or available_cpus(),
+}
+
+_executors = {}
+
+# Hashing calls submitted to the process pool and not yet finished
+_hash_pending = 0
+
+class Overloaded(Exception):
+    """Work was rejected up front because its queue is full"""
+
+    def __init__(self, kind: str, retry_after: int = 1):
+        super().__init__(f"Too much queued {kind} work")
+        self.kind = kind
+        self.retry_after = retry_after
+
+class AdmissionQueue:
+    """
+    Async limit on concurrent work of one kind, admitting waiters in arrival order.
+
+    Up to limit holders run at once and up to max_waiting more wait in a FIFO
+    queue; beyond that, entering raises Overloaded right away so callers can be
+    told to retry later instead of piling up.
+    """
+
+    def __init__(self, kind: str, limit: int, max_waiting: int, retry_after: int = 1):
+        self.kind = kind
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.retry_after = retry_after
+        self._active = 0
+        self._waiters = deque()
+
+    @property
+    def pending(self) -> int:
+        return self._active + len(self._waiters)
+
+    async def __aenter__(self):
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+        else:
+            if len(self._waiters) >= self.max_waiting:
+                ADMISSION_REJECTIONS.labels(self.kind).inc()
+                raise Overloaded(self.kind, self.retry_after)
+            
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just before cancellation; pass it on
+                    self._release()
+                else:
+                    self._waiters.remove(waiter)
+                raise
+        ADMISSION_PENDING.labels(self.kind).set(self.pending)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._release()
+
+    def _release(self):
+        # Hand the slot straight to the longest waiter so late arrivals cannot jump the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+        else:
+            self._active -= 1
+        ADMISSION_PENDING.labels(self.kind).set(self.pending)
+
+class SingleFlight:
+    """
+    Collapses concurrent async calls for the same key into one.
+
+    The first caller starts the call as a task; callers arriving while it runs
+    await the same result. A caller being cancelled does not cancel the call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key: str, func):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here in case every caller went away
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def get_executor(kind: str) -> Executor:
+    """Get or create the pool for a kind of blocking work"""
+    executor = _executors.get(kind)
+    if executor is None:
+        if kind == HASH:
+            # spawn rather than fork: the parent runs watch and exec threads
+            executor = ProcessPoolExecutor(
+                max_workers=_pool_sizes[kind](),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            executor = ThreadPoolExecutor(
+                max_workers=_pool_sizes[kind](),
+                thread_name_prefix=f"tempshell-{kind}"
+            )
+        _executors[kind] = executor
+    return executor
+
+async def run_blocking(kind: str, func, *args, **kwargs):
+    """Run a blocking call in the pool for its kind without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(kind),
+        functools.partial(func, *args, **kwargs)
+    )
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking MySQL call"""
+    return await run_blocking(DB, func, *args, **kwargs)
+
+async def run_k8s(func, *args, **kwargs):
+    """Run a blocking Kubernetes API call"""
+    return await run_blocking(K8S, func, *args, **kwargs)
+
+async def run_exec(func, *args, **kwargs):
+    """Run a blocking pod exec stream"""
+    return await run_blocking(EXEC, func, *args, **kwargs)
+
+async def run_hash(func, *args, **kwargs):
+    """
+    Run a CPU-bound password hashing call in the hashing process pool.
+
+    func must be a picklable module-level function. Raises Overloaded without
+    queueing when HASH_MAX_PENDING calls are already waiting or running, so a
+    login storm is shed quickly instead of piling up behind the workers.
+    """
+    global _hash_pending
+    if _hash_pending >= settings.HASH_MAX_PENDING:
+        HASH_REJECTIONS.inc()
+        raise Overloaded(HASH)
+    
+    _hash_pending += 1
+    HASH_PENDING.inc()
+    try:
+        return await run_blocking(HASH, func, *args, **kwargs)
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool for the next call
+        logger.error("Password hashing pool broke; recreating it")
+        _executors.pop(HASH, None)
+        raise
+    finally:
+        _hash_pending -= 1
+        HASH_PENDING.dec()
+
+def warm_hash_pool():
+    """Start the hashing worker processes ahead of the first login"""
+    executor = get_executor(HASH)
+    for _ in range(_pool_sizes[HASH]()):
+        executor.submit(os.getpid)
+
+def shutdown_executors():
+    """Shut down all blocking-work pools"""
+    for kind, executor in list(_executors.items()):
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"Shut down {kind} executor")
+    _executors.clear()
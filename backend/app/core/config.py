@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 import os
 
 class Settings(BaseSettings):
@@ -13,6 +13,9 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    JWT_BACKEND: str = "jose"  # "jose" (python-jose) or "pyjwt" (faster verification)
+    JWT_CACHE_MAX_ENTRIES: int = 10000  # 0 disables the decoded-token cache
+    REVOKED_TOKENS_MAX_ENTRIES: int = 100000  # In-process revocation index size (without Redis)
     
     # Database
     DB_HOST: str
@@ -20,6 +23,12 @@ class Settings(BaseSettings):
     DB_PASSWORD: str
     DB_NAME: str
     DB_PORT: int = 3306
+    DB_POOL_MIN_SIZE: int = 2
+    DB_POOL_MAX_SIZE: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 10.0  # Max wait for a free connection before 503
+    DB_POOL_IDLE_SECONDS: float = 300.0  # Close surplus connections idle this long
+    DB_POOL_MAX_LIFETIME_SECONDS: float = 3600.0
+    DB_POOL_PING_AFTER_SECONDS: float = 30.0  # Only ping connections idle longer than this
     
     # Kubernetes
     K8S_NAMESPACE: str = "tempshell"
@@ -30,11 +39,85 @@ class Settings(BaseSettings):
     POD_MEMORY_LIMIT: str = "512Mi"
     POD_TIMEOUT_SECONDS: int = 3600
     
+    # Warm pod pool (0 disables the pool)
+    WARM_POOL_SIZE: int = 2
+    WARM_POOL_REFILL_INTERVAL_SECONDS: int = 10
+    
+    # Idle pod reaping (0 disables the TTL / the cluster-wide pod budget)
+    POD_IDLE_TTL_SECONDS: int = 900
+    MAX_ACTIVE_PODS: int = 0
+    POD_REAPER_INTERVAL_SECONDS: int = 30
+    
+    # Replicas: leader election picks the one running cleanup, reaping and pool refills
+    LEADER_ELECTION_ENABLED: bool = True
+    LEADER_LEASE_NAME: str = "tempshell-backend-leader"
+    LEADER_LEASE_DURATION_SECONDS: int = 15
+    REPLICA_NAME: Optional[str] = None  # This replica's pod name (downward API); defaults to hostname
+    REPLICA_IP: Optional[str] = None  # This replica's pod IP; set to send cache invalidations to peers
+    REPLICA_LABEL_SELECTOR: str = "app=tempshell-backend"
+    
+    # Start the user's pod at login: off, recent (users who ran commands in
+    # their previous session) or always
+    PREPROVISION_ON_LOGIN: str = "recent"
+    
+    # Pod creation admission: concurrent creations, and creations queued before 503
+    POD_CREATE_CONCURRENCY: int = 8
+    POD_CREATE_MAX_QUEUE: int = 64
+    
+    # Blocking work thread pools (sized separately so one kind cannot starve another)
+    DB_THREADS: int = 10
+    K8S_API_THREADS: int = 8
+    EXEC_THREADS: int = 32
+    HASH_WORKERS: int = 0  # 0 = one worker process per available CPU
+    HASH_MAX_PENDING: int = 32
+    
+    # Persistent exec sessions (one long-lived shell per pod)
+    EXEC_SESSIONS_ENABLED: bool = True
+    EXEC_SESSION_IDLE_SECONDS: int = 300
+    
+    # Command execution deadlines (the default applies when a request sets none)
+    COMMAND_TIMEOUT_SECONDS: int = 30
+    COMMAND_TIMEOUT_MAX_SECONDS: int = 300
+    MAX_BATCH_COMMANDS: int = 50
+    BATCH_TIMEOUT_SECONDS: int = 600  # Whole batch; later commands get what is left
+    
+    # Command deny rules: a file of regexes, one per line, reloaded when it changes
+    COMMAND_POLICY_FILE: Optional[str] = None  # None uses the built-in rules
+    COMMAND_POLICY_RELOAD_SECONDS: float = 5.0
+    
+    # Maximum output captured per channel for buffered /execute responses
+    MAX_OUTPUT_BYTES: int = 1048576
+    
+    # Output frames buffered per streaming command before the exec stream is paused
+    STREAM_QUEUE_FRAMES: int = 64
+    
+    # File transfers (/shell/files): body chunk size, size caps and a deadline per transfer
+    FILE_CHUNK_BYTES: int = 65536
+    MAX_UPLOAD_BYTES: int = 104857600
+    MAX_DOWNLOAD_BYTES: int = 104857600  # Checked against the source's disk usage before streaming
+    FILE_TRANSFER_TIMEOUT_SECONDS: int = 600
+    
+    # Hibernation: snapshot home directories before pods are deleted and restore them
+    # into the user's next pod (touched files up to RESTORE_EAGER_BYTES first)
+    HIBERNATE_ENABLED: bool = False
+    SNAPSHOT_DIR: str = "/var/lib/tempshell/snapshots"  # Shared by replicas (ReadWriteMany volume)
+    SNAPSHOT_MAX_BYTES: int = 268435456  # Larger home directories are not kept
+    RESTORE_EAGER_BYTES: int = 16777216
+    SNAPSHOT_RETENTION_DAYS: int = 30
+    
+    # Username -> shell pod cache; set REDIS_URL to share caches between replicas
+    POD_CACHE_TTL_SECONDS: int = 300
+    POD_CACHE_MAX_ENTRIES: int = 10000
+    REDIS_URL: Optional[str] = None
+    
     # CORS - Parse from string to list
     CORS_ORIGINS: List[str] = ["http://localhost:3000"]
     
-    # Rate Limiting
-    RATE_LIMIT_PER_MINUTE: int = 60
+    # Rate Limiting (token buckets, requests per minute; 0 disables a bucket)
+    RATE_LIMIT_PER_MINUTE: int = 60  # Command executions per user
+    RATE_LIMIT_IP_PER_MINUTE: int = 600  # Command executions per client IP
+    RATE_LIMIT_AUTH_PER_MINUTE: int = 20  # Signup/login/refresh per client IP
+    RATE_LIMIT_POD_CREATE_PER_MINUTE: int = 5  # Pod creations per user
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,183 @@
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+)
+from prometheus_client import multiprocess
+import os
+import time
+
+# Buckets for operations ranging from sub-millisecond cache-backed requests
+# up to pod creation waits of a minute
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+BYTES_BUCKETS = (0, 64, 512, 4096, 32768, 262144, 1048576, 4194304)
+
+REQUEST_LATENCY = Histogram(
+    "tempshell_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+
+POD_CREATE_SECONDS = Histogram(
+    "tempshell_pod_create_seconds",
+    "Time spent creating user pods, split into API create and wait-for-ready",
+    ["phase"],
+    buckets=LATENCY_BUCKETS
+)
+
+WARM_POOL_CLAIMS = Counter(
+    "tempshell_warm_pool_claims_total",
+    "Warm pool claim attempts by result",
+    ["result"]
+)
+
+EXEC_SECONDS = Histogram(
+    "tempshell_exec_duration_seconds",
+    "Command execution time in pods by outcome",
+    ["outcome"],
+    buckets=LATENCY_BUCKETS
+)
+
+EXEC_OUTPUT_BYTES = Histogram(
+    "tempshell_exec_output_bytes",
+    "Output bytes produced per buffered command, including truncated bytes",
+    buckets=BYTES_BUCKETS
+)
+
+FILE_TRANSFER_BYTES = Counter(
+    "tempshell_file_transfer_bytes_total",
+    "Archive bytes streamed to and from pods by /shell/files, by direction",
+    ["direction"]
+)
+
+PODS_REAPED = Counter(
+    "tempshell_pods_reaped_total",
+    "User pods deleted by the reaper, by reason (idle, evicted over budget, or expiring)",
+    ["reason"]
+)
+
+HIBERNATE_SECONDS = Histogram(
+    "tempshell_hibernate_seconds",
+    "Home directory snapshot and restore time, by operation "
+    "(snapshot, restore_hot before the pod is handed out, restore_cold after)",
+    ["operation"],
+    buckets=LATENCY_BUCKETS
+)
+
+SNAPSHOT_BYTES = Counter(
+    "tempshell_snapshot_bytes_total",
+    "File bytes in home directory snapshots, by result (stored as new blobs or deduplicated)",
+    ["result"]
+)
+
+SPECULATIVE_PODS = Counter(
+    "tempshell_speculative_pods_total",
+    "Pods provisioned speculatively at login, by outcome "
+    "(started, reused an existing pod, used by a command, reaped unused)",
+    ["outcome"]
+)
+
+DB_POOL_WAIT_SECONDS = Histogram(
+    "tempshell_db_pool_wait_seconds",
+    "Time spent checking out a MySQL connection from the pool",
+    buckets=LATENCY_BUCKETS
+)
+
+DB_CHECKOUT_FAILURES = Counter(
+    "tempshell_db_checkout_failures_total",
+    "Failed MySQL connection checkouts"
+)
+
+PASSWORD_HASH_SECONDS = Histogram(
+    "tempshell_password_hash_seconds",
+    "bcrypt time by operation, including time queued for a worker process",
+    ["operation"],
+    buckets=LATENCY_BUCKETS
+)
+
+HASH_PENDING = Gauge(
+    "tempshell_password_hash_pending",
+    "Password hashing calls queued or running in the process pool",
+    multiprocess_mode="livesum"
+)
+
+HASH_REJECTIONS = Counter(
+    "tempshell_password_hash_rejections_total",
+    "Password hashing calls rejected because the queue was full"
+)
+
+ADMISSION_PENDING = Gauge(
+    "tempshell_admission_pending",
+    "Admission-controlled operations running or queued, by kind",
+    ["kind"],
+    multiprocess_mode="livesum"
+)
+
+ADMISSION_REJECTIONS = Counter(
+    "tempshell_admission_rejections_total",
+    "Operations rejected because their admission queue was full, by kind",
+    ["kind"]
+)
+
+RATE_LIMITED = Counter(
+    "tempshell_rate_limited_total",
+    "Requests rejected by the rate limiter, by budget and bucket scope",
+    ["budget", "scope"]
+)
+
+CACHE_LOOKUPS = Counter(
+    "tempshell_cache_lookups_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"]
+)
+
+ACTIVE_PODS = Gauge(
+    "tempshell_active_pods",
+    "Running shell pods assigned to users",
+    multiprocess_mode="max"
+)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route HTTP latency.
+
+    Routes are labeled by their path template (e.g. /api/v1/shell/execute)
+    so label cardinality stays bounded. WebSocket traffic is passed through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status_code)
+            ).observe(time.perf_counter() - start)
+
+def render_metrics() -> tuple:
+    """Render metrics in the Prometheus text format, aggregating worker processes when configured"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,256 @@
+from fastapi import status
+from fastapi.responses import JSONResponse
+from typing import Optional
+from app.core.config import settings
+from app.core.concurrency import Overloaded, run_db
+from app.core.metrics import RATE_LIMITED
+from app.core.security import authenticate_token
+from app.services.cache import get_redis_client
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Budgets as (per-user, per-IP) requests per minute; 0 disables that bucket.
+# Each bucket holds a minute's worth of tokens, so bursts up to the budget pass.
+BUDGETS = {
+    "auth": lambda: (0, settings.RATE_LIMIT_AUTH_PER_MINUTE),
+    "execute": lambda: (settings.RATE_LIMIT_PER_MINUTE, settings.RATE_LIMIT_IP_PER_MINUTE),
+    "pod_create": lambda: (settings.RATE_LIMIT_POD_CREATE_PER_MINUTE, 0),
+}
+
+# Routes limited by the middleware; pod creation is checked where it happens
+ROUTE_BUDGETS = {
+    "/api/v1/auth/signup": "auth",
+    "/api/v1/auth/login": "auth",
+    "/api/v1/auth/refresh": "auth",
+    "/api/v1/shell/execute": "execute",
+    "/api/v1/shell/execute/batch": "execute",
+    "/api/v1/shell/files": "execute",
+}
+
+class RateLimited(Overloaded):
+    """A client used up its request budget"""
+
+    def __init__(self, budget: str, retry_after: int, limit: int):
+        super().__init__(budget, retry_after)
+        self.args = (f"Rate limit exceeded for {budget}",)
+        self.limit = limit
+
+class Decision:
+    """Outcome of taking a token from a bucket"""
+
+    __slots__ = ("allowed", "limit", "remaining", "retry_after")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, retry_after: int):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> dict:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining)
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+class LocalBuckets:
+    """
+    In-process token buckets.
+
+    Each take is O(1): the bucket is refilled lazily from the time since its
+    last update. Buckets that have refilled completely are indistinguishable
+    from new ones, so a sweep every evict_interval seconds drops them.
+    """
+
+    blocking = False
+
+    def __init__(self, evict_interval: float = 60.0):
+        self.evict_interval = evict_interval
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + evict_interval
+
+    def take(self, key: str, per_minute: int) -> Decision:
+        now = time.monotonic()
+        refill = per_minute / 60.0
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (per_minute, now, per_minute))
+            tokens = min(per_minute, tokens + (now - updated) * refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, per_minute)
+            if now >= self._next_sweep:
+                self._sweep(now)
+        return Decision(allowed, per_minute, int(tokens), math.ceil((1 - tokens) / refill) if not allowed else 0)
+
+    def _sweep(self, now: float):
+        full = [
+            key for key, (tokens, updated, per_minute) in self._buckets.items()
+            if tokens + (now - updated) * per_minute / 60.0 >= per_minute
+        ]
+        for key in full:
+            del self._buckets[key]
+        self._next_sweep = now + self.evict_interval
+
+# Atomic refill-and-take; the bucket expires once it would be full again
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / refill * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+class RedisBuckets:
+    """
+    Token buckets shared between replicas through Redis.
+
+    A Lua script refills and takes in one round trip. Redis errors let the
+    request through, so an outage disables limiting instead of the API.
+    """
+
+    blocking = True
+
+    def __init__(self, client):
+        self.client = client
+        self._take = client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key: str, per_minute: int) -> Optional[Decision]:
+        refill = per_minute / 60.0
+        try:
+            allowed, tokens = self._take(
+                keys=[f"tempshell:ratelimit:{key}"],
+                args=[per_minute, refill, time.time()]
+            )
+        except Exception as e:
+            logger.warning(f"Redis rate limit check failed: {e}")
+            return None
+        tokens = float(tokens)
+        return Decision(bool(allowed), per_minute, int(tokens), math.ceil((1 - tokens) / refill) if not allowed else 0)
+
+class RateLimiter:
+    """Applies per-user and per-IP budgets on top of a bucket store"""
+
+    def __init__(self, store):
+        self.store = store
+
+    async def _take(self, key: str, per_minute: int) -> Optional[Decision]:
+        if self.store.blocking:
+            return await run_db(self.store.take, key, per_minute)
+        return self.store.take(key, per_minute)
+
+    async def take(self, budget: str, username: Optional[str] = None,
+                   client_ip: Optional[str] = None) -> Optional[Decision]:
+        """
+        Take a token from each bucket that applies and return the tightest decision.
+
+        Returns None when no bucket applies.
+        """
+        per_user, per_ip = BUDGETS[budget]()
+        tightest = None
+        for scope, identity, per_minute in (("user", username, per_user), ("ip", client_ip, per_ip)):
+            if not identity or per_minute <= 0:
+                continue
+            decision = await self._take(f"{budget}:{scope}:{identity}", per_minute)
+            if decision is None:
+                continue
+            if not decision.allowed:
+                RATE_LIMITED.labels(budget, scope).inc()
+                return decision
+            if tightest is None or decision.remaining < tightest.remaining:
+                tightest = decision
+        return tightest
+
+    async def check(self, budget: str, username: Optional[str] = None, client_ip: Optional[str] = None):
+        """Take a token, raising RateLimited when a bucket is empty"""
+        decision = await self.take(budget, username, client_ip)
+        if decision is not None and not decision.allowed:
+            raise RateLimited(budget, decision.retry_after, decision.limit)
+
+def create_bucket_store():
+    """Create buckets shared through Redis when configured, otherwise in-process"""
+    client = get_redis_client()
+    if client is not None:
+        return RedisBuckets(client)
+    return LocalBuckets()
+
+rate_limiter = RateLimiter(create_bucket_store())
+
+def rate_limited_response(exc: RateLimited) -> JSONResponse:
+    """Build the 429 response for a rejected request"""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Rate limit exceeded, please retry later"},
+        headers=Decision(False, exc.limit, 0, exc.retry_after).headers
+    )
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware enforcing ROUTE_BUDGETS.
+
+    The user comes from the bearer token when it is valid (decode_token caches
+    it, so this is cheap) and the IP from the ASGI client, which uvicorn sets
+    from X-Forwarded-For for trusted proxies. Limited routes get
+    X-RateLimit-Limit/Remaining headers; rejected requests get a 429.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        budget = ROUTE_BUDGETS.get(scope.get("path")) if scope["type"] == "http" else None
+        if budget is None or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        decision = await rate_limiter.take(budget, _username(scope), _client_ip(scope))
+        if decision is None:
+            await self.app(scope, receive, send)
+            return
+        if not decision.allowed:
+            response = rate_limited_response(RateLimited(budget, decision.retry_after, decision.limit))
+            await response(scope, receive, send)
+            return
+
+        headers = [(name.lower().encode(), value.encode()) for name, value in decision.headers.items()]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+def _client_ip(scope) -> Optional[str]:
+    client = scope.get("client")
+    return client[0] if client else None
+
+def _username(scope) -> Optional[str]:
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return authenticate_token(token)["username"]
+            except Exception:
+                return None  # The route itself rejects bad tokens
+    return None
@@ -1,12 +1,18 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
+from jose import JWTError
+from jose import jwt as jose_jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.core.config import settings
+from app.core.metrics import PASSWORD_HASH_SECONDS
+from app.core.concurrency import run_hash
+from app.services.cache import LocalCache, revoked_tokens
+import hashlib
 import secrets
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +23,30 @@ pwd_context = CryptContext(
 )
 security = HTTPBearer()
 
+def _load_jwt_backend(name: str):
+    """Get the JWT module and its error class for the configured library"""
+    if name == "pyjwt":
+        try:
+            import jwt as pyjwt
+            return pyjwt, pyjwt.PyJWTError
+        except ImportError:
+            logger.warning("JWT_BACKEND is pyjwt but PyJWT is not installed; using python-jose")
+    elif name != "jose":
+        logger.warning(f"Unknown JWT_BACKEND {name!r}; using python-jose")
+    return jose_jwt, JWTError
+
+# Both libraries share the encode/decode signatures, and tokens signed by
+# one verify with the other, so the backend can be switched at any time
+jwt, _jwt_error = _load_jwt_backend(settings.JWT_BACKEND)
+
+# Validated token payloads keyed by token digest, each kept until its token
+# expires, so repeat requests with the same token skip signature checks
+_token_cache = LocalCache(
+    "jwt",
+    settings.JWT_CACHE_MAX_ENTRIES,
+    settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+) if settings.JWT_CACHE_MAX_ENTRIES > 0 else None
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against a hashed password (auto-truncates to 72 bytes)"""
     # bcrypt will auto-truncate to 72 bytes with truncate_error=False
@@ -36,6 +66,22 @@ def get_password_hash(password: str) -> str:
         logger.error(f"Traceback:\n{traceback.format_exc()}")
         raise
 
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password in the hashing process pool"""
+    start = time.perf_counter()
+    try:
+        return await run_hash(verify_password, plain_password, hashed_password)
+    finally:
+        PASSWORD_HASH_SECONDS.labels("verify").observe(time.perf_counter() - start)
+
+async def aget_password_hash(password: str) -> str:
+    """Hash a password in the hashing process pool"""
+    start = time.perf_counter()
+    try:
+        return await run_hash(get_password_hash, password)
+    finally:
+        PASSWORD_HASH_SECONDS.labels("hash").observe(time.perf_counter() - start)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -65,21 +111,32 @@ def create_refresh_token(data: dict) -> str:
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
 def decode_token(token: str) -> dict:
-    """Decode and validate a JWT token"""
+    """Decode and validate a JWT token, reusing the payload of recently seen tokens"""
+    key = None
+    if _token_cache is not None:
+        key = hashlib.sha256(token.encode()).hexdigest()
+        payload = _token_cache.get(key)
+        if payload is not None:
+            return dict(payload)
+    
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
-    except JWTError as e:
+    except _jwt_error as e:
         logger.warning(f"JWT decode error: {e}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    
+    if key is not None and isinstance(payload.get("exp"), (int, float)):
+        remaining = payload["exp"] - time.time()
+        if remaining > 0:
+            _token_cache.set(key, dict(payload), ttl=remaining)
+    return payload
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Dependency to get the current authenticated user"""
-    token = credentials.credentials
+def authenticate_token(token: str) -> dict:
+    """Validate an access token and return the authenticated user"""
     payload = decode_token(token)
     
     # Validate token type
@@ -97,3 +154,17 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         )
     
     return {"username": username, "payload": payload}
+
+async def revoke_token(payload: dict) -> bool:
+    """
+    Revoke a decoded token by its jti until it expires.
+
+    Returns False if the token was already revoked, so a caller that revokes
+    a refresh token before honouring it can never honour it twice.
+    """
+    remaining = max(1.0, payload.get("exp", 0) - time.time())
+    return await revoked_tokens.aadd(payload["jti"], "1", ttl=remaining)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """Dependency to get the current authenticated user"""
+    return authenticate_token(credentials.credentials)
@@ -1,40 +1,177 @@
 import mysql.connector
-from mysql.connector import pooling
 from app.core.config import settings
+from app.db.pool import ConnectionPool, PoolTimeout
+from app.core.concurrency import run_db
+from app.core.metrics import DB_POOL_WAIT_SECONDS, DB_CHECKOUT_FAILURES
+from typing import Any, Callable, Optional, Sequence
+import asyncio
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 class Database:
     """Database connection pool manager"""
     _connection_pool = None
+    _pool_lock = threading.Lock()
+    
+    @classmethod
+    def _connect(cls):
+        """Open a new MySQL connection"""
+        return mysql.connector.connect(
+            host=settings.DB_HOST,
+            user=settings.DB_USER,
+            password=settings.DB_PASSWORD,
+            database=settings.DB_NAME,
+            port=settings.DB_PORT,
+            auth_plugin='mysql_native_password'
+        )
     
     @classmethod
     def get_pool(cls):
         """Get or create connection pool"""
         if cls._connection_pool is None:
-            try:
-                cls._connection_pool = pooling.MySQLConnectionPool(
-                    pool_name="tempshell_pool",
-                    pool_size=10,
-                    pool_reset_session=True,
-                    host=settings.DB_HOST,
-                    user=settings.DB_USER,
-                    password=settings.DB_PASSWORD,
-                    database=settings.DB_NAME,
-                    port=settings.DB_PORT,
-                    auth_plugin='mysql_native_password'
-                )
-                logger.info("Database connection pool created successfully")
-            except Exception as e:
-                logger.error(f"Failed to create connection pool: {e}")
-                raise
+            with cls._pool_lock:
+                if cls._connection_pool is None:
+                    try:
+                        cls._connection_pool = ConnectionPool(
+                            cls._connect,
+                            min_size=settings.DB_POOL_MIN_SIZE,
+                            max_size=settings.DB_POOL_MAX_SIZE,
+                            timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+                            idle_timeout=settings.DB_POOL_IDLE_SECONDS,
+                            max_lifetime=settings.DB_POOL_MAX_LIFETIME_SECONDS,
+                            ping_after=settings.DB_POOL_PING_AFTER_SECONDS
+                        )
+                        logger.info("Database connection pool created successfully")
+                    except Exception as e:
+                        logger.error(f"Failed to create connection pool: {e}")
+                        raise
         return cls._connection_pool
     
     @classmethod
     def get_connection(cls):
-        """Get a connection from the pool"""
-        return cls.get_pool().get_connection()
+        """Get a connection from the pool, waiting while the pool is saturated"""
+        start = time.perf_counter()
+        try:
+            return cls.get_pool().get_connection()
+        except Exception:
+            DB_CHECKOUT_FAILURES.inc()
+            raise
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+    
+    @classmethod
+    async def acquire(cls):
+        """
+        Get a connection from the pool without blocking a DB thread while it is saturated.
+        
+        Waits on the event loop for a connection to be returned, for up to
+        DB_POOL_TIMEOUT_SECONDS, then raises PoolTimeout.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            pool = await run_db(cls.get_pool)
+            deadline = loop.time() + pool.timeout
+            while True:
+                # Register before trying so a release in between is not missed
+                waiter = pool.register_waiter(loop)
+                conn = await run_db(pool.try_get_connection)
+                if conn is not None:
+                    return conn
+                
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection available within {pool.timeout}s")
+                try:
+                    await asyncio.wait_for(waiter, remaining)
+                except asyncio.TimeoutError:
+                    raise PoolTimeout(f"No database connection available within {pool.timeout}s")
+        except Exception:
+            DB_CHECKOUT_FAILURES.inc()
+            raise
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+    
+    @classmethod
+    def close_pool(cls):
+        """Close idle pooled connections"""
+        if cls._connection_pool is not None:
+            cls._connection_pool.close_all()
+
+# Returned by UnitOfWork statements that found no free connection
+_POOL_EXHAUSTED = object()
+
+class UnitOfWork:
+    """
+    Request-scoped database access that holds a connection only while a statement runs.
+    
+    Each call checks out a pooled connection inside the DB thread that runs
+    the statement, commits writes and returns the connection before leaving
+    that thread, so nothing awaited between calls (pod creation, a command's
+    exec stream, a wait for a DB thread) ties up the pool. Connections in use
+    by requests are thereby bounded by DB_THREADS. Only when the pool is
+    exhausted does it wait for a connection on the event loop.
+    """
+    
+    def __init__(self):
+        self.checkouts = 0
+    
+    async def _run(self, statement: Callable[[Any], Any]):
+        def run(conn=None):
+            if conn is None:
+                conn = Database.get_pool().try_get_connection()
+                if conn is None:
+                    return _POOL_EXHAUSTED
+            try:
+                return statement(conn)
+            finally:
+                conn.close()
+        
+        self.checkouts += 1
+        result = await run_db(run)
+        if result is _POOL_EXHAUSTED:
+            result = await run_db(run, await Database.acquire())
+        return result
+    
+    async def fetchone(self, sql: str, params: Sequence = ()) -> Optional[dict]:
+        """Run a query and return its first row as a dict"""
+        def statement(conn):
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute(sql, params)
+                return cursor.fetchone()
+            finally:
+                cursor.close()
+        
+        return await self._run(statement)
+    
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        """Run and commit a write, returning the number of affected rows"""
+        def statement(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                conn.commit()
+                return cursor.rowcount
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        
+        return await self._run(statement)
+
+def get_uow() -> UnitOfWork:
+    """FastAPI dependency giving each request its own UnitOfWork"""
+    return UnitOfWork()
+
+# (column, definition) for existing users tables missing them
+ADDED_USER_COLUMNS = [
+    ("last_command_at", "TIMESTAMP NULL AFTER last_login"),  # Last session's first command
+]
 
 def init_db():
     """Initialize database tables"""
@@ -54,6 +191,7 @@ def init_db():
             shell_pod_id VARCHAR(100) DEFAULT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             last_login TIMESTAMP NULL,
+            last_command_at TIMESTAMP NULL,
             is_active BOOLEAN DEFAULT TRUE,
             failed_login_attempts INT DEFAULT 0,
             locked_until TIMESTAMP NULL,
@@ -63,6 +201,17 @@ def init_db():
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
         """
         cursor.execute(create_table_sql)
+        
+        # Columns added after the table was first created
+        for column, definition in ADDED_USER_COLUMNS:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users' AND COLUMN_NAME = %s",
+                (column,)
+            )
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
+                logger.info(f"Added column users.{column}")
         conn.commit()
         logger.info("Database tables initialized successfully")
         
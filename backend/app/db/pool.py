@@ -0,0 +1,207 @@
+from collections import deque
+from typing import Callable, Optional
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout"""
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+class PooledConnection:
+    """
+    Proxy handed out by ConnectionPool.
+
+    Behaves like the underlying connection, except that close() returns it
+    to the pool instead of disconnecting.
+    """
+
+    def __init__(self, pool: "ConnectionPool", conn, created_at: float):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if not self._returned:
+            self._returned = True
+            self._pool._release(self._conn, self._created_at)
+
+class ConnectionPool:
+    """
+    Bounded connection pool that queues callers instead of failing.
+
+    - Opens connections on demand up to max_size, keeping at least min_size.
+    - Callers that find the pool exhausted wait up to `timeout` seconds.
+    - Idle connections are handed out most-recently-used first, so surplus
+      connections age out and are closed after `idle_timeout` seconds.
+    - A connection is pinged only if it sat idle longer than `ping_after`.
+    - On return, an open transaction is rolled back; otherwise the connection
+      goes straight back without a session reset round trip.
+    """
+
+    def __init__(self, connect: Callable, min_size: int, max_size: int, timeout: float,
+                 idle_timeout: float, max_lifetime: float, ping_after: float):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+
+        self._idle = deque()  # (conn, created_at, returned_at)
+        self._size = 0
+        self._waiting = 0
+        self._async_waiters = []
+        self._available = threading.Condition()
+
+        for _ in range(min_size):
+            conn = self._connect()
+            self._size += 1
+            self._idle.append((conn, time.monotonic(), time.monotonic()))
+
+    def stats(self) -> dict:
+        with self._available:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting + len(self._async_waiters)
+            }
+
+    def try_get_connection(self) -> Optional[PooledConnection]:
+        """Check out a connection without waiting; returns None while the pool is exhausted"""
+        while True:
+            with self._available:
+                if self._idle:
+                    conn, created_at, returned_at = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                else:
+                    return None
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+                return PooledConnection(self, conn, time.monotonic())
+
+            if self._usable(conn, created_at, returned_at):
+                return PooledConnection(self, conn, created_at)
+            self._discard(conn)
+
+    def register_waiter(self, loop: asyncio.AbstractEventLoop) -> asyncio.Future:
+        """
+        Get a future that resolves the next time a connection is returned.
+
+        Lets coroutines wait for a connection on the event loop instead of
+        blocking a thread, so connection holders keep their threads for SQL.
+        """
+        future = loop.create_future()
+        with self._available:
+            self._async_waiters.append((loop, future))
+        return future
+
+    def _wake_async_waiters(self):
+        """Wake every registered coroutine; the ones that lose the race register again"""
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def get_connection(self) -> PooledConnection:
+        """Check out a connection, blocking up to the pool timeout when all are in use"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn = self.try_get_connection()
+            if conn is not None:
+                return conn
+
+            with self._available:
+                if self._idle or self._size < self.max_size:
+                    continue  # Freed up since the attempt above
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"No database connection available within {self.timeout}s "
+                        f"({self._size} in use)"
+                    )
+                self._waiting += 1
+                try:
+                    self._available.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+    def _usable(self, conn, created_at: float, returned_at: float) -> bool:
+        """Check an idle connection, pinging only if it has been idle a while"""
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            return False
+        if now - returned_at > self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception as e:
+                logger.info(f"Dropping dead pooled connection: {e}")
+                return False
+        return True
+
+    def _release(self, conn, created_at: float):
+        """Return a connection to the pool"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception as e:
+            logger.info(f"Dropping pooled connection after failed rollback: {e}")
+            self._discard(conn)
+            return
+
+        stale = []
+        now = time.monotonic()
+        with self._available:
+            self._idle.append((conn, created_at, now))
+            # Oldest idle connections sit at the left; trim those past idle_timeout
+            while (self._idle and self._size > self.min_size
+                   and now - self._idle[0][2] > self.idle_timeout):
+                stale.append(self._idle.popleft()[0])
+                self._size -= 1
+            self._available.notify()
+            self._wake_async_waiters()
+
+        for old in stale:
+            self._close_quietly(old)
+
+    def _discard(self, conn):
+        """Drop a connection and free its slot"""
+        with self._available:
+            self._size -= 1
+            self._available.notify()
+            self._wake_async_waiters()
+        if conn is not None:
+            self._close_quietly(conn)
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Close idle connections (used at shutdown)"""
+        with self._available:
+            idle = [entry[0] for entry in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close_quietly(conn)
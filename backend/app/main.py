@@ -1,10 +1,17 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from app.core.config import settings
-from app.api.v1 import auth, shell
-from app.db.database import init_db
-from app.services.k8s_service import K8sService
+from app.api.v1 import auth, shell, internal
+from app.db.database import Database, init_db
+from app.db.pool import PoolTimeout
+from app.core.concurrency import shutdown_executors, run_k8s, warm_hash_pool, Overloaded
+from app.core.metrics import MetricsMiddleware, ACTIVE_PODS, render_metrics
+from app.core.rate_limit import RateLimitMiddleware, RateLimited, rate_limited_response
+from app.api.v1.shell import k8s_service, detach_reaped_pods
+from app.services.cache import user_pod_cache, LocalCache
+from app.services.invalidation import InvalidationBroadcaster
 import logging
 
 logging.basicConfig(
@@ -19,17 +26,48 @@ async def lifespan(app: FastAPI):
     logger.info("Initializing database...")
     init_db()
     
-    # Cleanup old shell pods
-    logger.info("Cleaning up old shell pods...")
-    k8s_service = K8sService()
-    k8s_service.cleanup_old_pods()
+    # Serve pod status from a watch instead of per-request API reads
+    k8s_service.start_pod_cache()
+    
+    # Reap idle persistent exec sessions
+    k8s_service.start_exec_sessions()
+    
+    # One replica cleans up old shell pods, reaps and refills the warm pool; the
+    # loops below wait for the election to pick it
+    k8s_service.start_leader_election(on_started_leading=k8s_service.cleanup_old_pods)
+    
+    # Keep pre-provisioned pods ready for first commands
+    k8s_service.start_warm_pool()
+    
+    # Free capacity held by idle pods
+    k8s_service.start_pod_reaper(detach_reaped_pods)
+    
+    # Tell other replicas when a user's pod changes so their local caches follow
+    if isinstance(user_pod_cache, LocalCache) and k8s_service.enabled and settings.REPLICA_IP:
+        user_pod_cache.on_delete = InvalidationBroadcaster(
+            k8s_service.v1,
+            settings.K8S_NAMESPACE,
+            settings.REPLICA_LABEL_SELECTOR,
+            settings.REPLICA_IP
+        ).publish
+    
+    # Spawn password hashing workers before the first login needs them
+    warm_hash_pool()
     
     logger.info("Application startup complete")
 
     yield    # <-- yaha app start hoti hai
     
     # Shutdown
-    k8s_service.cleanup_old_pods()
+    k8s_service.stop_pod_reaper()
+    k8s_service.stop_warm_pool()
+    k8s_service.stop_exec_sessions()
+    k8s_service.stop_pod_cache()
+    if k8s_service.is_leader():
+        k8s_service.cleanup_old_pods()
+    k8s_service.stop_leader_election()
+    shutdown_executors()
+    Database.close_pool()
     logger.info("Shutting down application...")
 
 app = FastAPI(
@@ -44,6 +82,9 @@ app = FastAPI(
     redoc_url="/api/redoc" if settings.ENVIRONMENT == "development" else None
 )
 
+# Token-bucket rate limits (inside CORS so 429s stay readable by the browser)
+app.add_middleware(RateLimitMiddleware)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -54,9 +95,39 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    """A saturated DB pool is a transient overload, not a server error"""
+    logger.warning(f"Database pool saturated: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service is busy, please retry shortly"},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Shed work rejected at admission with a retryable response"""
+    logger.warning(f"Rejected request: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service is busy, please retry shortly"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    """A client over its budget gets a 429 with the time until its next token"""
+    return rate_limited_response(exc)
+
+# Per-route latency histograms
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["Authentication"])
 app.include_router(shell.router, prefix="/api/v1/shell", tags=["Shell"])
+# Replica-to-replica messages; outside /api/ so nginx never exposes them
+app.include_router(internal.router, prefix="/internal", include_in_schema=False)
 
 @app.get("/health")
 async def health_check():
@@ -64,9 +135,18 @@ async def health_check():
     return {
         "status": "healthy",
         "service": "tempshell-api",
-        "version": "2.0.0"
+        "version": "2.0.0",
+        "warm_pool": k8s_service.get_warm_pool_stats(),
+        "pod_cache": user_pod_cache.stats()
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics endpoint"""
+    ACTIVE_PODS.set(await run_k8s(k8s_service.count_active_pods))
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
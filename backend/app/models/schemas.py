@@ -1,6 +1,8 @@
 from pydantic import BaseModel, EmailStr, Field, validator
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
+from app.core.config import settings
+from app.core.command_policy import command_policy
 import re
 
 class UserCreate(BaseModel):
@@ -33,6 +35,14 @@ class TokenRefresh(BaseModel):
 class CommandExecute(BaseModel):
     """Schema for command execution"""
     command: str = Field(..., max_length=1000, min_length=1)
+    timeout: Optional[int] = Field(None, ge=1)  # Seconds; defaults to COMMAND_TIMEOUT_SECONDS
+    command_id: Optional[str] = Field(None, max_length=64)  # Chosen by the client, for /cancel
+    
+    @validator('timeout')
+    def validate_timeout(cls, v):
+        if v is not None and v > settings.COMMAND_TIMEOUT_MAX_SECONDS:
+            raise ValueError(f'Timeout cannot exceed {settings.COMMAND_TIMEOUT_MAX_SECONDS} seconds')
+        return v
     
     @validator('command')
     def validate_command(cls, v):
@@ -40,26 +50,23 @@ class CommandExecute(BaseModel):
         # Strip leading/trailing whitespace
         v = v.strip()
         
-        # Block dangerous command patterns
-        dangerous_patterns = [
-            r'rm\s+-rf\s+/',  # Recursive force delete from root
-            r':\(\)\{.*\};:',  # Fork bomb
-            r'mkfs',  # Format filesystem
-            r'dd\s+if=/dev/zero',  # Disk wipe
-            r'>\s*/dev/sd',  # Write to disk
-            r'chmod\s+-R\s+777',  # Dangerous permissions
-        ]
-        
-        for pattern in dangerous_patterns:
-            if re.search(pattern, v, re.IGNORECASE):
-                raise ValueError('Command contains potentially dangerous operations')
+        # Block dangerous command patterns (see app.core.command_policy)
+        if command_policy.is_denied(v):
+            raise ValueError('Command contains potentially dangerous operations')
         
         return v
 
 class CommandResponse(BaseModel):
     """Schema for command execution response"""
-    output: str
+    output: str  # stdout, then stderr, for display
+    stdout: str = ""
+    stderr: str = ""
     exit_code: int
+    interrupted: Optional[str] = None  # "timeout" or "cancelled" when the backend stopped the command
+    truncated: bool = False  # Either stream exceeded MAX_OUTPUT_BYTES; head and tail kept
+    stdout_truncated: bool = False
+    stderr_truncated: bool = False
+    bytes_total: int = 0  # Bytes produced, including any truncated
     executed_at: datetime
     
     class Config:
@@ -67,11 +74,46 @@ class CommandResponse(BaseModel):
             datetime: lambda v: v.isoformat()
         }
 
+class CommandBatch(BaseModel):
+    """Schema for running several commands in one request"""
+    commands: List[CommandExecute] = Field(..., min_length=1, max_length=settings.MAX_BATCH_COMMANDS)
+    stop_on_error: bool = False  # Skip the remaining commands after a non-zero exit code
+
+class CommandBatchResponse(BaseModel):
+    """Schema for batch execution response"""
+    results: List[CommandResponse]  # One per command that ran, in order
+    completed: bool  # False if the batch stopped before running every command
+    status: str = "completed"  # Or why it stopped: failed (stop_on_error), cancelled, timed_out (BATCH_TIMEOUT_SECONDS)
+
 class ShellStatus(BaseModel):
     """Schema for shell status"""
     pod_id: Optional[str]
-    status: str
+    status: str  # Pod phase, or startup step such as ContainerCreating while provisioning
     created_at: Optional[datetime]
+    provision_id: Optional[str] = None  # Set while a provisioning is in progress or failed
+    detail: Optional[str] = None  # Why provisioning failed
+
+class ProvisionResponse(BaseModel):
+    """Schema for an accepted provisioning request"""
+    provision_id: str
+    status: str
+    pod_id: Optional[str] = None
+    detail: Optional[str] = None
+
+class FileTransferResponse(BaseModel):
+    """Schema for a file upload or download and its progress"""
+    transfer_id: str
+    direction: str  # upload or download
+    path: str
+    bytes_total: Optional[int] = None  # Upload size, or the source's disk usage for downloads
+    bytes_transferred: int = 0  # Body bytes streamed so far (compressed size for gzip downloads)
+    status: str  # running, completed or failed
+    started_at: datetime
+    
+    class Config:
+        json_encoders = {
+            datetime: lambda v: v.isoformat()
+        }
 
 class ErrorResponse(BaseModel):
     """Schema for error responses"""
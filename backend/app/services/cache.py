@@ -0,0 +1,234 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+from app.core.config import settings
+from app.core.concurrency import run_db
+from app.core.metrics import CACHE_LOOKUPS
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class Cache(ABC):
+    """Base class for string caches with hit/miss accounting"""
+
+    # Whether operations do network I/O and must stay off the event loop
+    blocking = False
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached value, or None on a miss"""
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_LOOKUPS.labels(self.name, "miss" if value is None else "hit").inc()
+        return value
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """Store a value for ttl seconds, or the cache's default TTL"""
+
+    @abstractmethod
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """Set a value only if the key is absent; returns whether it was set"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove a key, on every replica sharing the cache"""
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        """Look up a value without hit/miss accounting"""
+
+    async def aget(self, key: str) -> Optional[str]:
+        if self.blocking:
+            return await run_db(self.get, key)
+        return self.get(key)
+
+    async def aset(self, key: str, value: str):
+        if self.blocking:
+            return await run_db(self.set, key, value)
+        return self.set(key, value)
+
+    async def aadd(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        if self.blocking:
+            return await run_db(self.add, key, value, ttl)
+        return self.add(key, value, ttl)
+
+    async def adelete(self, key: str):
+        if self.blocking:
+            return await run_db(self.delete, key)
+        return self.delete(key)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "backend": type(self).__name__,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else None
+        }
+
+class LocalCache(Cache):
+    """
+    In-process LRU cache whose entries also expire after a TTL.
+
+    When on_delete is set, it is called with (cache name, key) after each
+    delete so other replicas can drop their copy too; discard deletes
+    without calling it.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: int):
+        super().__init__(name)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_delete = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return False
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def delete(self, key: str):
+        self.discard(key)
+        if self.on_delete is not None:
+            self.on_delete(self.name, key)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+class RedisCache(Cache):
+    """
+    Cache shared between replicas through a Redis-compatible server.
+
+    Any client exposing get/set(ex=)/delete works, so a local stand-in such
+    as fakeredis can replace the server. Backend errors count as misses so a
+    Redis outage degrades to reading from the source of truth.
+    """
+
+    blocking = True
+
+    def __init__(self, name: str, client, ttl: int):
+        super().__init__(name)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = f"tempshell:{name}:"
+
+    def _get(self, key: str) -> Optional[str]:
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Redis get failed for cache {self.name}: {e}")
+            return None
+        if isinstance(value, bytes):
+            value = value.decode()
+        return value
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        try:
+            self.client.set(self.prefix + key, value, ex=max(1, int(self.ttl if ttl is None else ttl)))
+        except Exception as e:
+            logger.warning(f"Redis set failed for cache {self.name}: {e}")
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        # Unlike lookups, a failed add must not be read as success
+        result = self.client.set(
+            self.prefix + key, value,
+            ex=max(1, int(self.ttl if ttl is None else ttl)), nx=True
+        )
+        return bool(result)
+
+    def delete(self, key: str):
+        try:
+            self.client.delete(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Redis delete failed for cache {self.name}: {e}")
+
+_redis_client = None
+
+def get_redis_client():
+    """Get the shared Redis client, or None when REDIS_URL is not configured"""
+    global _redis_client
+    if not settings.REDIS_URL:
+        return None
+    if _redis_client is None:
+        try:
+            import redis
+        except ImportError:
+            logger.warning("REDIS_URL is set but the redis package is not installed; using local caches")
+            return None
+        _redis_client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=0.5)
+    return _redis_client
+
+# Caches made by create_cache, by name, for invalidations sent by other replicas
+caches = {}
+
+def create_cache(name: str, max_entries: int, ttl: int) -> Cache:
+    """Create a cache shared through Redis when configured, otherwise in-process"""
+    client = get_redis_client()
+    if client is not None:
+        cache = RedisCache(name, client, ttl)
+    else:
+        cache = LocalCache(name, max_entries, ttl)
+    caches[name] = cache
+    return cache
+
+# Maps revoked token jti -> "1" until the token would have expired anyway
+revoked_tokens = create_cache(
+    "revoked-token",
+    settings.REVOKED_TOKENS_MAX_ENTRIES,
+    settings.REFRESH_TOKEN_EXPIRE_DAYS * 86400
+)
+
+# Maps username -> shell_pod_id ("" when the user has no pod)
+user_pod_cache = create_cache(
+    "user-pod",
+    settings.POD_CACHE_MAX_ENTRIES,
+    settings.POD_CACHE_TTL_SECONDS
+)
+
+# Users who ran a command since logging in, so last_command_at is written once per session
+command_activity = create_cache(
+    "command-activity",
+    settings.POD_CACHE_MAX_ENTRIES,
+    settings.REFRESH_TOKEN_EXPIRE_DAYS * 86400
+)
@@ -0,0 +1,354 @@
+from kubernetes.stream import stream
+from typing import Callable, Optional
+import logging
+import secrets
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Exit statuses reported for commands stopped by the backend, following the
+# conventions of timeout(1) and a shell interrupted by SIGINT
+TIMEOUT_EXIT_CODE = 124
+CANCELLED_EXIT_CODE = 130
+
+class SessionClosed(Exception):
+    """The session's shell process or exec stream has gone away"""
+
+class CommandInterrupted(Exception):
+    """
+    A command was stopped by its deadline or an explicit cancel.
+
+    started is False when it never reached the pod, e.g. while waiting for
+    a busy session, so there is nothing to kill.
+    """
+
+    def __init__(self, exit_code: int, started: bool = True):
+        super().__init__(f"Command interrupted with exit code {exit_code}")
+        self.exit_code = exit_code
+        self.started = started
+
+class CommandControl:
+    """
+    Deadline, cancellation flag and process group of one in-flight command.
+
+    command_id names the command for cancel_command; pgid is the process
+    group it runs in within the pod, once the exec that runs it reports it.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, command_id: Optional[str] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.cancelled = threading.Event()
+        self.command_id = command_id
+        self.started = time.monotonic()
+        self.pgid = None
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """Raise CommandInterrupted once the command is cancelled or past its deadline"""
+        if self.cancelled.is_set():
+            raise CommandInterrupted(CANCELLED_EXIT_CODE)
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise CommandInterrupted(TIMEOUT_EXIT_CODE)
+
+class _SentinelScanner:
+    """
+    Incrementally scans a channel for a sentinel line.
+
+    Everything before the sentinel is released to the caller, except a short
+    tail that might be the start of a sentinel split across frames.
+    """
+
+    def __init__(self, sentinel: str):
+        self.sentinel = sentinel
+        self.pending = ""
+        self.found = False
+        self.trailer = ""
+
+    def feed(self, data: str) -> str:
+        """Consume data and return the part that is safe to emit as output"""
+        if self.found:
+            self.trailer += data
+            return ""
+
+        self.pending += data
+        index = self.pending.find(self.sentinel)
+        if index >= 0:
+            self.found = True
+            emit = self.pending[:index]
+            self.trailer = self.pending[index + len(self.sentinel):]
+            self.pending = ""
+            return emit
+
+        keep = len(self.sentinel) - 1
+        if len(self.pending) <= keep:
+            return ""
+        emit = self.pending[:-keep]
+        self.pending = self.pending[-keep:]
+        return emit
+
+    def flush(self) -> str:
+        """Return output held back while waiting for a sentinel that never came"""
+        emit, self.pending = self.pending, ""
+        return emit
+
+# Runs a shell as the leader of a new process group and reports the group on
+# its first line of output, so an interrupted command can be killed alone
+PROCESS_GROUP_PREFIX = ["setsid", "-w", "/bin/sh", "-c", 'echo "$$"; exec "$@"', "sh"]
+
+# Seconds a new session may take to report its process group
+SESSION_OPEN_TIMEOUT = 10
+
+class ShellSession:
+    """
+    One long-lived /bin/sh process in a pod, reached over a single exec stream.
+
+    Commands are written to the shell's stdin one at a time. Each is followed by
+    printf sentinels on stdout (carrying $?) and stderr, so the end of a command's
+    output can be found without closing the stream. Shell state such as the
+    working directory and exported variables carries over between commands.
+    The shell leads its own process group, which its commands run in too.
+    """
+
+    def __init__(self, v1, namespace: str, pod_id: str):
+        self.v1 = v1
+        self.namespace = namespace
+        self.pod_id = pod_id
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._resp = None
+        self.pgid = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._resp is not None and self._resp.is_open()
+
+    def open(self):
+        """Start the shell process and read its process group"""
+        self._resp = stream(
+            self.v1.connect_get_namespaced_pod_exec,
+            self.pod_id,
+            self.namespace,
+            command=PROCESS_GROUP_PREFIX + ["/bin/sh"],
+            stderr=True,
+            stdin=True,
+            stdout=True,
+            tty=False,
+            _preload_content=False
+        )
+
+        header = ""
+        deadline = time.monotonic() + SESSION_OPEN_TIMEOUT
+        while "\n" not in header:
+            if not self._resp.is_open() or time.monotonic() >= deadline:
+                self.close()
+                raise SessionClosed(f"Exec session for pod {self.pod_id} did not start")
+            self._resp.update(timeout=1)
+            if self._resp.peek_stdout():
+                header += self._resp.read_stdout()
+        self.pgid = int(header.split("\n", 1)[0])
+        logger.info(f"Opened exec session for pod {self.pod_id}")
+
+    def ensure_open(self, control: CommandControl = None):
+        """Open the shell process unless it is already running, waiting for a running command as run does"""
+        self._acquire(control or CommandControl())
+        try:
+            if not self.is_open:
+                self.open()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Close the exec stream, which ends the shell process"""
+        if self._resp is not None:
+            try:
+                self._resp.close()
+            except Exception as e:
+                logger.debug(f"Error closing exec session for pod {self.pod_id}: {e}")
+            self._resp = None
+            self.pgid = None
+            logger.info(f"Closed exec session for pod {self.pod_id}")
+
+    def close_if_idle(self, cutoff: float) -> bool:
+        """Close the session if it is not running a command and was last used before cutoff"""
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            if self.is_open and self.last_used >= cutoff:
+                return False
+            self.close()
+            return True
+        finally:
+            self._lock.release()
+
+    def run(self, command: str, on_output: Callable[[str, str], None], control: CommandControl = None) -> int:
+        """
+        Run one command in the session, streaming output to on_output, and return its exit code
+
+        The session's process group is recorded on control; killing it after an
+        interruption ends this session's shell and command, and nothing else.
+        While another command holds the session, waiting ends at control's
+        deadline or cancel with CommandInterrupted(started=False).
+        """
+        control = control or CommandControl()
+        self._acquire(control)
+        try:
+            if not self.is_open:
+                raise SessionClosed(f"Exec session for pod {self.pod_id} is closed")
+
+            control.pgid = self.pgid
+            try:
+                return self._run_locked(command, on_output, control)
+            except BaseException:
+                # Output framing is lost once a command is abandoned midway
+                self.close()
+                raise
+            finally:
+                self.last_used = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def _acquire(self, control: CommandControl):
+        """Take the session lock, checking control at least every second while waiting"""
+        while True:
+            remaining = control.remaining()
+            if self._lock.acquire(timeout=1 if remaining is None else min(remaining, 1)):
+                return
+            try:
+                control.check()
+            except CommandInterrupted as e:
+                raise CommandInterrupted(e.exit_code, started=False)
+
+    def _run_locked(self, command: str, on_output: Callable[[str, str], None], control: CommandControl) -> int:
+        marker = f"__TEMPSHELL_{secrets.token_hex(8)}__"
+        # The quoted heredoc passes the command through verbatim, and eval makes a
+        # syntax error fail the command instead of leaving the shell waiting for
+        # more input. stdin is detached so commands cannot eat the next script.
+        script = (
+            f"eval \"$(cat <<'{marker}'\n{command}\n{marker}\n)\" </dev/null\n"
+            f"printf '\\n{marker}:%d\\n' $?\n"
+            f"printf '\\n{marker}\\n' >&2\n"
+        )
+        self._resp.write_stdin(script)
+
+        stdout = _SentinelScanner(f"\n{marker}:")
+        stderr = _SentinelScanner(f"\n{marker}\n")
+
+        def flush():
+            for channel, scanner in (("stdout", stdout), ("stderr", stderr)):
+                rest = scanner.flush()
+                if rest:
+                    on_output(channel, rest)
+
+        while not (stdout.found and "\n" in stdout.trailer and stderr.found):
+            try:
+                control.check()
+            except CommandInterrupted:
+                flush()
+                raise
+            if not self._resp.is_open():
+                # The command ended the shell itself (e.g. `exit 3`)
+                flush()
+                exit_code = self._resp.returncode
+                self._resp = None
+                return exit_code if exit_code is not None else 1
+
+            self._resp.update(timeout=1)
+            if self._resp.peek_stdout():
+                emit = stdout.feed(self._resp.read_stdout())
+                if emit:
+                    on_output("stdout", emit)
+            if self._resp.peek_stderr():
+                emit = stderr.feed(self._resp.read_stderr())
+                if emit:
+                    on_output("stderr", emit)
+
+        return int(stdout.trailer.split("\n", 1)[0])
+
+class SessionManager:
+    """Keeps one exec session per pod and reaps sessions left idle"""
+
+    def __init__(self, v1, namespace: str, idle_timeout: int):
+        self.v1 = v1
+        self.namespace = namespace
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper = None
+
+    def _get(self, pod_id: str) -> ShellSession:
+        with self._lock:
+            session = self._sessions.get(pod_id)
+            if session is None:
+                session = ShellSession(self.v1, self.namespace, pod_id)
+                self._sessions[pod_id] = session
+            return session
+
+    def run(self, pod_id: str, command: str, on_output: Callable[[str, str], None],
+            control: CommandControl = None) -> int:
+        """Run a command over the pod's session, opening a fresh one if needed"""
+        for attempt in range(2):
+            session = self._get(pod_id)
+            session.ensure_open(control)
+            try:
+                return session.run(command, on_output, control)
+            except SessionClosed:
+                # Lost a race with the reaper or a dead stream; retry once
+                if attempt:
+                    raise
+
+    def close(self, pod_id: str):
+        """Close the session for a pod, e.g. when the pod is deleted"""
+        with self._lock:
+            session = self._sessions.pop(pod_id, None)
+        if session:
+            session.close()
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def reap_idle(self):
+        """Close sessions that have not run a command within the idle timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            idle = [
+                pod_id for pod_id, session in self._sessions.items()
+                if session.close_if_idle(cutoff)
+            ]
+            for pod_id in idle:
+                del self._sessions[pod_id]
+        if idle:
+            logger.info(f"Reaped {len(idle)} idle exec sessions")
+
+    def _reap_loop(self):
+        while not self._stop.wait(min(self.idle_timeout, 30)):
+            self.reap_idle()
+
+    def start(self):
+        """Start the idle session reaper"""
+        if self._reaper and self._reaper.is_alive():
+            return
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._reap_loop, name="exec-session-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop(self):
+        """Stop the reaper and close all sessions"""
+        self._stop.set()
+        if self._reaper:
+            self._reaper.join(timeout=5)
+            self._reaper = None
+        self.close_all()
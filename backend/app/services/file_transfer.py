@@ -0,0 +1,155 @@
+from kubernetes.stream.ws_client import STDIN_CHANNEL, STDOUT_CHANNEL, STDERR_CHANNEL, ERROR_CHANNEL
+from websocket import ABNF
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import json
+import secrets
+import select
+import tarfile
+import time
+
+# Seconds finished transfers stay listed for progress polling
+TRANSFER_RETENTION_SECONDS = 60
+
+class FileTransferError(Exception):
+    """An archive command in the pod failed; the message is its error output"""
+
+class ExecFrames:
+    """
+    Binary access to an exec stream opened with _preload_content=False.
+
+    WSClient.update decodes every frame as UTF-8, which would corrupt
+    archives, so frames are read off its websocket directly and stdin is
+    written as binary frames. The status frame on the error channel is kept
+    for exit_status().
+    """
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.status = b""
+        self.open = True
+
+    def read(self, timeout: float) -> Optional[Tuple[int, bytes]]:
+        """Wait up to timeout seconds for an output frame and return (channel, data), else None"""
+        sock = self.resp.sock
+        if not self.open or not sock.connected:
+            self.open = False
+            return None
+
+        poll = select.poll()
+        poll.register(sock.sock, select.POLLIN)
+        ready = poll.poll(timeout * 1000)
+        if not ready:
+            return None
+
+        opcode, frame = sock.recv_data_frame(True)
+        if opcode == ABNF.OPCODE_CLOSE:
+            self.open = False
+            return None
+        data = frame.data
+        if opcode not in (ABNF.OPCODE_BINARY, ABNF.OPCODE_TEXT) or len(data) < 2:
+            return None
+        if data[0] == ERROR_CHANNEL:
+            self.status += data[1:]
+            return None
+        if data[0] not in (STDOUT_CHANNEL, STDERR_CHANNEL):
+            return None
+        return data[0], data[1:]
+
+    def write(self, data: bytes):
+        """Send data to the command's stdin, blocking while the pod is not reading"""
+        self.resp.write_channel(STDIN_CHANNEL, bytes(data))
+
+    def exit_status(self) -> Tuple[int, str]:
+        """(exit code, message) from the status frame of a finished command"""
+        if not self.status:
+            return 0, ""
+        status = json.loads(self.status)
+        if status.get("status") == "Success":
+            return 0, ""
+        for cause in (status.get("details") or {}).get("causes") or ():
+            if cause.get("reason") == "ExitCode":
+                return int(cause["message"]), status.get("message", "")
+        return 1, status.get("message", "")
+
+    def close(self):
+        self.resp.close()
+
+def single_file_framing(name: str, size: int) -> Tuple[bytes, bytes]:
+    """
+    Tar header and trailer that turn size bytes of file content into an archive.
+
+    Lets a plain file body be streamed into `tar -x` without buffering it;
+    the total archive size is len(header) + size + len(trailer).
+    """
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = int(time.time())
+    header = info.tobuf(format=tarfile.PAX_FORMAT)
+    # Pad the content to a whole block, then two empty blocks end the archive
+    trailer = b"\0" * (-size % tarfile.BLOCKSIZE) + b"\0" * (2 * tarfile.BLOCKSIZE)
+    return header, trailer
+
+class Transfer:
+    """Progress of one file upload or download"""
+
+    __slots__ = ("id", "username", "direction", "path", "bytes_total", "bytes_transferred",
+                 "status", "started_at", "finished_at")
+
+    def __init__(self, username: str, direction: str, path: str, bytes_total: Optional[int]):
+        self.id = secrets.token_urlsafe(8)
+        self.username = username
+        self.direction = direction
+        self.path = path
+        self.bytes_total = bytes_total
+        self.bytes_transferred = 0
+        self.status = "running"
+        self.started_at = datetime.utcnow()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "transfer_id": self.id,
+            "direction": self.direction,
+            "path": self.path,
+            "bytes_total": self.bytes_total,
+            "bytes_transferred": self.bytes_transferred,
+            "status": self.status,
+            "started_at": self.started_at
+        }
+
+class TransferTracker:
+    """
+    Running and recently finished transfers of each user, for progress polling.
+
+    Lives on the event loop like ProvisioningTracker; counts are updated by
+    the routes as chunks pass through them. Finished transfers stay listed
+    for TRANSFER_RETENTION_SECONDS so a poll after the last chunk still sees
+    the outcome.
+    """
+
+    def __init__(self):
+        self._transfers: Dict[str, Transfer] = {}
+
+    def start(self, username: str, direction: str, path: str, bytes_total: Optional[int] = None) -> Transfer:
+        self._prune()
+        transfer = Transfer(username, direction, path, bytes_total)
+        self._transfers[transfer.id] = transfer
+        return transfer
+
+    def finish(self, transfer: Transfer, status: str):
+        transfer.status = status
+        transfer.finished_at = time.monotonic()
+
+    def list(self, username: str) -> List[Transfer]:
+        self._prune()
+        return [t for t in self._transfers.values() if t.username == username]
+
+    def _prune(self):
+        cutoff = time.monotonic() - TRANSFER_RETENTION_SECONDS
+        for transfer_id, transfer in list(self._transfers.items()):
+            if transfer.finished_at is not None and transfer.finished_at < cutoff:
+                del self._transfers[transfer_id]
+
+transfers = TransferTracker()
@@ -0,0 +1,400 @@
+from app.core.metrics import HIBERNATE_SECONDS, SNAPSHOT_BYTES
+from typing import Iterator, List, Optional
+import hashlib
+import json
+import logging
+import os
+import secrets
+import tarfile
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Pod annotation set while a resumed pod's cold files are still being restored
+RESTORE_ANNOTATION = "restore"
+
+# Bytes read from archives and blobs at a time
+BLOCK_BYTES = 1048576
+
+# Unreferenced blobs younger than this may belong to a snapshot being written
+BLOB_GRACE_SECONDS = 3600
+
+class SnapshotTooLarge(Exception):
+    """A home directory exceeded SNAPSHOT_MAX_BYTES"""
+
+class SnapshotStore:
+    """
+    Content-addressed home directory snapshots under a directory.
+
+    blobs/<ab>/<sha256> holds zlib-compressed file contents, shared by every
+    snapshot (of any user) containing the same bytes; manifests/<username>.json
+    lists the entries of the user's latest snapshot. Everything is written
+    under a temporary name and renamed into place, so replicas sharing the
+    directory (a ReadWriteMany volume) only ever see complete files.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def _manifest_path(self, username: str) -> str:
+        return os.path.join(self.root, "manifests", f"{username}.json")
+
+    def _temp_path(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{secrets.token_hex(4)}.tmp"
+
+    def touch_blob(self, digest: str) -> bool:
+        """
+        Refresh a blob's mtime as it is reused; returns whether the store holds it.
+
+        A blob picked up by a snapshot is not referenced until its manifest is
+        saved, so the fresh mtime keeps collect_garbage from deleting it
+        within BLOB_GRACE_SECONDS.
+        """
+        try:
+            os.utime(self._blob_path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def store_blob(self, source) -> tuple:
+        """
+        Compress a file object's contents into the store.
+
+        Returns (digest, bytes written), with nothing written when the store
+        already held the contents.
+        """
+        temp_path = self._temp_path(os.path.join(self.root, "blobs", "incoming"))
+        digest = hashlib.sha256()
+        compressor = zlib.compressobj(1)  # Snapshots hold up pod deletion; favour speed
+        try:
+            with open(temp_path, "wb") as blob:
+                for block in iter(lambda: source.read(BLOCK_BYTES), b""):
+                    digest.update(block)
+                    blob.write(compressor.compress(block))
+                blob.write(compressor.flush())
+                written = blob.tell()
+            path = self._blob_path(digest.hexdigest())
+            if self.touch_blob(digest.hexdigest()):
+                os.unlink(temp_path)
+                return digest.hexdigest(), 0
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            return digest.hexdigest(), written
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def read_blob(self, digest: str) -> Iterator[bytes]:
+        """Yield a blob's decompressed contents in pieces"""
+        decompressor = zlib.decompressobj()
+        with open(self._blob_path(digest), "rb") as blob:
+            for block in iter(lambda: blob.read(BLOCK_BYTES), b""):
+                data = decompressor.decompress(block)
+                if data:
+                    yield data
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+    def has_manifest(self, username: str) -> bool:
+        return os.path.exists(self._manifest_path(username))
+
+    def load_manifest(self, username: str) -> Optional[dict]:
+        try:
+            with open(self._manifest_path(username)) as manifest:
+                return json.load(manifest)
+        except FileNotFoundError:
+            return None
+
+    def save_manifest(self, username: str, manifest: dict):
+        path = self._manifest_path(username)
+        temp_path = self._temp_path(path)
+        with open(temp_path, "w") as out:
+            json.dump(manifest, out)
+        os.replace(temp_path, path)
+
+    def delete_manifest(self, username: str):
+        try:
+            os.unlink(self._manifest_path(username))
+        except FileNotFoundError:
+            pass
+
+    def collect_garbage(self, retention_seconds: float) -> tuple:
+        """
+        Delete manifests older than retention_seconds, then blobs no manifest references.
+
+        Returns (manifests deleted, blobs deleted).
+        """
+        now = time.time()
+        referenced = set()
+        manifests_deleted = 0
+        manifest_dir = os.path.join(self.root, "manifests")
+        for name in os.listdir(manifest_dir) if os.path.isdir(manifest_dir) else ():
+            path = os.path.join(manifest_dir, name)
+            if not name.endswith(".json"):
+                continue
+            if now - os.path.getmtime(path) > retention_seconds:
+                os.unlink(path)
+                manifests_deleted += 1
+                continue
+            with open(path) as manifest:
+                referenced.update(entry["digest"] for entry in json.load(manifest)["entries"] if "digest" in entry)
+
+        blobs_deleted = 0
+        blob_dir = os.path.join(self.root, "blobs")
+        for dirpath, _, names in os.walk(blob_dir):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                if name in referenced or now - os.path.getmtime(path) < BLOB_GRACE_SECONDS:
+                    continue
+                os.unlink(path)
+                blobs_deleted += 1
+        return manifests_deleted, blobs_deleted
+
+def _entry_header(entry: dict) -> bytes:
+    info = tarfile.TarInfo(entry["path"])
+    info.mode = entry["mode"]
+    info.mtime = entry["mtime"]
+    if entry["type"] == "dir":
+        info.type = tarfile.DIRTYPE
+    elif entry["type"] == "symlink":
+        info.type = tarfile.SYMTYPE
+        info.linkname = entry["link"]
+    else:
+        info.size = entry["size"]
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+class Hibernator:
+    """
+    Keeps users' home directories across pod deletions.
+
+    Before a pod is deleted, its home directory is streamed out of `tar -c`
+    and split into content-addressed blobs in a SnapshotStore; files whose
+    size and mtime match the previous snapshot reuse its blobs without being
+    compressed again. Files modified during the pod's session are marked hot,
+    newest first, up to eager_bytes. When the user next gets a pod, the
+    directories, symlinks and hot files are restored before it is handed out,
+    and the remaining files follow in the background with
+    `tar --keep-newer-files`, so they never replace what the user changed
+    meanwhile. A pod with cold files still pending carries the restore
+    annotation; snapshotting it keeps the previous snapshot's missing files.
+    """
+
+    def __init__(self, k8s_service, store: SnapshotStore, enabled: bool, eager_bytes: int,
+                 max_bytes: int, chunk_bytes: int, retention_seconds: float):
+        self.k8s = k8s_service
+        self.store = store
+        self._enabled = enabled
+        self.eager_bytes = eager_bytes
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.retention_seconds = retention_seconds
+        self._last_collected = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled and self.k8s.enabled
+
+    def snapshot(self, pod_id: str, username: str, session_started: float, restore_pending: bool = False):
+        """Snapshot the pod's home directory as the user's latest; raises on failure"""
+        start = time.perf_counter()
+        previous = self.store.load_manifest(username)
+        known = {entry["path"]: entry for entry in previous["entries"]} if previous else {}
+
+        read_fd, write_fd = os.pipe()
+        failure = []
+
+        def produce():
+            try:
+                with os.fdopen(write_fd, "wb") as sink:
+                    self.k8s.archive_home(pod_id, sink.write)
+            except BrokenPipeError:
+                pass  # The reader gave up and reports why
+            except Exception as e:
+                failure.append(e)
+
+        producer = threading.Thread(target=produce, name="home-snapshot", daemon=True)
+        producer.start()
+
+        entries = []
+        by_path = {}
+        total = stored = deduplicated = 0
+        try:
+            with os.fdopen(read_fd, "rb") as source, tarfile.open(fileobj=source, mode="r|") as archive:
+                for member in archive:
+                    path = os.path.normpath(member.name)
+                    if path == ".":
+                        continue
+                    entry = {"path": path, "mode": member.mode, "mtime": int(member.mtime)}
+                    if member.isdir():
+                        entry["type"] = "dir"
+                    elif member.issym():
+                        entry.update(type="symlink", link=member.linkname)
+                    elif member.islnk() and os.path.normpath(member.linkname) in by_path:
+                        target = by_path[os.path.normpath(member.linkname)]
+                        entry.update(type="file", size=target["size"], digest=target["digest"])
+                    elif member.isfile():
+                        total += member.size
+                        if total > self.max_bytes:
+                            raise SnapshotTooLarge(f"Home directory exceeds {self.max_bytes} bytes")
+                        old = known.get(path)
+                        if (old is not None and old["type"] == "file" and old["size"] == member.size
+                                and old["mtime"] == entry["mtime"] and self.store.touch_blob(old["digest"])):
+                            digest = old["digest"]
+                            deduplicated += member.size
+                        else:
+                            digest, written = self.store.store_blob(archive.extractfile(member))
+                            if written:
+                                stored += member.size
+                            else:
+                                deduplicated += member.size
+                        entry.update(type="file", size=member.size, digest=digest)
+                    else:
+                        continue  # Devices, FIFOs and sockets are not kept
+                    entries.append(entry)
+                    by_path[path] = entry
+        finally:
+            producer.join()
+        if failure:
+            raise failure[0]
+
+        if restore_pending and previous:
+            entries += [dict(entry, hot=False) for entry in previous["entries"] if entry["path"] not in by_path]
+
+        budget = self.eager_bytes
+        touched = [entry for entry in entries if entry["type"] == "file" and entry["mtime"] >= session_started]
+        for entry in sorted(touched, key=lambda entry: entry["mtime"], reverse=True):
+            if entry["size"] <= budget:
+                entry["hot"] = True
+                budget -= entry["size"]
+
+        self.store.save_manifest(username, {
+            "created_at": int(time.time()),
+            "pod_id": pod_id,
+            "entries": entries
+        })
+        SNAPSHOT_BYTES.labels("stored").inc(stored)
+        SNAPSHOT_BYTES.labels("deduplicated").inc(deduplicated)
+        HIBERNATE_SECONDS.labels("snapshot").observe(time.perf_counter() - start)
+        logger.info(
+            f"Snapshot of {username}'s home from pod {pod_id}: {len(entries)} entries, "
+            f"{total} bytes, {stored} newly stored"
+        )
+
+    def snapshot_pod(self, pod_id: str, pod=None):
+        """Snapshot a user pod before it is deleted, logging instead of raising on failure"""
+        try:
+            if pod is None:
+                pod = self.k8s.read_pod(pod_id)
+            if pod is None or pod.status.phase != "Running":
+                return
+            annotations = pod.metadata.annotations or {}
+            self.snapshot(
+                pod_id,
+                pod.metadata.labels["user"],
+                float(annotations.get("created-at", "0")),
+                annotations.get(RESTORE_ANNOTATION) == "pending"
+            )
+        except Exception as e:
+            logger.error(f"Failed to snapshot pod {pod_id}; its home directory is lost: {e}")
+
+    def has_snapshot(self, username: str) -> bool:
+        return self.store.has_manifest(username)
+
+    def discard(self, username: str):
+        """Forget the user's snapshot, so their next pod starts empty"""
+        self.store.delete_manifest(username)
+
+    def _archive(self, entries: List[dict]) -> tuple:
+        """(size, next_chunk) of a tar archive of entries built from their blobs"""
+        headers = [_entry_header(entry) for entry in entries]
+        size = 2 * tarfile.BLOCKSIZE
+        for entry, header in zip(entries, headers):
+            content = entry.get("size", 0) if entry["type"] == "file" else 0
+            size += len(header) + content + (-content % tarfile.BLOCKSIZE)
+
+        def pieces():
+            for entry, header in zip(entries, headers):
+                yield header
+                if entry["type"] != "file":
+                    continue
+                written = 0
+                for data in self.store.read_blob(entry["digest"]):
+                    written += len(data)
+                    yield data
+                if written != entry["size"]:
+                    raise IOError(f"Blob {entry['digest']} of {entry['path']} is damaged")
+                yield b"\0" * (-written % tarfile.BLOCKSIZE)
+            yield b"\0" * (2 * tarfile.BLOCKSIZE)
+
+        def chunks():
+            pending = bytearray()
+            for piece in pieces():
+                pending += piece
+                while len(pending) >= self.chunk_bytes:
+                    yield bytes(pending[:self.chunk_bytes])
+                    del pending[:self.chunk_bytes]
+            if pending:
+                yield bytes(pending)
+
+        chunk_iter = chunks()
+        return size, lambda: next(chunk_iter, None)
+
+    def restore(self, pod_id: str, username: str) -> bool:
+        """
+        Restore the directories, symlinks and hot files of the user's snapshot into a new pod.
+
+        Returns whether cold files remain for restore_remaining, in which case
+        the pod is annotated as pending until they are in place.
+        """
+        manifest = self.store.load_manifest(username)
+        if manifest is None:
+            return False
+        start = time.perf_counter()
+        eager = [entry for entry in manifest["entries"] if entry["type"] != "file" or entry.get("hot")]
+        remaining = len(eager) < len(manifest["entries"])
+        if remaining:
+            self.k8s.annotate_pod(pod_id, {RESTORE_ANNOTATION: "pending"})
+        if eager:
+            size, next_chunk = self._archive(eager)
+            self.k8s.upload_archive(pod_id, ".", size, next_chunk)
+        HIBERNATE_SECONDS.labels("restore_hot").observe(time.perf_counter() - start)
+        logger.info(f"Restored {len(eager)}/{len(manifest['entries'])} entries of {username}'s home into pod {pod_id}")
+        return remaining
+
+    def restore_remaining(self, pod_id: str, username: str):
+        """Restore the cold files of the user's snapshot, keeping files changed in the pod since"""
+        start = time.perf_counter()
+        try:
+            manifest = self.store.load_manifest(username)
+            cold = [entry for entry in (manifest or {}).get("entries", ())
+                    if entry["type"] == "file" and not entry.get("hot")]
+            if cold:
+                size, next_chunk = self._archive(cold)
+                self.k8s.upload_archive(pod_id, ".", size, next_chunk, keep_newer=True)
+            self.k8s.annotate_pod(pod_id, {RESTORE_ANNOTATION: None})
+        except Exception as e:
+            logger.error(f"Failed to restore the rest of {username}'s home into pod {pod_id}: {e}")
+            return
+        HIBERNATE_SECONDS.labels("restore_cold").observe(time.perf_counter() - start)
+        logger.info(f"Restored {len(cold)} remaining files of {username}'s home into pod {pod_id}")
+
+    def maybe_collect_garbage(self, interval: float = 3600):
+        """Run SnapshotStore.collect_garbage at most once per interval seconds"""
+        if not self.enabled or time.monotonic() - self._last_collected < interval:
+            return
+        self._last_collected = time.monotonic()
+        try:
+            manifests, blobs = self.store.collect_garbage(self.retention_seconds)
+        except OSError as e:
+            logger.warning(f"Snapshot garbage collection failed: {e}")
+            return
+        if manifests or blobs:
+            logger.info(f"Deleted {manifests} expired snapshots and {blobs} unreferenced blobs")
@@ -0,0 +1,82 @@
+from app.core.config import settings
+from app.core.concurrency import get_executor, K8S
+from typing import List
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-TempShell-Signature"
+
+def sign(body: bytes) -> str:
+    """HMAC of an internal message body under the shared SECRET_KEY"""
+    return hmac.new(settings.SECRET_KEY.encode(), body, hashlib.sha256).hexdigest()
+
+def verify(body: bytes, signature: str) -> bool:
+    return hmac.compare_digest(sign(body), signature or "")
+
+class InvalidationBroadcaster:
+    """
+    Tells the other backend replicas to drop entries from their in-process caches.
+
+    Peers are the running backend pods matching REPLICA_LABEL_SELECTOR, listed
+    at most every peer_ttl seconds. Messages are signed POSTs to each peer's
+    /internal/invalidate, sent from the Kubernetes API thread pool so callers
+    never wait on them. Delivery is best effort: a missed message leaves an
+    entry stale until its TTL, as it would without the broadcast.
+    """
+
+    def __init__(self, v1, namespace: str, label_selector: str, own_ip: str, port: int = 8000,
+                 peer_ttl: float = 10.0, timeout: float = 1.0):
+        self.v1 = v1
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.own_ip = own_ip
+        self.port = port
+        self.peer_ttl = peer_ttl
+        self.timeout = timeout
+        self._peers = []
+        self._peers_at = 0.0
+        self._lock = threading.Lock()
+
+    def peers(self) -> List[str]:
+        """IPs of the other running backend replicas"""
+        with self._lock:
+            if time.monotonic() - self._peers_at < self.peer_ttl:
+                return self._peers
+        pods = self.v1.list_namespaced_pod(namespace=self.namespace, label_selector=self.label_selector)
+        peers = [
+            pod.status.pod_ip for pod in pods.items
+            if pod.status.phase == "Running" and pod.status.pod_ip and pod.status.pod_ip != self.own_ip
+        ]
+        with self._lock:
+            self._peers, self._peers_at = peers, time.monotonic()
+        return peers
+
+    def _send(self, body: bytes):
+        try:
+            peers = self.peers()
+        except Exception as e:
+            logger.warning(f"Failed to list backend replicas for invalidation: {e}")
+            return
+        for ip in peers:
+            request = urllib.request.Request(
+                f"http://{ip}:{self.port}/internal/invalidate",
+                data=body,
+                headers={"Content-Type": "application/json", SIGNATURE_HEADER: sign(body)},
+                method="POST"
+            )
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except Exception as e:
+                logger.warning(f"Failed to send cache invalidation to replica {ip}: {e}")
+
+    def publish(self, cache: str, key: str):
+        """Ask every other replica to delete key from its cache named cache"""
+        body = json.dumps({"cache": cache, "keys": [key]}).encode()
+        get_executor(K8S).submit(self._send, body)
@@ -2,13 +2,50 @@ from kubernetes import client, config
 from kubernetes.client.rest import ApiException
 from kubernetes.stream import stream
 from app.core.config import settings
+from app.core.metrics import (
+    POD_CREATE_SECONDS, WARM_POOL_CLAIMS, EXEC_SECONDS, EXEC_OUTPUT_BYTES, SPECULATIVE_PODS
+)
+from app.core.concurrency import get_executor, K8S
+from app.services.pod_cache import PodCache
+from app.services.pod_reaper import PodReaper, LAST_USED_ANNOTATION, SPECULATIVE_ANNOTATION
+from app.services.leader_election import LeaderElector
+from app.services.exec_session import (
+    ShellSession, SessionManager, CommandControl, CommandInterrupted,
+    TIMEOUT_EXIT_CODE, PROCESS_GROUP_PREFIX
+)
+from app.services.output_buffer import OutputBuffer
+from app.services.file_transfer import ExecFrames, FileTransferError
+from app.services.hibernation import Hibernator, SnapshotStore
+from kubernetes.stream.ws_client import STDOUT_CHANNEL
 import hashlib
+import math
+import os
 import secrets  # Secure unique pod name banana
+import socket
+from typing import Callable, Dict, List, Optional, Tuple
 import logging
+import threading
 import time
 
 logger = logging.getLogger(__name__)
 
+MANAGED_BY_SELECTOR = "managed-by=tempshell-backend"
+
+def describe_pod_phase(pod) -> str:
+    """
+    The pod's phase, refined while Pending by why its container is waiting
+    
+    Gives "Pending" until the pod is scheduled, then reasons such as
+    "ContainerCreating" or "ImagePullBackOff", then "Running" and so on.
+    """
+    phase = pod.status.phase
+    if phase == "Pending":
+        for container in pod.status.container_statuses or []:
+            waiting = container.state and container.state.waiting
+            if waiting and waiting.reason:
+                return waiting.reason
+    return phase
+
 class K8sService:
     """Service for managing Kubernetes pods for user shells"""
     
@@ -18,6 +55,52 @@ class K8sService:
         self.namespace = settings.K8S_NAMESPACE
         self.enabled = False
         
+        # Warm pool state
+        self._pool_lock = threading.Lock()
+        self._pool_hits = 0
+        self._pool_misses = 0
+        self._pool_stop = threading.Event()
+        self._pool_wakeup = threading.Event()
+        self._pool_thread = None
+        
+        # Watch-fed pod cache and persistent exec sessions, created once the client is configured
+        self.pod_cache = None
+        self.sessions = None
+        
+        # Lease-based election of the replica running cleanup, reaping and pool refills
+        self.leader = None
+        
+        # Snapshots home directories before pods are deleted and restores them into new ones
+        self.hibernator = Hibernator(
+            self,
+            SnapshotStore(settings.SNAPSHOT_DIR),
+            settings.HIBERNATE_ENABLED,
+            settings.RESTORE_EAGER_BYTES,
+            settings.SNAPSHOT_MAX_BYTES,
+            settings.FILE_CHUNK_BYTES,
+            settings.SNAPSHOT_RETENTION_DAYS * 86400
+        )
+        
+        # Deletes idle user pods and enforces MAX_ACTIVE_PODS; with hibernation, also
+        # pods about to reach POD_TIMEOUT_SECONDS, while their home can still be saved
+        self.reaper = PodReaper(
+            self,
+            settings.POD_IDLE_TTL_SECONDS,
+            settings.MAX_ACTIVE_PODS,
+            settings.POD_REAPER_INTERVAL_SECONDS,
+            expire_after=(
+                settings.POD_TIMEOUT_SECONDS - 2 * settings.POD_REAPER_INTERVAL_SECONDS - 60
+                if settings.HIBERNATE_ENABLED else 0
+            )
+        )
+        
+        # Controls for in-flight commands, keyed by pod, for cancellation
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        
+        # Speculative pods this replica has seen a command in
+        self._speculation_used = set()
+        
         try:
             # Try in-cluster config first (for production)
             config.load_incluster_config()
@@ -34,17 +117,111 @@ class K8sService:
             except Exception as e2:
                 logger.warning(f"Kubernetes not available: {e2}. Shell functionality disabled for local development.")
                 self.enabled = False
+        
+        if self.enabled:
+            self.pod_cache = PodCache(self.v1, self.namespace, MANAGED_BY_SELECTOR)
+            if settings.EXEC_SESSIONS_ENABLED:
+                self.sessions = SessionManager(self.v1, self.namespace, settings.EXEC_SESSION_IDLE_SECONDS)
     
-    def create_user_pod(self, username: str) -> str:
-        """Create an isolated pod for user shell sessions"""
-        if not self.enabled:
-            raise Exception("Kubernetes not available. Shell functionality disabled for local development.")
+    def start_pod_cache(self):
+        """Start the list+watch thread feeding the pod cache"""
+        if not self.pod_cache:
+            return
+        self.pod_cache.start()
+        if not self.pod_cache.wait_until_synced(timeout=10):
+            logger.warning("Pod cache not synced yet, falling back to direct API reads")
+    
+    def stop_pod_cache(self):
+        """Stop the pod cache watch"""
+        if self.pod_cache:
+            self.pod_cache.stop()
+    
+    def start_exec_sessions(self):
+        """Start reaping idle exec sessions"""
+        if self.sessions:
+            self.sessions.start()
+    
+    def stop_exec_sessions(self):
+        """Close all exec sessions"""
+        if self.sessions:
+            self.sessions.stop()
+    
+    def is_leader(self) -> bool:
+        """
+        Whether this replica runs the cluster-wide background work
         
-        # Generate unique pod ID
-        pod_id = hashlib.sha256(
-            f"{username}-{secrets.token_hex(16)}-{int(time.time())}".encode()
-        ).hexdigest()[:32]
+        Always with election disabled, since the replica is then the only one;
+        otherwise only once the elector has won the lease, so nothing runs
+        before the election has started or decided.
+        """
+        if not self.enabled or not settings.LEADER_ELECTION_ENABLED:
+            return True
+        return self.leader is not None and self.leader.is_leader
+    
+    def start_leader_election(self, on_started_leading: Callable[[], None]):
+        """
+        Campaign for leadership among backend replicas.
+        
+        Without Kubernetes or with LEADER_ELECTION_ENABLED off, this replica
+        acts as the only one and on_started_leading runs right away. A new
+        leader also refills the warm pool at once rather than at its next pass.
+        """
+        if not self.enabled or not settings.LEADER_ELECTION_ENABLED:
+            on_started_leading()
+            return
+        
+        def started_leading():
+            on_started_leading()
+            self._pool_wakeup.set()
+        
+        identity = f"{settings.REPLICA_NAME or socket.gethostname()}-{os.getpid()}"
+        self.leader = LeaderElector(
+            client.CoordinationV1Api(),
+            self.namespace,
+            settings.LEADER_LEASE_NAME,
+            identity,
+            settings.LEADER_LEASE_DURATION_SECONDS,
+            on_started_leading=started_leading
+        )
+        self.leader.start()
+    
+    def stop_leader_election(self):
+        """Give up leadership so another replica takes over without waiting for the lease to expire"""
+        if self.leader:
+            self.leader.stop()
+    
+    def start_pod_reaper(self, on_reaped: Optional[Callable[[Dict[str, str]], None]] = None):
+        """Start reaping idle pods; on_reaped receives {pod_id: username} for deleted pods"""
+        self.reaper.on_reaped = on_reaped
+        self.reaper.start()
+    
+    def stop_pod_reaper(self):
+        """Stop reaping idle pods"""
+        self.reaper.stop()
+    
+    def _cache_ready(self) -> bool:
+        return self.pod_cache is not None and self.pod_cache.synced
+    
+    def _list_pods(self, labels: dict, phases: tuple = None) -> list:
+        """List managed pods carrying the given labels, from the cache when it is synced"""
+        if self._cache_ready():
+            return self.pod_cache.list(
+                lambda pod: all((pod.metadata.labels or {}).get(k) == v for k, v in labels.items())
+                and (phases is None or pod.status.phase in phases)
+            )
         
+        selector = ",".join([MANAGED_BY_SELECTOR] + [f"{k}={v}" for k, v in labels.items()])
+        pods = self.v1.list_namespaced_pod(namespace=self.namespace, label_selector=selector)
+        return [pod for pod in pods.items if phases is None or pod.status.phase in phases]
+    
+    def _generate_pod_id(self, seed: str) -> str:
+        """Generate a unique, DNS-safe pod name"""
+        return hashlib.sha256(
+            f"{seed}-{secrets.token_hex(16)}-{int(time.time())}".encode()
+        ).hexdigest()[:32]
+    
+    def _build_pod(self, pod_id: str, labels: dict, annotations: Optional[dict] = None) -> client.V1Pod:
+        """Build the pod specification for a shell pod"""
         # Security context for strict isolation
         security_context = client.V1SecurityContext(
             run_as_non_root=True,
@@ -71,16 +248,17 @@ class K8sService:
         )
         
         # Pod specification
-        pod = client.V1Pod(
+        return client.V1Pod(
             metadata=client.V1ObjectMeta(
                 name=pod_id,
                 labels={
                     "app": "tempshell",
-                    "user": username,
-                    "managed-by": "tempshell-backend"
+                    "managed-by": "tempshell-backend",
+                    **labels
                 },
                 annotations={
-                    "created-at": str(int(time.time()))
+                    "created-at": str(int(time.time())),
+                    **(annotations or {})
                 }
             ),
             spec=client.V1PodSpec(
@@ -102,25 +280,211 @@ class K8sService:
                 automount_service_account_token=False  # Don't mount service account
             )
         )
+    
+    def create_user_pod(self, username: str, on_phase: Optional[Callable[[str, str], None]] = None,
+                        speculative: bool = False) -> str:
+        """
+        Create an isolated pod for user shell sessions, claiming a warm pod when available
+        
+        on_phase, if given, is called with (pod_id, phase) as a new pod moves
+        through its startup phases (see describe_pod_phase); a claimed warm
+        pod is already running and reports none. A speculative pod, started
+        before the user asked for one, is annotated so its first command and
+        its reaping can be counted.
+        """
+        if not self.enabled:
+            raise Exception("Kubernetes not available. Shell functionality disabled for local development.")
+        
+        annotations = {SPECULATIVE_ANNOTATION: "unused"} if speculative else {}
+        if speculative:
+            SPECULATIVE_PODS.labels("started").inc()
+        
+        if settings.WARM_POOL_SIZE > 0:
+            with POD_CREATE_SECONDS.labels("claim").time():
+                pod_id = self._claim_warm_pod(username, annotations)
+            WARM_POOL_CLAIMS.labels("hit" if pod_id else "miss").inc()
+            with self._pool_lock:
+                if pod_id:
+                    self._pool_hits += 1
+                else:
+                    self._pool_misses += 1
+            # Top the pool back up without waiting for the next refill tick
+            self._pool_wakeup.set()
+            if pod_id:
+                self.reaper.touch(pod_id)
+                return pod_id
+        
+        # Generate unique pod ID
+        pod_id = self._generate_pod_id(username)
+        pod = self._build_pod(pod_id, {"user": username}, annotations)
         
         try:
-            self.v1.create_namespaced_pod(namespace=self.namespace, body=pod)
+            with POD_CREATE_SECONDS.labels("create").time():
+                self.v1.create_namespaced_pod(namespace=self.namespace, body=pod)
             logger.info(f"Created pod {pod_id} for user {username}")
+            if on_phase:
+                on_phase(pod_id, "Pending")
             
             # Wait for pod to be ready
-            self._wait_for_pod_ready(pod_id)
+            with POD_CREATE_SECONDS.labels("wait_ready").time():
+                self._wait_for_pod_ready(pod_id, on_phase=on_phase)
             
+            self.reaper.touch(pod_id)
             return pod_id
         except ApiException as e:
             logger.error(f"Failed to create pod: {e}")
             raise Exception(f"Failed to create shell environment: {e.reason}")
     
-    def _wait_for_pod_ready(self, pod_id: str, timeout: int = 60):
-        """Wait for pod to be in running state"""
+    def _claim_warm_pod(self, username: str, annotations: dict) -> Optional[str]:
+        """Claim a ready pod from the warm pool by relabeling it to the user"""
+        try:
+            pods = self._list_pods({"pool": "warm"}, phases=("Running",))
+        except ApiException as e:
+            logger.warning(f"Failed to list warm pool pods: {e}")
+            return None
+        
+        for pod in pods:
+            if self._is_pool_pod_stale(pod):
+                continue
+            
+            pod_name = pod.metadata.name
+            try:
+                # resourceVersion makes the claim fail with 409 if another request
+                # (or replica) relabeled the pod first
+                self.v1.patch_namespaced_pod(
+                    name=pod_name,
+                    namespace=self.namespace,
+                    body={
+                        "metadata": {
+                            "resourceVersion": pod.metadata.resource_version,
+                            "labels": {"pool": None, "user": username},
+                            # The pod may be older than the idle TTL already
+                            "annotations": {LAST_USED_ANNOTATION: str(int(time.time())), **annotations}
+                        }
+                    }
+                )
+                logger.info(f"Claimed warm pod {pod_name} for user {username}")
+                return pod_name
+            except ApiException as e:
+                if e.status not in (404, 409):
+                    logger.warning(f"Failed to claim warm pod {pod_name}: {e}")
+        
+        return None
+    
+    def _is_pool_pod_stale(self, pod) -> bool:
+        """A pool pod past half its sleep timeout would leave the user too little session time"""
+        created_at = int((pod.metadata.annotations or {}).get("created-at", "0"))
+        return time.time() - created_at > settings.POD_TIMEOUT_SECONDS / 2
+    
+    def _refill_warm_pool(self):
+        """Create pool pods until the warm pool reaches its target size"""
+        try:
+            # Finished pool pods are left for cleanup_old_pods
+            pods = self._list_pods({"pool": "warm"}, phases=("Pending", "Running"))
+        except ApiException as e:
+            logger.warning(f"Failed to list warm pool pods: {e}")
+            return
+        
+        live_count = 0
+        for pod in pods:
+            if self._is_pool_pod_stale(pod):
+                try:
+                    self.delete_pod(pod.metadata.name)
+                    logger.info(f"Recycled stale warm pod {pod.metadata.name}")
+                except Exception as e:
+                    logger.warning(f"Failed to recycle warm pod {pod.metadata.name}: {e}")
+                continue
+            live_count += 1
+        
+        for _ in range(settings.WARM_POOL_SIZE - live_count):
+            pod_id = self._generate_pod_id("pool")
+            try:
+                self.v1.create_namespaced_pod(
+                    namespace=self.namespace,
+                    body=self._build_pod(pod_id, {"pool": "warm"})
+                )
+                logger.info(f"Created warm pool pod {pod_id}")
+            except ApiException as e:
+                logger.warning(f"Failed to create warm pool pod: {e}")
+                return
+    
+    def _warm_pool_loop(self):
+        """Background loop keeping the warm pool filled"""
+        while not self._pool_stop.is_set():
+            if self.is_leader():
+                self._refill_warm_pool()
+            self._pool_wakeup.wait(settings.WARM_POOL_REFILL_INTERVAL_SECONDS)
+            self._pool_wakeup.clear()
+    
+    def start_warm_pool(self):
+        """Start the background warm pool refill thread"""
+        if not self.enabled or settings.WARM_POOL_SIZE <= 0:
+            return
+        if self._pool_thread and self._pool_thread.is_alive():
+            return
+        
+        self._pool_stop.clear()
+        self._pool_thread = threading.Thread(
+            target=self._warm_pool_loop,
+            name="warm-pool-refill",
+            daemon=True
+        )
+        self._pool_thread.start()
+        logger.info(f"Warm pod pool started with target size {settings.WARM_POOL_SIZE}")
+    
+    def stop_warm_pool(self):
+        """Stop the background warm pool refill thread"""
+        self._pool_stop.set()
+        self._pool_wakeup.set()
+        if self._pool_thread:
+            self._pool_thread.join(timeout=5)
+            self._pool_thread = None
+    
+    def get_warm_pool_stats(self) -> dict:
+        """Get warm pool hit/miss counters for sizing the pool"""
+        with self._pool_lock:
+            hits, misses = self._pool_hits, self._pool_misses
+        claims = hits + misses
+        return {
+            "target_size": settings.WARM_POOL_SIZE,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / claims, 3) if claims else None
+        }
+    
+    def _wait_for_pod_ready(self, pod_id: str, timeout: int = 60,
+                            on_phase: Optional[Callable[[str, str], None]] = None):
+        """Wait for pod to be in running state, reporting phase changes to on_phase"""
+        last_phase = None
+        
+        def report(pod):
+            nonlocal last_phase
+            phase = describe_pod_phase(pod)
+            if on_phase and phase != last_phase:
+                on_phase(pod_id, phase)
+            last_phase = phase
+        
+        if self._cache_ready():
+            def settled(pod):
+                if pod is None:
+                    return False
+                report(pod)
+                return pod.status.phase in ("Running", "Failed", "Succeeded")
+            
+            try:
+                pod = self.pod_cache.wait_for(pod_id, settled, timeout)
+            except TimeoutError:
+                raise Exception("Pod failed to become ready within timeout")
+            if pod.status.phase != "Running":
+                raise Exception(f"Pod exited before becoming ready: {pod.status.phase}")
+            logger.info(f"Pod {pod_id} is ready")
+            return
+        
         start_time = time.time()
         while time.time() - start_time < timeout:
             try:
                 pod = self.v1.read_namespaced_pod(name=pod_id, namespace=self.namespace)
+                report(pod)
                 if pod.status.phase == "Running":
                     logger.info(f"Pod {pod_id} is ready")
                     return
@@ -131,55 +495,456 @@ class K8sService:
         
         raise Exception("Pod failed to become ready within timeout")
     
-    def execute_command(self, pod_id: str, command: str) -> tuple:
-        """Execute command in pod and return output and exit code"""
+    def stream_command(self, pod_id: str, command: str, on_output: Callable[[str, str], None],
+                       timeout: Optional[int] = None, session: Optional[ShellSession] = None,
+                       command_id: Optional[str] = None) -> int:
+        """
+        Execute command in pod, passing output frames to on_output as they arrive.
+        
+        on_output is called with ("stdout" | "stderr", data) on the exec thread; if it
+        blocks, reading from the pod pauses too, which propagates backpressure to the
+        kubelet. Commands go through the given session, else the pod's persistent
+        exec session when sessions are enabled. A command still running after timeout seconds (default
+        COMMAND_TIMEOUT_SECONDS), or cancelled through cancel_command with
+        command_id, has its process group killed and reports TIMEOUT_EXIT_CODE or
+        CANCELLED_EXIT_CODE. Returns the exit code.
+        """
+        return self._run_command(pod_id, command, on_output, timeout, session, command_id)[0]
+    
+    def _run_command(self, pod_id: str, command: str, on_output: Callable[[str, str], None],
+                     timeout: Optional[int], session: Optional[ShellSession],
+                     command_id: Optional[str]) -> Tuple[int, Optional[str]]:
+        """
+        stream_command, also returning how the backend interrupted the command.
+        
+        The second value is "timeout" or "cancelled" when the command was stopped
+        here, and None when it exited on its own, whatever its exit code, so a
+        command exiting 124 or 130 by itself is not mistaken for an interruption.
+        """
         if not self.enabled:
             raise Exception("Kubernetes not available. Shell functionality disabled for local development.")
         
+        timeout = timeout or settings.COMMAND_TIMEOUT_SECONDS
+        control = CommandControl(timeout, command_id or secrets.token_hex(8))
+        start = time.perf_counter()
+        outcome = "error"
+        self._begin_inflight(pod_id, control)
+        
         try:
-            cmd = ["/bin/sh", "-c", command]
+            if session is not None:
+                session.ensure_open(control)
+                exit_code = session.run(command, on_output, control)
+            elif self.sessions:
+                exit_code = self.sessions.run(pod_id, command, on_output, control)
+            else:
+                exit_code = self._stream_oneshot(pod_id, command, on_output, control)
+            outcome = "completed"
+        except CommandInterrupted as e:
+            if e.started:
+                self._kill_command(pod_id, control)
+            if e.exit_code == TIMEOUT_EXIT_CODE:
+                waiting = "" if e.started else " waiting for the previous command"
+                on_output("stderr", f"\nCommand timed out after {timeout} seconds{waiting}\n")
+                outcome = "timeout"
+            else:
+                on_output("stderr", "\nCommand cancelled\n")
+                outcome = "cancelled"
+            exit_code = e.exit_code
+        finally:
+            EXEC_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+            self._end_inflight(pod_id, control)
+        
+        logger.info(f"Command executed in pod {pod_id}: exit_code={exit_code}")
+        return exit_code, outcome if outcome in ("timeout", "cancelled") else None
+    
+    def _stream_oneshot(self, pod_id: str, command: str, on_output: Callable[[str, str], None],
+                        control: CommandControl) -> int:
+        """Run command in its own exec stream, as the leader of a new process group"""
+        cmd = PROCESS_GROUP_PREFIX + ["/bin/sh", "-c", command]
+        header = ""
+        
+        resp = stream(
+            self.v1.connect_get_namespaced_pod_exec,
+            pod_id,
+            self.namespace,
+            command=cmd,
+            stderr=True,
+            stdin=False,
+            stdout=True,
+            tty=False,
+            _preload_content=False
+        )
+        
+        try:
+            while resp.is_open():
+                control.check()
+                resp.update(timeout=1)
+                if resp.peek_stdout():
+                    data = resp.read_stdout()
+                    if control.pgid is None:
+                        # The first line is the process group, not output
+                        header += data
+                        data = ""
+                        if "\n" in header:
+                            pgid, data = header.split("\n", 1)
+                            control.pgid = int(pgid)
+                    if data:
+                        on_output("stdout", data)
+                if resp.peek_stderr():
+                    on_output("stderr", resp.read_stderr())
+            
+            return resp.returncode if hasattr(resp, 'returncode') else 0
+        finally:
+            resp.close()
+    
+    def _begin_inflight(self, pod_id: str, control: CommandControl):
+        """Register work running in the pod, so it can be cancelled and is not reaped meanwhile"""
+        with self._inflight_lock:
+            self._inflight.setdefault(pod_id, set()).add(control)
+        self.reaper.touch(pod_id)
+        self._note_speculation_used(pod_id)
+    
+    def _end_inflight(self, pod_id: str, control: CommandControl):
+        with self._inflight_lock:
+            controls = self._inflight.get(pod_id)
+            controls.discard(control)
+            if not controls:
+                del self._inflight[pod_id]
+        self.reaper.touch(pod_id)
+    
+    def _exec_binary(self, pod_id: str, command: List[str], control: CommandControl,
+                     on_stdout: Optional[Callable[[bytes], None]] = None,
+                     next_chunk: Optional[Callable[[], Optional[bytes]]] = None):
+        """
+        Run command in its own exec stream with binary stdin and stdout.
+        
+        next_chunk, if given, is called for data to write to stdin until it
+        returns None; stdout frames are passed to on_stdout as they arrive. Both
+        run on the exec thread and may block, which pauses the stream. Raises
+        FileTransferError with the command's error output if it exits non-zero.
+        """
+        frames = ExecFrames(stream(
+            self.v1.connect_get_namespaced_pod_exec,
+            pod_id,
+            self.namespace,
+            command=command,
+            stderr=True,
+            stdin=next_chunk is not None,
+            stdout=True,
+            tty=False,
+            _preload_content=False
+        ))
+        errors = OutputBuffer(4096)
+        
+        def take(frame):
+            channel, data = frame
+            if channel == STDOUT_CHANNEL:
+                if on_stdout is not None:
+                    on_stdout(data)
+            else:
+                errors.write(data)
+        
+        try:
+            if next_chunk is not None:
+                while True:
+                    control.check()
+                    chunk = next_chunk()
+                    if chunk is None:
+                        break
+                    frames.write(chunk)
+                    frame = frames.read(0)
+                    while frame:
+                        take(frame)
+                        frame = frames.read(0)
             
-            resp = stream(
+            while frames.open:
+                control.check()
+                frame = frames.read(1)
+                if frame:
+                    take(frame)
+            exit_code, message = frames.exit_status()
+        finally:
+            frames.close()
+        
+        if exit_code != 0:
+            raise FileTransferError(errors.getvalue().strip() or message or f"exit code {exit_code}")
+    
+    def _run_transfer(self, pod_id: str, command: List[str], **kwargs):
+        """_exec_binary as tracked, cancellable work bounded by FILE_TRANSFER_TIMEOUT_SECONDS"""
+        if not self.enabled:
+            raise Exception("Kubernetes not available. Shell functionality disabled for local development.")
+        
+        control = CommandControl(settings.FILE_TRANSFER_TIMEOUT_SECONDS)
+        self._begin_inflight(pod_id, control)
+        try:
+            self._exec_binary(pod_id, command, control, **kwargs)
+        except CommandInterrupted as e:
+            # Closing the stream breaks tar's pipes, so it exits without a kill
+            if e.exit_code == TIMEOUT_EXIT_CODE:
+                raise FileTransferError(f"Transfer timed out after {settings.FILE_TRANSFER_TIMEOUT_SECONDS} seconds")
+            raise FileTransferError("Transfer cancelled")
+        finally:
+            self._end_inflight(pod_id, control)
+    
+    def measure_path(self, pod_id: str, path: str) -> int:
+        """Disk usage in bytes of a file or directory tree in the pod; relative paths start at $HOME"""
+        output = bytearray()
+        self._run_transfer(
+            pod_id,
+            ["/bin/sh", "-c", 'cd "$HOME" && du -sk -- "$1"', "tempshell-du", path],
+            on_stdout=output.extend
+        )
+        return int(output.split()[0]) * 1024
+    
+    def upload_archive(self, pod_id: str, dest: str, size: int,
+                       next_chunk: Callable[[], Optional[bytes]], gzip: bool = False, keep_newer: bool = False):
+        """
+        Extract a tar archive of size bytes into the directory dest in the pod.
+        
+        The archive is read piece by piece from next_chunk (None ends it) and
+        written straight to tar's stdin, so it is never held in memory. The exec
+        protocol cannot close stdin, so `head -c size` ends tar's input instead.
+        keep_newer leaves files alone that are newer in the pod than in the
+        archive. Raises FileTransferError with tar's error output if extraction fails.
+        """
+        flags = " ".join(flag for flag, on in (("-z", gzip), ("--keep-newer-files", keep_newer)) if on)
+        script = 'cd "$HOME" && mkdir -p -- "$3" && head -c "$1" | tar -x $2 -f - -C "$3"'
+        self._run_transfer(
+            pod_id,
+            ["/bin/sh", "-c", script, "tempshell-upload", str(size), flags, dest],
+            next_chunk=next_chunk
+        )
+        logger.info(f"Uploaded {size} bytes to {dest} in pod {pod_id}")
+    
+    def download_archive(self, pod_id: str, path: str, on_chunk: Callable[[bytes], None], gzip: bool = False):
+        """
+        Stream a tar archive of path (a file or directory) in the pod to on_chunk.
+        
+        on_chunk gets stdout frames as tar produces them and may block to slow
+        it down. Raises FileTransferError if tar fails, possibly after some of
+        the archive was already passed on.
+        """
+        script = 'cd "$HOME" && exec tar -c $1 -f - -C "$(dirname -- "$2")" -- "$(basename -- "$2")"'
+        self._run_transfer(
+            pod_id,
+            ["/bin/sh", "-c", script, "tempshell-download", "-z" if gzip else "", path],
+            on_stdout=on_chunk
+        )
+        logger.info(f"Downloaded {path} from pod {pod_id}")
+    
+    def archive_home(self, pod_id: str, on_chunk: Callable[[bytes], None]):
+        """
+        Stream a tar archive of the pod's home directory to on_chunk.
+        
+        Files changing or vanishing while they are read are archived as found
+        rather than failing the archive (tar's exit status 1).
+        """
+        script = 'cd "$HOME" && tar -c --ignore-failed-read -f - . ; test $? -le 1'
+        self._run_transfer(pod_id, ["/bin/sh", "-c", script, "tempshell-snapshot"], on_stdout=on_chunk)
+    
+    def _kill_command(self, pod_id: str, control: CommandControl):
+        """
+        Kill the process group of an interrupted command.
+        
+        Closing an exec stream does not stop what it started, so interrupted
+        commands are killed explicitly. Each command runs in a process group of
+        its own (for a session, the session's), so other commands and transfers
+        in the pod keep running. Processes that started a new session of their
+        own escape the kill.
+        """
+        if control.pgid is None:
+            logger.warning(f"Process group of interrupted command in pod {pod_id} unknown, not killed")
+            return
+        try:
+            stream(
                 self.v1.connect_get_namespaced_pod_exec,
                 pod_id,
                 self.namespace,
-                command=cmd,
+                command=["/bin/sh", "-c", f"kill -9 -{control.pgid}"],
                 stderr=True,
                 stdin=False,
                 stdout=True,
-                tty=False,
-                _preload_content=False
+                tty=False
+            )
+            logger.info(f"Killed process group {control.pgid} in pod {pod_id}")
+        except Exception as e:
+            logger.warning(f"Failed to kill process group {control.pgid} in pod {pod_id}: {e}")
+    
+    def _note_speculation_used(self, pod_id: str):
+        """
+        Count the first command in a pod provisioned speculatively at login
+        
+        Needs the pod cache to see the annotation without an API call; the
+        annotation itself is flipped to "used" in the background so the
+        reaper and other replicas no longer count the pod as unused.
+        """
+        if not self._cache_ready():
+            return
+        pod = self.pod_cache.get(pod_id)
+        if pod is None or (pod.metadata.annotations or {}).get(SPECULATIVE_ANNOTATION) != "unused":
+            return
+        with self._inflight_lock:
+            if pod_id in self._speculation_used:
+                return
+            self._speculation_used.add(pod_id)
+        SPECULATIVE_PODS.labels("used").inc()
+        get_executor(K8S).submit(self._mark_speculation_used, pod_id)
+    
+    def _mark_speculation_used(self, pod_id: str):
+        try:
+            self.annotate_pod(pod_id, {SPECULATIVE_ANNOTATION: "used"})
+        except ApiException as e:
+            if e.status != 404:
+                logger.warning(f"Failed to mark speculative pod {pod_id} used: {e}")
+    
+    def has_inflight(self, pod_id: str) -> bool:
+        """Whether a command is running in the pod"""
+        with self._inflight_lock:
+            return pod_id in self._inflight
+    
+    def cancel_command(self, pod_id: str, command_id: Optional[str] = None) -> bool:
+        """
+        Cancel one command in flight in a pod; returns whether there was one.
+        
+        Cancels the command started with command_id, or without one the most
+        recently started command. File transfers are not commands and are left
+        running.
+        """
+        with self._inflight_lock:
+            controls = [
+                control for control in self._inflight.get(pod_id, ())
+                if control.command_id is not None and command_id in (None, control.command_id)
+            ]
+        if not controls:
+            return False
+        max(controls, key=lambda control: control.started).cancel()
+        return True
+    
+    def execute_command(self, pod_id: str, command: str, timeout: Optional[int] = None,
+                        session: Optional[ShellSession] = None, command_id: Optional[str] = None) -> dict:
+        """
+        Execute command in pod and return its captured output and exit code.
+        
+        stdout and stderr are each captured into an OutputBuffer of up to
+        MAX_OUTPUT_BYTES, so memory per exec grows with the output but stays
+        under twice that regardless of output volume. Each stream is returned
+        with its own truncation flag, and output combines them for display.
+        interrupted is "timeout" or "cancelled" when the backend stopped the
+        command, else None.
+        """
+        if not self.enabled:
+            raise Exception("Kubernetes not available. Shell functionality disabled for local development.")
+        
+        buffers = {
+            "stdout": OutputBuffer(settings.MAX_OUTPUT_BYTES),
+            "stderr": OutputBuffer(settings.MAX_OUTPUT_BYTES)
+        }
+        
+        try:
+            exit_code, interrupted = self._run_command(
+                pod_id,
+                command,
+                lambda channel, data: buffers[channel].write(data),
+                timeout,
+                session,
+                command_id
             )
-            
-            output = ""
-            error_output = ""
-            
-            while resp.is_open():
-                resp.update(timeout=1)
-                if resp.peek_stdout():
-                    output += resp.read_stdout()
-                if resp.peek_stderr():
-                    error_output += resp.read_stderr()
-            
-            # Combine stdout and stderr
-            full_output = output
-            if error_output:
-                full_output += "\n" + error_output
-            
-            exit_code = resp.returncode if hasattr(resp, 'returncode') else 0
-            
-            logger.info(f"Command executed in pod {pod_id}: exit_code={exit_code}")
-            return full_output.strip() if full_output else "(no output)", exit_code
-            
         except ApiException as e:
             logger.error(f"Command execution failed in pod {pod_id}: {e}")
-            return f"Error: {e.reason}", 1
+            return self._command_result(f"Error: {e.reason}", 1)
         except Exception as e:
             logger.error(f"Unexpected error during command execution: {e}")
-            return f"Error: {str(e)}", 1
+            return self._command_result(f"Error: {str(e)}", 1)
+        
+        bytes_total = buffers["stdout"].bytes_total + buffers["stderr"].bytes_total
+        EXEC_OUTPUT_BYTES.observe(bytes_total)
+        
+        stdout = buffers["stdout"].getvalue()
+        stderr = buffers["stderr"].getvalue()
+        
+        # Combine stdout and stderr
+        full_output = stdout
+        if stderr:
+            full_output += "\n" + stderr
+        
+        return {
+            "output": full_output.strip() if full_output else "(no output)",
+            "stdout": stdout,
+            "stderr": stderr,
+            "exit_code": exit_code,
+            "interrupted": interrupted,
+            "truncated": buffers["stdout"].truncated or buffers["stderr"].truncated,
+            "stdout_truncated": buffers["stdout"].truncated,
+            "stderr_truncated": buffers["stderr"].truncated,
+            "bytes_total": bytes_total
+        }
+    
+    def execute_batch(self, pod_id: str, commands: List[Tuple[str, Optional[int], Optional[str]]],
+                      stop_on_error: bool = False) -> Tuple[List[dict], str]:
+        """
+        Execute (command, timeout, command_id) triples in order over one exec stream.
+        
+        Uses the pod's persistent session when sessions are enabled, otherwise a
+        shell opened for the batch alone. The whole batch shares a deadline of
+        BATCH_TIMEOUT_SECONDS, and each command's timeout is cut to what is left
+        of it. Returns one execute_command result per command that ran, and the
+        batch status: "completed", or what ended it; "cancelled" after a
+        cancelled command, "failed" after a non-zero exit code when
+        stop_on_error is set, "timed_out" when the deadline was reached.
+        """
+        if not self.enabled:
+            raise Exception("Kubernetes not available. Shell functionality disabled for local development.")
+        
+        deadline = time.monotonic() + settings.BATCH_TIMEOUT_SECONDS
+        session = None if self.sessions else ShellSession(self.v1, self.namespace, pod_id)
+        results = []
+        status = "completed"
+        try:
+            for command, timeout, command_id in commands:
+                remaining = math.ceil(deadline - time.monotonic())
+                if remaining <= 0:
+                    status = "timed_out"
+                    break
+                timeout = timeout or settings.COMMAND_TIMEOUT_SECONDS
+                result = self.execute_command(pod_id, command, min(timeout, remaining), session, command_id)
+                results.append(result)
+                if result["interrupted"] == "cancelled":
+                    status = "cancelled"
+                    break
+                if result["interrupted"] == "timeout" and remaining < timeout:
+                    status = "timed_out"
+                    break
+                if stop_on_error and result["exit_code"] != 0:
+                    status = "failed"
+                    break
+        finally:
+            if session is not None:
+                session.close()
+        
+        return results, status
+    
+    def _command_result(self, error: str, exit_code: int) -> dict:
+        """Build an execute_command result for a command that could not run"""
+        return {
+            "output": error,
+            "stdout": "",
+            "stderr": error,
+            "exit_code": exit_code,
+            "interrupted": None,
+            "truncated": False,
+            "stdout_truncated": False,
+            "stderr_truncated": False,
+            "bytes_total": 0
+        }
     
     def delete_pod(self, pod_id: str):
         """Delete user pod"""
+        if self.sessions:
+            self.sessions.close(pod_id)
+        self.reaper.forget(pod_id)
+        with self._inflight_lock:
+            self._speculation_used.discard(pod_id)
+        
         try:
             self.v1.delete_namespaced_pod(
                 name=pod_id,
@@ -194,12 +959,43 @@ class K8sService:
                 logger.error(f"Failed to delete pod {pod_id}: {e}")
                 raise Exception(f"Failed to delete shell environment: {e.reason}")
     
+    def read_pod(self, pod_id: str):
+        """The pod object, from the watch cache when it is synced; None if it does not exist"""
+        if self._cache_ready():
+            return self.pod_cache.get(pod_id)
+        try:
+            return self.v1.read_namespaced_pod(name=pod_id, namespace=self.namespace)
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+    
+    def hibernate_pod(self, pod_id: str, pod=None):
+        """
+        Delete a user pod, first snapshotting its home directory when HIBERNATE_ENABLED.
+        
+        A failed snapshot is logged and the pod deleted anyway. pod is the
+        pod object if the caller already has it.
+        """
+        if self.hibernator.enabled:
+            self.hibernator.snapshot_pod(pod_id, pod)
+        self.delete_pod(pod_id)
+    
     def get_pod_status(self, pod_id: str) -> dict:
-        """Get status of a pod"""
+        """Get status of a pod, answered from the watch cache when it is synced"""
+        if self._cache_ready():
+            pod = self.pod_cache.get(pod_id)
+            if pod is None:
+                return {"status": "not_found", "created_at": None}
+            return {
+                "status": describe_pod_phase(pod),
+                "created_at": pod.metadata.creation_timestamp
+            }
+        
         try:
             pod = self.v1.read_namespaced_pod(name=pod_id, namespace=self.namespace)
             return {
-                "status": pod.status.phase,
+                "status": describe_pod_phase(pod),
                 "created_at": pod.metadata.creation_timestamp
             }
         except ApiException as e:
@@ -208,6 +1004,34 @@ class K8sService:
             logger.error(f"Failed to get pod status: {e}")
             return {"status": "error", "created_at": None}
     
+    def list_user_pods(self) -> list:
+        """List pending and running pods assigned to users"""
+        return [pod for pod in self._list_pods({}, phases=("Pending", "Running"))
+                if "user" in (pod.metadata.labels or {})]
+    
+    def annotate_pod(self, pod_id: str, annotations: dict):
+        """Merge annotations into a pod's metadata"""
+        self.v1.patch_namespaced_pod(
+            name=pod_id,
+            namespace=self.namespace,
+            body={"metadata": {"annotations": annotations}}
+        )
+    
+    def count_active_pods(self) -> int:
+        """Count running pods assigned to users"""
+        if not self.enabled:
+            return 0
+        try:
+            return len([pod for pod in self._list_pods({}, phases=("Running",))
+                        if "user" in (pod.metadata.labels or {})])
+        except ApiException as e:
+            logger.warning(f"Failed to count active pods: {e}")
+            return 0
+    
+    def is_pod_ready(self, pod_id: str) -> bool:
+        """Whether a pod is running and can accept exec sessions"""
+        return self.get_pod_status(pod_id)["status"] == "Running"
+    
     def cleanup_old_pods(self):
         """Clean up all old tempshell user pods (except running ones)"""
         if not self.enabled:
@@ -218,7 +1042,7 @@ class K8sService:
             # List all pods with tempshell label
             pods = self.v1.list_namespaced_pod(
                 namespace=self.namespace,
-                label_selector="managed-by=tempshell-backend"
+                label_selector=MANAGED_BY_SELECTOR
             )
             
             cleaned_count = 0
@@ -0,0 +1,146 @@
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class LeaderElector:
+    """
+    Leader election among backend replicas through a coordination.k8s.io Lease.
+
+    The holder renews the lease every lease_duration / 3 seconds; any other
+    replica may take it over once it has gone lease_duration seconds without
+    renewal. Every write carries the lease's resourceVersion, so two replicas
+    racing for an expired lease cannot both win. A leader that fails to renew
+    before its own lease would expire steps down on its own. Callbacks run on
+    the election thread.
+    """
+
+    def __init__(self, api: client.CoordinationV1Api, namespace: str, name: str, identity: str,
+                 lease_duration: int = 15,
+                 on_started_leading: Optional[Callable[[], None]] = None,
+                 on_stopped_leading: Optional[Callable[[], None]] = None):
+        self.api = api
+        self.namespace = namespace
+        self.name = name
+        self.identity = identity
+        self.lease_duration = lease_duration
+        self.on_started_leading = on_started_leading
+        self.on_stopped_leading = on_stopped_leading
+
+        self._leading = threading.Event()
+        self._renewed_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leading.is_set()
+
+    def _spec(self, now: datetime, transitions: int, acquire_time: datetime) -> client.V1LeaseSpec:
+        return client.V1LeaseSpec(
+            holder_identity=self.identity,
+            lease_duration_seconds=self.lease_duration,
+            acquire_time=acquire_time,
+            renew_time=now,
+            lease_transitions=transitions
+        )
+
+    def _try_acquire_or_renew(self) -> bool:
+        """Take or keep the lease; returns whether this replica holds it afterwards"""
+        now = datetime.now(timezone.utc)
+        try:
+            lease = self.api.read_namespaced_lease(self.name, self.namespace)
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            self.api.create_namespaced_lease(self.namespace, client.V1Lease(
+                metadata=client.V1ObjectMeta(name=self.name),
+                spec=self._spec(now, 0, now)
+            ))
+            return True
+
+        spec = lease.spec
+        if spec.holder_identity == self.identity:
+            lease.spec = self._spec(now, spec.lease_transitions or 0, spec.acquire_time or now)
+        else:
+            renewed = spec.renew_time or spec.acquire_time
+            duration = spec.lease_duration_seconds or self.lease_duration
+            if spec.holder_identity and renewed and renewed + timedelta(seconds=duration) > now:
+                return False  # Held by a live replica
+            lease.spec = self._spec(now, (spec.lease_transitions or 0) + 1, now)
+
+        # Fails with 409 if another replica wrote the lease since we read it
+        self.api.replace_namespaced_lease(self.name, self.namespace, lease)
+        return True
+
+    def _set_leading(self, leading: bool):
+        if leading == self.is_leader:
+            return
+        if leading:
+            self._leading.set()
+            logger.info(f"{self.identity} became leader")
+            callback = self.on_started_leading
+        else:
+            self._leading.clear()
+            logger.info(f"{self.identity} stopped leading")
+            callback = self.on_stopped_leading
+        if callback:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Leader election callback failed: {e}")
+
+    def _run(self):
+        retry = max(1.0, self.lease_duration / 3)
+        while not self._stop.is_set():
+            try:
+                held = self._try_acquire_or_renew()
+                if held:
+                    self._renewed_at = datetime.now(timezone.utc)
+                self._set_leading(held)
+            except ApiException as e:
+                if e.status != 409:
+                    logger.warning(f"Leader election failed: {e}")
+                self._step_down_if_expiring(retry)
+            except Exception as e:
+                # e.g. urllib3's MaxRetryError while the API server is unreachable
+                logger.warning(f"Leader election error: {e}")
+                self._step_down_if_expiring(retry)
+            self._stop.wait(retry)
+
+    def _step_down_if_expiring(self, retry: float):
+        """Keep leading only while our last renewal is still valid for another retry interval"""
+        if self.is_leader and (
+            self._renewed_at is None
+            or datetime.now(timezone.utc) - self._renewed_at >= timedelta(seconds=self.lease_duration - retry)
+        ):
+            self._set_leading(False)
+
+    def start(self):
+        """Start campaigning for the lease"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop campaigning and hand the lease back so another replica can take over at once"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if not self.is_leader:
+            return
+        try:
+            lease = self.api.read_namespaced_lease(self.name, self.namespace)
+            if lease.spec.holder_identity == self.identity:
+                lease.spec.holder_identity = None
+                self.api.replace_namespaced_lease(self.name, self.namespace, lease)
+        except ApiException as e:
+            logger.warning(f"Failed to release leader lease: {e}")
+        self._set_leading(False)
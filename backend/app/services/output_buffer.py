@@ -0,0 +1,73 @@
+class OutputBuffer:
+    """
+    Bounded capture of a command's output that keeps the head and the tail.
+
+    Memory per buffer grows with the output up to limit and no further, so
+    short outputs cost what they print. The first half of the limit holds the
+    start of the output; the second half becomes a ring buffer once full and
+    always holds the most recent bytes. Everything in between is counted but
+    dropped.
+    """
+
+    def __init__(self, limit: int):
+        self._head_size = limit // 2
+        self._tail_size = limit - self._head_size
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._tail_start = 0  # Oldest byte of the ring once the tail is full
+        self.bytes_total = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self.bytes_total > self._head_size + self._tail_size
+
+    def write(self, data):
+        """Append output, accepting str (encoded as UTF-8) or bytes"""
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        view = memoryview(data)
+        self.bytes_total += len(view)
+
+        # Fill the head first
+        room = self._head_size - len(self._head)
+        if room > 0:
+            chunk = view[:room]
+            self._head += chunk
+            view = view[len(chunk):]
+
+        capacity = self._tail_size
+        if not view or capacity == 0:
+            return
+
+        # Only the last `capacity` bytes can survive in the tail
+        if len(view) >= capacity:
+            self._tail[:] = view[-capacity:]
+            self._tail_start = 0
+            return
+
+        # Grow the tail until it reaches capacity
+        room = capacity - len(self._tail)
+        if room > 0:
+            chunk = view[:room]
+            self._tail += chunk
+            view = view[len(chunk):]
+            if not view:
+                return
+
+        # Full: overwrite the oldest bytes
+        first = min(len(view), capacity - self._tail_start)
+        self._tail[self._tail_start:self._tail_start + first] = view[:first]
+        self._tail[:len(view) - first] = view[first:]
+        self._tail_start = (self._tail_start + len(view)) % capacity
+
+    def _tail_bytes(self) -> bytes:
+        return bytes(self._tail[self._tail_start:]) + bytes(self._tail[:self._tail_start])
+
+    def getvalue(self) -> str:
+        """Decode the captured output, marking where bytes were dropped"""
+        head = bytes(self._head).decode("utf-8", errors="replace")
+        tail = self._tail_bytes().decode("utf-8", errors="replace")
+        if not self.truncated:
+            return head + tail
+        dropped = self.bytes_total - len(self._head) - len(self._tail)
+        return f"{head}\n... [{dropped} bytes truncated] ...\n{tail}"
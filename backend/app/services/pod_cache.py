@@ -0,0 +1,155 @@
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+from typing import Callable, List, Optional
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class PodCache:
+    """
+    Informer-style in-memory cache of pods matching a label selector.
+
+    A single background thread does a list followed by a watch from the
+    list's resourceVersion, so status and readiness queries are answered
+    from memory instead of a read_namespaced_pod round trip each.
+    """
+
+    def __init__(self, v1, namespace: str, label_selector: str, watch_timeout: int = 300):
+        self.v1 = v1
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.watch_timeout = watch_timeout
+
+        self._pods = {}
+        self._resource_version = None
+        self._changed = threading.Condition()
+        self._synced = threading.Event()
+        self._stop = threading.Event()
+        self._watch = None
+        self._thread = None
+
+    @property
+    def synced(self) -> bool:
+        """Whether the cache holds a complete view of the watched pods"""
+        return self._synced.is_set()
+
+    def start(self):
+        """Start the list+watch thread"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pod-cache-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the list+watch thread"""
+        self._stop.set()
+        if self._watch:
+            self._watch.stop()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._synced.clear()
+
+    def wait_until_synced(self, timeout: float) -> bool:
+        """Block until the initial list has been loaded"""
+        return self._synced.wait(timeout)
+
+    def get(self, name: str):
+        """Get a cached pod by name, or None if it does not exist"""
+        with self._changed:
+            return self._pods.get(name)
+
+    def list(self, predicate: Callable = None) -> List:
+        """List cached pods, optionally filtered by a predicate"""
+        with self._changed:
+            pods = list(self._pods.values())
+        if predicate:
+            pods = [pod for pod in pods if predicate(pod)]
+        return pods
+
+    def wait_for(self, name: str, predicate: Callable, timeout: float) -> Optional[object]:
+        """
+        Block until the named pod satisfies predicate(pod) or the timeout expires.
+
+        The predicate is called with None while the pod is absent. Returns the
+        pod that satisfied the predicate, or raises TimeoutError.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while True:
+                pod = self._pods.get(name)
+                if predicate(pod):
+                    return pod
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Timed out waiting for pod {name}")
+                self._changed.wait(remaining)
+
+    def _relist(self):
+        """Replace the cache contents with a fresh list"""
+        pods = self.v1.list_namespaced_pod(
+            namespace=self.namespace,
+            label_selector=self.label_selector
+        )
+        with self._changed:
+            self._pods = {pod.metadata.name: pod for pod in pods.items}
+            self._resource_version = pods.metadata.resource_version
+            self._changed.notify_all()
+        self._synced.set()
+        logger.info(f"Pod cache synced with {len(pods.items)} pods")
+
+    def _apply(self, event_type: str, pod):
+        """Apply a single watch event"""
+        with self._changed:
+            if event_type == "DELETED":
+                self._pods.pop(pod.metadata.name, None)
+            elif event_type in ("ADDED", "MODIFIED"):
+                self._pods[pod.metadata.name] = pod
+            self._resource_version = pod.metadata.resource_version
+            self._changed.notify_all()
+
+    def _run(self):
+        """List+watch loop, relisting whenever the watch falls too far behind"""
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                if self._resource_version is None:
+                    self._relist()
+
+                self._watch = watch.Watch()
+                for event in self._watch.stream(
+                    self.v1.list_namespaced_pod,
+                    namespace=self.namespace,
+                    label_selector=self.label_selector,
+                    resource_version=self._resource_version,
+                    timeout_seconds=self.watch_timeout,
+                    allow_watch_bookmarks=True
+                ):
+                    if self._stop.is_set():
+                        break
+                    if event["type"] == "BOOKMARK":
+                        self._resource_version = event["object"].metadata.resource_version
+                        continue
+                    self._apply(event["type"], event["object"])
+                backoff = 1
+            except ApiException as e:
+                if e.status == 410:
+                    # Our resourceVersion is too old to resume from
+                    logger.info("Pod watch expired, relisting")
+                    self._resource_version = None
+                    continue
+                logger.warning(f"Pod watch failed: {e}")
+                self._resource_version = None
+                self._synced.clear()
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+            except Exception as e:
+                logger.warning(f"Pod watch error: {e}")
+                self._resource_version = None
+                self._synced.clear()
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
@@ -0,0 +1,180 @@
+from kubernetes.client.rest import ApiException
+from app.core.metrics import PODS_REAPED, SPECULATIVE_PODS
+from typing import Callable, Dict, Optional
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Pod annotation holding the last time (epoch seconds) a command ran in the pod
+LAST_USED_ANNOTATION = "last-used-at"
+
+# Pod annotation on pods provisioned speculatively at login: "unused" until a command runs
+SPECULATIVE_ANNOTATION = "speculative"
+
+class PodReaper:
+    """
+    Deletes user pods left idle and enforces a cluster-wide pod budget.
+
+    Each replica records when it last ran a command in a pod and copies that
+    time to the pod's last-used-at annotation once per pass, so replicas see
+    each other's activity. A pod is idle since the newest of that annotation,
+    the local record and its creation. Pods idle past idle_ttl are deleted;
+    if more than max_pods remain, the least recently used go first. Pods with
+    a command in flight are never reaped. With expire_after set, pods older
+    than that are reaped too, before their sleep runs out and takes their
+    home directory with it. Pods are deleted through hibernate_pod, which
+    snapshots them first when hibernation is enabled. on_reaped is called with
+    {pod_id: username} for the deleted pods so their users can be detached.
+
+    With several replicas, only the leader reaps; the others keep publishing
+    their activity so the leader sees it.
+    """
+
+    def __init__(self, k8s_service, idle_ttl: int, max_pods: int, interval: int,
+                 on_reaped: Optional[Callable[[Dict[str, str]], None]] = None, expire_after: int = 0):
+        self.k8s = k8s_service
+        self.idle_ttl = idle_ttl
+        self.max_pods = max_pods
+        self.expire_after = expire_after
+        self.interval = interval
+        self.on_reaped = on_reaped
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.k8s.enabled and (self.idle_ttl > 0 or self.max_pods > 0 or self.expire_after > 0)
+
+    def touch(self, pod_id: str):
+        """Record activity in a pod"""
+        with self._lock:
+            self._last_used[pod_id] = time.time()
+
+    def forget(self, pod_id: str):
+        """Drop the activity record of a deleted pod"""
+        with self._lock:
+            self._last_used.pop(pod_id, None)
+
+    def _last_used_at(self, pod) -> float:
+        annotations = pod.metadata.annotations or {}
+        with self._lock:
+            local = self._last_used.get(pod.metadata.name, 0.0)
+        return max(
+            local,
+            float(annotations.get(LAST_USED_ANNOTATION, "0")),
+            float(annotations.get("created-at", "0"))
+        )
+
+    def _publish_activity(self, pod):
+        """Copy newer local activity to the pod annotation for other replicas"""
+        annotations = pod.metadata.annotations or {}
+        with self._lock:
+            local = self._last_used.get(pod.metadata.name)
+        if local is None or local <= float(annotations.get(LAST_USED_ANNOTATION, "0")):
+            return
+        try:
+            self.k8s.annotate_pod(pod.metadata.name, {LAST_USED_ANNOTATION: str(int(local))})
+        except ApiException as e:
+            if e.status != 404:
+                logger.warning(f"Failed to record activity on pod {pod.metadata.name}: {e}")
+
+    def publish_activity(self):
+        """Copy this replica's activity records to the pod annotations"""
+        try:
+            pods = self.k8s.list_user_pods()
+        except ApiException as e:
+            logger.warning(f"Failed to list user pods for activity: {e}")
+            return
+        for pod in pods:
+            self._publish_activity(pod)
+
+    def reap(self) -> Dict[str, str]:
+        """Run one reaping pass and return {pod_id: username} for the deleted pods"""
+        try:
+            pods = self.k8s.list_user_pods()
+        except ApiException as e:
+            logger.warning(f"Failed to list user pods for reaping: {e}")
+            return {}
+
+        now = time.time()
+        candidates = []
+        for pod in pods:
+            self._publish_activity(pod)
+            if self.k8s.has_inflight(pod.metadata.name):
+                continue
+            candidates.append((self._last_used_at(pod), pod))
+        candidates.sort(key=lambda item: item[0])
+
+        victims = {}
+        if self.expire_after > 0:
+            for last_used, pod in candidates:
+                created_at = float((pod.metadata.annotations or {}).get("created-at", "0"))
+                if created_at and now - created_at > self.expire_after:
+                    victims[pod.metadata.name] = ("expiring", pod)
+
+        if self.idle_ttl > 0:
+            for last_used, pod in candidates:
+                if now - last_used > self.idle_ttl and pod.metadata.name not in victims:
+                    victims[pod.metadata.name] = ("idle", pod)
+
+        if self.max_pods > 0:
+            excess = len(pods) - len(victims) - self.max_pods
+            for last_used, pod in candidates:
+                if excess <= 0:
+                    break
+                if pod.metadata.name not in victims:
+                    victims[pod.metadata.name] = ("evicted", pod)
+                    excess -= 1
+
+        reaped = {}
+        for pod_id, (reason, pod) in victims.items():
+            username = pod.metadata.labels["user"]
+            try:
+                self.k8s.hibernate_pod(pod_id, pod)
+            except Exception as e:
+                logger.warning(f"Failed to reap pod {pod_id}: {e}")
+                continue
+            self.forget(pod_id)
+            PODS_REAPED.labels(reason).inc()
+            if (pod.metadata.annotations or {}).get(SPECULATIVE_ANNOTATION) == "unused":
+                SPECULATIVE_PODS.labels("reaped_unused").inc()
+            logger.info(f"Reaped pod {pod_id} of user {username} ({reason})")
+            reaped[pod_id] = username
+
+        if reaped and self.on_reaped:
+            try:
+                self.on_reaped(reaped)
+            except Exception as e:
+                logger.error(f"Failed to detach {len(reaped)} reaped pods from their users: {e}")
+        return reaped
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.k8s.is_leader():
+                self.reap()
+                self.k8s.hibernator.maybe_collect_garbage()
+            else:
+                self.publish_activity()
+
+    def start(self):
+        """Start the background reaping thread"""
+        if not self.enabled:
+            return
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pod-reaper", daemon=True)
+        self._thread.start()
+        logger.info(f"Pod reaper started (idle TTL {self.idle_ttl}s, budget {self.max_pods or 'unlimited'} pods)")
+
+    def stop(self):
+        """Stop the background reaping thread"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
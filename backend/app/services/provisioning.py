@@ -0,0 +1,122 @@
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+import asyncio
+import secrets
+import time
+
+# Statuses after which a provisioning no longer changes
+TERMINAL_STATUSES = ("Running", "Failed")
+
+# Seconds a finished provisioning stays visible to /status and event streams
+PROVISIONING_RETENTION_SECONDS = 60
+
+class Provisioning:
+    """Progress of one user's pod provisioning"""
+
+    __slots__ = ("id", "username", "status", "pod_id", "detail", "updated_at", "version")
+
+    def __init__(self, username: str):
+        self.id = secrets.token_urlsafe(8)
+        self.username = username
+        self.status = "Pending"
+        self.pod_id = None
+        self.detail = None
+        self.updated_at = datetime.utcnow()
+        self.version = 0
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self) -> dict:
+        return {
+            "provision_id": self.id,
+            "status": self.status,
+            "pod_id": self.pod_id,
+            "detail": self.detail
+        }
+
+class ProvisioningTracker:
+    """
+    Latest provisioning of each user, with change notifications for push channels.
+
+    Lives on the event loop: update() must be called from it, so updates from
+    Kubernetes threads go through loop.call_soon_threadsafe. State is per
+    replica; sticky routing sends a user's provision call and event stream to
+    the same one. Finished provisionings are dropped after
+    PROVISIONING_RETENTION_SECONDS, so a late poll still sees the outcome.
+    """
+
+    def __init__(self):
+        self._latest: Dict[str, Provisioning] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._finished: Deque[Tuple[float, Provisioning]] = deque()
+
+    def get(self, username: str) -> Optional[Provisioning]:
+        self._prune()
+        return self._latest.get(username)
+
+    def start(self, username: str) -> Provisioning:
+        """Begin tracking a provisioning, or return the one already in progress"""
+        current = self.get(username)
+        if current is not None and not current.done:
+            return current
+        provisioning = Provisioning(username)
+        self._latest[username] = provisioning
+        self._notify(username)
+        return provisioning
+
+    def update(self, username: str, status: str, pod_id: Optional[str] = None, detail: Optional[str] = None):
+        """Record a status change of the user's current provisioning"""
+        current = self._latest.get(username)
+        if current is None or current.done:
+            return
+        if current.status == status and pod_id in (None, current.pod_id):
+            return
+        current.status = status
+        current.pod_id = pod_id or current.pod_id
+        current.detail = detail
+        current.updated_at = datetime.utcnow()
+        current.version += 1
+        if current.done:
+            self._finished.append((time.monotonic(), current))
+        self._notify(username)
+
+    def _prune(self):
+        # Finished in order, so only the oldest can have expired
+        cutoff = time.monotonic() - PROVISIONING_RETENTION_SECONDS
+        while self._finished and self._finished[0][0] < cutoff:
+            _, provisioning = self._finished.popleft()
+            if self._latest.get(provisioning.username) is provisioning:
+                del self._latest[provisioning.username]
+
+    def _notify(self, username: str):
+        changed = self._changed.pop(username, None)
+        if changed is not None:
+            changed.set()
+
+    async def watch(self, username: str, heartbeat: float) -> AsyncIterator[Optional[dict]]:
+        """
+        Yield the user's provisioning as a dict now and after every change until it is done.
+
+        Yields nothing if the user has no provisioning, and None when nothing
+        changed for heartbeat seconds, so callers can keep idle connections alive.
+        """
+        seen = None
+        while True:
+            current = self.get(username)
+            if current is None:
+                return
+            if (current.id, current.version) != seen:
+                seen = (current.id, current.version)
+                yield current.to_dict()
+                if current.done:
+                    return
+            changed = self._changed.setdefault(username, asyncio.Event())
+            try:
+                await asyncio.wait_for(changed.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+provisionings = ProvisioningTracker()
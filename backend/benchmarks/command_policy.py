@@ -0,0 +1,95 @@
+"""
+Command validation cost as the deny list grows.
+
+Compares the previous validator (one re.search per rule, case-insensitive),
+a single compiled alternation of all rules, and CommandPolicy's prefix-indexed
+RuleMatcher over a corpus of typical shell commands, for the built-in rules
+and for synthetic rule sets of a few hundred entries. Nearly every real
+command is allowed, so this is the cost of a full scan without a match.
+
+Usage (from backend/):
+    python -m benchmarks.command_policy --rules 10,100,500 --iterations 20
+"""
+import argparse
+import os
+import re
+import time
+
+for _var in ("SECRET_KEY", "DB_HOST", "DB_USER", "DB_PASSWORD", "DB_NAME"):
+    os.environ.setdefault(_var, "benchmark")
+
+from app.core.command_policy import DEFAULT_DENY_RULES, compile_rules
+
+CORPUS = [
+    "ls -la",
+    "cd /home/tempuser && ls",
+    "pwd",
+    "cat /etc/os-release",
+    "echo $HOME",
+    "grep -rn 'TODO' src/ | head -20",
+    "find . -name '*.py' -newer setup.py -print",
+    "python3 -c 'import sys; print(sys.version)'",
+    "tar czf backup.tar.gz project/ --exclude=node_modules",
+    "curl -s https://example.com/api/items | jq '.[] | .name'",
+    "for i in $(seq 1 10); do echo line $i >> out.txt; done",
+    "git log --oneline --graph --decorate -n 50",
+    "awk -F: '{ print $1, $7 }' /etc/passwd | sort | uniq -c",
+    "ps aux --sort=-%mem | head",
+    "df -h && du -sh ~/* 2>/dev/null",
+    "sed -i 's/foo/bar/g' notes.txt && wc -l notes.txt",
+]
+
+
+def synthetic_rules(count):
+    """Deny rules shaped like the built-in ones: a command name, flags and a target"""
+    rules = list(DEFAULT_DENY_RULES)
+    for i in range(count - len(rules)):
+        rules.append(rf"blocked{i}\s+-[a-z]*f\s+/srv/{i}")
+    return rules[:count]
+
+
+def per_rule_loop(rules):
+    """The validator as it was: search every rule in turn"""
+    def check(command):
+        for rule in rules:
+            if re.search(rule, command, re.IGNORECASE):
+                return True
+        return False
+    return check
+
+
+def alternation(rules):
+    pattern = re.compile("|".join(f"(?:{rule})" for rule in rules), re.IGNORECASE)
+    return lambda command: pattern.search(command) is not None
+
+
+def matcher(rules):
+    return compile_rules(rules).search
+
+
+def measure(check, iterations):
+    """Mean microseconds per command over the corpus"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for command in CORPUS:
+            check(command)
+    return (time.perf_counter() - start) / (iterations * len(CORPUS)) * 1e6
+
+
+def main(args):
+    for count in args.rules:
+        rules = synthetic_rules(count) if count > len(DEFAULT_DENY_RULES) else DEFAULT_DENY_RULES[:count]
+        loop = measure(per_rule_loop(rules), args.iterations)
+        single = measure(alternation(rules), args.iterations)
+        indexed = measure(matcher(rules), args.iterations)
+        print(
+            f"rules={len(rules):<5} per-rule={loop:9.2f}us "
+            f"alternation={single:9.2f}us matcher={indexed:7.2f}us"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rules", type=lambda s: [int(c) for c in s.split(",")], default=[6, 100, 500])
+    parser.add_argument("--iterations", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,91 @@
+"""
+Database connections held by concurrent long-running shell commands.
+
+Runs N users' /execute requests at once against the fakes in benchmarks.fakes,
+each creating its pod and then running a command that takes --exec-latency
+seconds, with a pool allowed to grow to N connections. Shell routes hold a
+connection only inside the DB thread running each statement, so at most
+DB_THREADS (4 here) are in use at once however many commands run and however
+long they take. tests/test_db_pool.py asserts the same bound; the exit
+status here is 1 only when requests fail.
+
+Usage (from backend/):
+    python -m benchmarks.db_connections --users 100 --exec-latency 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+for _var, _value in (("DB_POOL_MIN_SIZE", "1"), ("DB_POOL_MAX_SIZE", "100"),
+                     ("DB_THREADS", "4"), ("EXEC_THREADS", "100"), ("POD_CREATE_MAX_QUEUE", "1000")):
+    os.environ.setdefault(_var, _value)
+
+from benchmarks.load_test import call, PASSWORD
+from app.api.v1 import shell
+from app.core.concurrency import shutdown_executors, warm_hash_pool
+from app.db.database import Database
+from benchmarks import fakes
+
+
+async def login(name):
+    await call("POST", "/api/v1/auth/signup", body={
+        "username": name, "password": PASSWORD, "email": f"{name}@bench.example"
+    })
+    status_code, data = await call("POST", "/api/v1/auth/login", body={"username": name, "password": PASSWORD})
+    if status_code != 200:
+        raise RuntimeError(f"login failed for {name}: {status_code} {data}")
+    return data["access_token"]
+
+
+async def sample_pool(peak, stop):
+    """Record the most connections in use at once until stop is set"""
+    pool = Database.get_pool()
+    while not stop.is_set():
+        peak["in_use"] = max(peak["in_use"], pool.stats()["in_use"])
+        await asyncio.sleep(0.001)
+
+
+async def main(args):
+    fakes.install(shell.k8s_service, pod_start_latency=args.pod_start_latency, exec_latency=args.exec_latency)
+    warm_hash_pool()
+
+    tokens = []
+    for start in range(0, args.users, 10):
+        tokens += await asyncio.gather(*(login(f"dbconn{i}") for i in range(start, min(start + 10, args.users))))
+
+    pool = Database.get_pool()
+    opened_before = pool.stats()["size"]
+    peak = {"in_use": 0}
+    stop = asyncio.Event()
+    sampler = asyncio.ensure_future(sample_pool(peak, stop))
+
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(
+        call("POST", "/api/v1/shell/execute", token, {"command": "sleep 2", "timeout": 30})
+        for token in tokens
+    ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    failures = [status_code for status_code, _ in responses if status_code != 200]
+    opened = pool.stats()["size"]
+    shutdown_executors()
+
+    print(f"users={args.users} elapsed={elapsed:.2f}s failed={len(failures)}")
+    print(f"connections: opened={opened - opened_before} peak in use={peak['in_use']}")
+
+    if failures:
+        print(f"FAIL {len(failures)} requests failed: {sorted(set(failures))}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--exec-latency", type=float, default=2.0)
+    parser.add_argument("--pod-start-latency", type=float, default=1.0)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,186 @@
+"""
+Event loop latency under long-running execs.
+
+Drives the ASGI app in-process with a fake MySQL connection and a fake
+Kubernetes service, starts a batch of slow /shell/execute requests and
+samples /health and /shell/status latency while they run. If blocking
+work leaks onto the event loop, p99 of the probe routes grows with the
+exec duration instead of staying flat.
+
+Usage (from backend/):
+    python -m benchmarks.event_loop_latency --execs 20 --exec-seconds 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+for _var in ("SECRET_KEY", "DB_HOST", "DB_USER", "DB_PASSWORD", "DB_NAME"):
+    os.environ.setdefault(_var, "benchmark")
+
+from app.main import app
+from app.api.v1 import shell
+from app.core.security import create_access_token
+from app.db.database import Database
+
+
+class FakeCursor:
+    def __init__(self, db_latency):
+        self.db_latency = db_latency
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        time.sleep(self.db_latency)
+        self.rowcount = 1
+
+    def fetchone(self):
+        return {"shell_pod_id": "benchmark-pod"}
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    in_transaction = False
+
+    def __init__(self, db_latency):
+        self.db_latency = db_latency
+
+    def ping(self, reconnect=False):
+        time.sleep(self.db_latency)
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self.db_latency)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def install_fakes(exec_seconds, api_latency, db_latency):
+    """Swap MySQL and Kubernetes for blocking stand-ins with fixed latencies"""
+    Database._connect = classmethod(lambda cls: FakeConnection(db_latency))
+
+    def get_pod_status(pod_id):
+        time.sleep(api_latency)
+        return {"status": "Running", "created_at": None}
+
+    def execute_command(pod_id, command, timeout=None, session=None, command_id=None):
+        time.sleep(exec_seconds)
+        return {"output": "done", "exit_code": 0}
+
+    shell.k8s_service.get_pod_status = get_pod_status
+    shell.k8s_service.execute_command = execute_command
+
+
+async def request(method, path, token=None, body=None):
+    """Send one HTTP request straight to the ASGI app and return (status, seconds)"""
+    headers = [(b"content-type", b"application/json")]
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    sent = False
+    status_code = None
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return status_code, time.perf_counter() - start
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def sample_probes(token, duration, interval=0.02):
+    """
+    Hit /health and /shell/status on fixed, independent schedules for the given duration.
+
+    Latency is measured from each probe's scheduled send time, so time spent
+    waiting for a stalled event loop counts against the probe.
+    """
+    async def probe(path):
+        samples = []
+        start = time.perf_counter()
+        tick = 0
+        while True:
+            scheduled = start + tick * interval
+            if scheduled - start >= duration:
+                return samples
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            await request("GET", path, token)
+            samples.append((time.perf_counter() - scheduled) * 1000)
+            tick += 1
+
+    paths = ["/health", "/api/v1/shell/status"]
+    results = await asyncio.gather(*(probe(path) for path in paths))
+    return dict(zip(paths, results))
+
+
+def report(label, latencies):
+    for path, samples in latencies.items():
+        print(
+            f"{label:<10} {path:<24} n={len(samples):<5} "
+            f"p50={statistics.median(samples):7.2f}ms "
+            f"p99={percentile(samples, 99):7.2f}ms"
+        )
+
+
+async def main(args):
+    install_fakes(args.exec_seconds, args.api_latency, args.db_latency)
+    token = create_access_token(data={"sub": "benchmark"})
+
+    report("idle", await sample_probes(token, args.exec_seconds))
+
+    execs = [
+        asyncio.create_task(
+            request("POST", "/api/v1/shell/execute", token, {"command": "sleep 1"})
+        )
+        for _ in range(args.execs)
+    ]
+    report("loaded", await sample_probes(token, args.exec_seconds * 0.8))
+
+    results = await asyncio.gather(*execs)
+    print(f"execs completed: {sum(1 for code, _ in results if code == 200)}/{args.execs}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--execs", type=int, default=20)
+    parser.add_argument("--exec-seconds", type=float, default=3.0)
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    asyncio.run(main(parser.parse_args()))
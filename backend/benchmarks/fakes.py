@@ -0,0 +1,369 @@
+"""
+In-process stand-ins for MySQL and Kubernetes used by the benchmarks.
+
+SQLiteConnection replaces the MySQL connection behind Database, and
+FakeCoreV1Api/fake_stream replace the Kubernetes API and exec streams behind
+K8sService, each with configurable latencies. install() wires them into the
+running app so the real route, pool and service code is what gets measured.
+"""
+import collections
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from kubernetes.client.rest import ApiException
+from websocket import ABNF
+
+from app.db.database import Database
+from app.services import k8s_service as k8s_service_module
+
+SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    email TEXT NOT NULL UNIQUE,
+    shell_pod_id TEXT DEFAULT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_login TEXT NULL,
+    last_command_at TEXT NULL,
+    is_active INTEGER DEFAULT 1,
+    failed_login_attempts INTEGER DEFAULT 0,
+    locked_until TEXT NULL
+)
+"""
+
+
+class SQLiteDatabase:
+    """One in-memory SQLite database shared by every fake connection"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(SCHEMA)
+
+
+class SQLiteCursor:
+    """mysql-connector style cursor over the shared SQLite database"""
+
+    def __init__(self, db, dictionary):
+        self.db = db
+        self.dictionary = dictionary
+        self.rowcount = -1
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        # Round trip to the server, outside the lock like a real network wait
+        time.sleep(self.db.latency)
+        params = tuple(p.isoformat() if isinstance(p, datetime) else p for p in params or ())
+        with self.db.lock:
+            cursor = self.db.conn.execute(sql.replace("%s", "?"), params)
+            self._rows = cursor.fetchall()
+            self.rowcount = cursor.rowcount
+
+    def _row(self, row):
+        return dict(row) if self.dictionary else tuple(row)
+
+    def fetchone(self):
+        return self._row(self._rows.pop(0)) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return [self._row(row) for row in rows]
+
+    def close(self):
+        pass
+
+
+class SQLiteConnection:
+    """mysql-connector style connection; statements autocommit"""
+
+    in_transaction = False
+
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self.db, dictionary)
+
+    def ping(self, reconnect=False):
+        time.sleep(self.db.latency)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePod:
+    """Pod whose phase turns Running once its start latency has passed"""
+
+    _versions = itertools.count(1)
+
+    def __init__(self, body, ready_at):
+        self.ready_at = ready_at
+        self.metadata = SimpleNamespace(
+            name=body.metadata.name,
+            labels=dict(body.metadata.labels or {}),
+            annotations=dict(body.metadata.annotations or {}),
+            creation_timestamp=datetime.utcnow(),
+            resource_version=str(next(self._versions))
+        )
+
+    @property
+    def status(self):
+        if time.monotonic() >= self.ready_at:
+            return SimpleNamespace(phase="Running", container_statuses=None)
+        waiting = SimpleNamespace(state=SimpleNamespace(waiting=SimpleNamespace(reason="ContainerCreating")))
+        return SimpleNamespace(phase="Pending", container_statuses=[waiting])
+
+
+class FakeCoreV1Api:
+    """The subset of CoreV1Api used by K8sService, holding pods in memory"""
+
+    def __init__(self, pod_start_latency, api_latency):
+        self.pod_start_latency = pod_start_latency
+        self.api_latency = api_latency
+        self.pods = {}
+        self.lock = threading.Lock()
+
+    def _get(self, name):
+        pod = self.pods.get(name)
+        if pod is None:
+            raise ApiException(status=404, reason="Not Found")
+        return pod
+
+    def create_namespaced_pod(self, namespace, body):
+        time.sleep(self.api_latency)
+        with self.lock:
+            self.pods[body.metadata.name] = FakePod(body, time.monotonic() + self.pod_start_latency)
+
+    def read_namespaced_pod(self, name, namespace):
+        time.sleep(self.api_latency)
+        with self.lock:
+            return self._get(name)
+
+    def list_namespaced_pod(self, namespace, label_selector=None, **kwargs):
+        time.sleep(self.api_latency)
+        with self.lock:
+            items = list(self.pods.values())
+        return SimpleNamespace(items=items, metadata=SimpleNamespace(resource_version="0"))
+
+    def patch_namespaced_pod(self, name, namespace, body):
+        time.sleep(self.api_latency)
+        metadata = body.get("metadata", {})
+        with self.lock:
+            pod = self._get(name)
+            expected = metadata.get("resourceVersion")
+            if expected is not None and expected != pod.metadata.resource_version:
+                raise ApiException(status=409, reason="Conflict")
+            for field in ("labels", "annotations"):
+                values = getattr(pod.metadata, field)
+                for key, value in metadata.get(field, {}).items():
+                    if value is None:
+                        values.pop(key, None)
+                    else:
+                        values[key] = value
+            pod.metadata.resource_version = str(next(FakePod._versions))
+
+    def delete_namespaced_pod(self, name, namespace, body=None):
+        time.sleep(self.api_latency)
+        with self.lock:
+            self._get(name)
+            del self.pods[name]
+
+    def connect_get_namespaced_pod_exec(self, *args, **kwargs):
+        raise NotImplementedError("exec goes through fake_stream")
+
+
+class FakePodCache:
+    """Synced pod cache reading straight from the fake API's pod table"""
+
+    synced = True
+
+    def __init__(self, api):
+        self.api = api
+
+    def get(self, name):
+        return self.api.pods.get(name)
+
+    def list(self, predicate=None):
+        with self.api.lock:
+            pods = list(self.api.pods.values())
+        return [pod for pod in pods if predicate is None or predicate(pod)]
+
+    def wait_for(self, name, predicate, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            pod = self.get(name)
+            if predicate(pod):
+                return pod
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for pod {name}")
+            wait = pod.ready_at - time.monotonic() if pod is not None else 0.01
+            time.sleep(min(max(wait, 0.001), deadline - time.monotonic()))
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class FakeExecStream:
+    """Exec stream that finishes after the exec latency with a line of output"""
+
+    def __init__(self, command, latency):
+        self.done_at = time.monotonic() + latency
+        self.stdout = f"ran: {command[-1]}\n"
+        if command[0] == "setsid":
+            # Commands report their process group first
+            self.stdout = f"{os.getpid()}\n{self.stdout}"
+        self.returncode = None
+
+    def is_open(self):
+        return self.returncode is None
+
+    def update(self, timeout=0):
+        remaining = self.done_at - time.monotonic()
+        if remaining > 0:
+            time.sleep(min(remaining, timeout))
+        else:
+            self.returncode = 0
+
+    def peek_stdout(self):
+        return self.returncode is not None and bool(self.stdout)
+
+    def read_stdout(self):
+        data, self.stdout = self.stdout, ""
+        return data
+
+    def peek_stderr(self):
+        return False
+
+    def read_stderr(self):
+        return ""
+
+    def close(self):
+        pass
+
+
+class FakeFrameSocket:
+    """
+    The websocket under a FakeBinaryExec: frames queued by pump threads, each
+    signalled by a byte on a socketpair so it can be polled like a real socket.
+    At most window frames are queued, like data in flight on a TCP connection.
+    """
+
+    def __init__(self, window=8):
+        self.sock, self._signal = socket.socketpair()
+        self.frames = collections.deque()
+        self.window = threading.Semaphore(window)
+        self.connected = True
+
+    def push(self, opcode, data):
+        self.window.acquire()
+        self.frames.append((opcode, SimpleNamespace(data=data)))
+        self._signal.send(b"x")
+
+    def recv_data_frame(self, control_frame=True):
+        self.sock.recv(1)
+        self.window.release()
+        opcode, frame = self.frames.popleft()
+        if opcode == ABNF.OPCODE_CLOSE:
+            self.connected = False
+        return opcode, frame
+
+
+class FakeBinaryExec:
+    """
+    Exec stream running the backend's file transfer commands on the local
+    machine, with $HOME pointing at a directory that stands in for the pod's.
+    """
+
+    def __init__(self, command, home, stdin):
+        self.sock = FakeFrameSocket()
+        self.proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env={"HOME": home, "PATH": os.environ.get("PATH", "/usr/bin:/bin")}
+        )
+        pumps = [threading.Thread(target=self._pump, args=(pipe, channel), daemon=True)
+                 for pipe, channel in ((self.proc.stdout, 1), (self.proc.stderr, 2))]
+        for pump in pumps:
+            pump.start()
+        threading.Thread(target=self._finish, args=(pumps,), daemon=True).start()
+
+    def _pump(self, pipe, channel):
+        for data in iter(lambda: pipe.read1(32768), b""):
+            self.sock.push(ABNF.OPCODE_BINARY, bytes([channel]) + data)
+
+    def _finish(self, pumps):
+        for pump in pumps:
+            pump.join()
+        code = self.proc.wait()
+        if code == 0:
+            status = {"status": "Success"}
+        else:
+            status = {"status": "Failure", "message": "command terminated with non-zero exit code",
+                      "details": {"causes": [{"reason": "ExitCode", "message": str(code)}]}}
+        self.sock.push(ABNF.OPCODE_BINARY, b"\x03" + json.dumps(status).encode())
+        self.sock.push(ABNF.OPCODE_CLOSE, b"")
+
+    def write_channel(self, channel, data):
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+
+
+def fake_stream(latency, files_home=None):
+    """
+    Build a kubernetes.stream.stream replacement with the given exec latency
+
+    With files_home, file transfer commands really run locally, each pod's
+    home directory being files_home/<pod name>.
+    """
+    def stream(func, name, namespace, command, _preload_content=True, stdin=False, **kwargs):
+        if files_home is not None and command[3:4] and command[3].startswith("tempshell-"):
+            home = os.path.join(files_home, name)
+            os.makedirs(home, exist_ok=True)
+            return FakeBinaryExec(command, home, stdin)
+        if _preload_content:
+            time.sleep(latency)
+            return ""
+        return FakeExecStream(command, latency)
+    return stream
+
+
+def install(k8s_service, pod_start_latency=2.0, exec_latency=0.05, api_latency=0.005, db_latency=0.001,
+            files_home=None):
+    """Point Database and the given K8sService at the fakes; returns the fake API"""
+    db = SQLiteDatabase(db_latency)
+    Database._connect = classmethod(lambda cls: SQLiteConnection(db))
+    Database._connection_pool = None
+
+    api = FakeCoreV1Api(pod_start_latency, api_latency)
+    k8s_service.v1 = api
+    k8s_service.enabled = True
+    k8s_service.pod_cache = FakePodCache(api)
+    k8s_service.sessions = None
+    k8s_service_module.stream = fake_stream(exec_latency, files_home)
+    return api
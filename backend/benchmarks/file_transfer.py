@@ -0,0 +1,134 @@
+"""
+Throughput and backend memory of streamed file uploads and downloads.
+
+Uploads a file of --size-mb through PUT /api/v1/shell/files and downloads it
+back through GET, against the fakes in benchmarks.fakes with the transfer's
+tar commands running locally in a temporary home directory. The body is fed
+and consumed in chunks, so the peak Python allocation measured during the
+transfers shows whether anything buffered whole bodies; the exit status is 1
+when it exceeded --max-memory-mb or the downloaded archive did not round-trip.
+
+Usage (from backend/):
+    python -m benchmarks.file_transfer --size-mb 64
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("MAX_UPLOAD_BYTES", str(1 << 40))
+os.environ.setdefault("MAX_DOWNLOAD_BYTES", str(1 << 40))
+
+from benchmarks.db_connections import login
+from app.main import app
+from app.api.v1 import shell
+from app.core.concurrency import shutdown_executors, warm_hash_pool
+from benchmarks import fakes
+
+PIECE = b"0123456789abcdef" * 4096  # 64 KiB of request body per ASGI message
+
+
+async def transfer(method, path, query, token, size=0, on_body=None, body=None):
+    """
+    Stream size bytes of request body (repeated PIECE, or body) to the app
+    and pass response chunks to on_body
+    """
+    headers = [(b"authorization", f"Bearer {token}".encode())]
+    if method == "PUT":
+        headers.append((b"content-length", str(size).encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "headers": headers,
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+    }
+    remaining = size
+    status_code = None
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal remaining
+        if remaining > 0 or method == "PUT" and remaining == 0 and size == 0:
+            if body is not None:
+                piece = body[size - remaining:size - remaining + len(PIECE)]
+            else:
+                piece = PIECE[:remaining] if method == "PUT" else b""
+            remaining -= len(piece)
+            return {"type": "http.request", "body": piece, "more_body": remaining > 0}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body":
+            if on_body is not None:
+                on_body(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await app(scope, receive, send)
+    return status_code
+
+
+async def main(args):
+    home = tempfile.mkdtemp(prefix="tempshell-files-")
+    fakes.install(shell.k8s_service, pod_start_latency=0.1, files_home=home)
+    warm_hash_pool()
+    token = await login("filebench")
+    size = args.size_mb * 1024 * 1024
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    status_code = await transfer("PUT", "/api/v1/shell/files", "path=data/blob.bin", token, size)
+    upload_seconds = time.perf_counter() - started
+    upload_peak = tracemalloc.get_traced_memory()[1]
+    if status_code != 200:
+        print(f"FAIL upload returned {status_code}")
+        return 1
+
+    tracemalloc.reset_peak()
+    received = tempfile.TemporaryFile()
+    started = time.perf_counter()
+    status_code = await transfer("GET", "/api/v1/shell/files", "path=data", token, on_body=received.write)
+    download_seconds = time.perf_counter() - started
+    download_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    shutdown_executors()
+
+    received.seek(0)
+    with tarfile.open(fileobj=received) as archive:
+        member = archive.extractfile("data/blob.bin")
+        digest = hashlib.sha256()
+        for block in iter(lambda: member.read(1 << 20), b""):
+            digest.update(block)
+    expected = hashlib.sha256()
+    for offset in range(0, size, len(PIECE)):
+        expected.update(PIECE[:size - offset])
+
+    mib = size / (1024 * 1024)
+    print(f"upload:   {mib:.0f} MiB in {upload_seconds:.2f}s ({mib / upload_seconds:.0f} MiB/s), "
+          f"peak allocated {upload_peak / 1048576:.1f} MiB")
+    print(f"download: {mib:.0f} MiB in {download_seconds:.2f}s ({mib / download_seconds:.0f} MiB/s), "
+          f"peak allocated {download_peak / 1048576:.1f} MiB")
+
+    if digest.digest() != expected.digest():
+        print("FAIL downloaded file differs from the upload")
+        return 1
+    if max(upload_peak, download_peak) > args.max_memory_mb * 1024 * 1024:
+        print(f"FAIL transfers allocated more than {args.max_memory_mb} MiB")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--max-memory-mb", type=int, default=8)
+    sys.exit(asyncio.run(main(parser.parse_args())))
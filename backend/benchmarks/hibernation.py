@@ -0,0 +1,126 @@
+"""
+Resume latency and deduplication of hibernated home directories.
+
+Against the fakes in benchmarks.fakes (each pod's home being a local
+directory), fills a user's home through PUT /api/v1/shell/files with
+--files files of --file-kb each, of which --touched were modified during the
+session and the rest carry an old mtime. The shell is then terminated, which
+snapshots the home, and the next /execute creates a new pod and restores it.
+Reported are the snapshot time, the first command's latency (which includes
+restoring the touched files only), the time until the rest is restored, and
+the time and bytes stored of a second snapshot of the same files. The
+exit status is 1 when the restored home differs from the original.
+
+Usage (from backend/):
+    python -m benchmarks.hibernation --files 400 --file-kb 256 --touched 20
+"""
+import argparse
+import asyncio
+import filecmp
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import time
+
+_SNAPSHOTS = tempfile.mkdtemp(prefix="tempshell-snapshots-")
+for _var, _value in (("HIBERNATE_ENABLED", "true"), ("SNAPSHOT_DIR", _SNAPSHOTS),
+                     ("MAX_UPLOAD_BYTES", str(1 << 40)), ("SNAPSHOT_MAX_BYTES", str(1 << 40))):
+    os.environ.setdefault(_var, _value)
+
+from benchmarks.db_connections import login
+from benchmarks.file_transfer import transfer
+from benchmarks.load_test import call
+from app.api.v1 import shell
+from app.core.concurrency import shutdown_executors, warm_hash_pool
+from app.core.metrics import SNAPSHOT_BYTES
+from benchmarks import fakes
+
+
+def build_archive(files, size, touched):
+    """A tar archive of files, the first `touched` with a current mtime and the rest a week old"""
+    buf = io.BytesIO()
+    now = time.time()
+    with tarfile.open(fileobj=buf, mode="w") as archive:
+        for i in range(files):
+            data = os.urandom(size // 2) * 2  # Compressible, like most real files
+            info = tarfile.TarInfo(f"project/dir{i % 10}/file{i}.bin")
+            info.size = len(data)
+            info.mtime = now if i < touched else now - 7 * 86400
+            archive.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def stored_bytes():
+    return SNAPSHOT_BYTES.labels("stored")._value.get()
+
+
+def same_tree(left, right):
+    comparison = filecmp.dircmp(left, right)
+    if comparison.left_only or comparison.right_only or comparison.diff_files or comparison.funny_files:
+        return False
+    if any(not filecmp.cmp(os.path.join(left, name), os.path.join(right, name), shallow=False)
+           for name in comparison.common_files):
+        return False
+    return all(same_tree(os.path.join(left, d), os.path.join(right, d)) for d in comparison.common_dirs)
+
+
+async def main(args):
+    homes = tempfile.mkdtemp(prefix="tempshell-homes-")
+    api = fakes.install(shell.k8s_service, pod_start_latency=0.1, files_home=homes)
+    warm_hash_pool()
+    token = await login("hibernator")
+    # The session starts with the pod; files written after that count as touched
+    await call("POST", "/api/v1/shell/execute", token, {"command": "true"})
+
+    archive = build_archive(args.files, args.file_kb * 1024, args.touched)
+    status_code = await transfer("PUT", "/api/v1/shell/files", "path=.&archive=true", token,
+                                 len(archive), body=archive)
+    if status_code != 200:
+        print(f"FAIL upload returned {status_code}")
+        return 1
+    # Deleting a fake pod leaves its home directory, to compare against later
+    original = os.path.join(homes, next(iter(api.pods)))
+
+    started = time.perf_counter()
+    status_code, _ = await call("DELETE", "/api/v1/shell/terminate", token)
+    snapshot_seconds = time.perf_counter() - started
+    first_stored = stored_bytes()
+
+    started = time.perf_counter()
+    status_code, _ = await call("POST", "/api/v1/shell/execute", token, {"command": "ls", "timeout": 30})
+    first_command_seconds = time.perf_counter() - started
+    while shell._provision_tasks:
+        await asyncio.sleep(0.01)
+    full_restore_seconds = time.perf_counter() - started
+
+    second_pod = next(iter(api.pods))
+    restored = os.path.join(homes, second_pod)
+    if not same_tree(original, restored):
+        print("FAIL restored home differs from the original")
+        return 1
+
+    started = time.perf_counter()
+    await call("DELETE", "/api/v1/shell/terminate", token)
+    second_snapshot_seconds = time.perf_counter() - started
+    second_stored = stored_bytes() - first_stored
+    shutdown_executors()
+
+    total_mib = args.files * args.file_kb / 1024
+    touched_mib = args.touched * args.file_kb / 1024
+    print(f"home: {args.files} files, {total_mib:.1f} MiB ({touched_mib:.1f} MiB touched in the session)")
+    print(f"snapshot:       {snapshot_seconds:.2f}s, {first_stored / 1048576:.1f} MiB of file content stored")
+    print(f"first command:  {first_command_seconds:.2f}s (pod start + touched files)")
+    print(f"fully restored: {full_restore_seconds:.2f}s")
+    print(f"second snapshot: {second_snapshot_seconds:.2f}s, {second_stored / 1048576:.1f} MiB stored "
+          f"(unchanged files reuse their blobs)")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--file-kb", type=int, default=256)
+    parser.add_argument("--touched", type=int, default=20)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,68 @@
+"""
+Per-request authentication overhead.
+
+Times authenticate_token, the work every authenticated request does before
+reaching its handler, for each JWT backend with and without the
+decoded-token cache. Requests cycle through a fixed set of live tokens, as
+when a handful of shell sessions poll the API.
+
+Usage (from backend/):
+    python -m benchmarks.jwt_auth --requests 20000 --tokens 50
+"""
+import argparse
+import os
+import statistics
+import time
+
+for _var in ("SECRET_KEY", "DB_HOST", "DB_USER", "DB_PASSWORD", "DB_NAME"):
+    os.environ.setdefault(_var, "benchmark")
+
+from app.core import security
+from app.services.cache import LocalCache
+
+
+def configure(backend, cached):
+    """Point the security module at a JWT backend and a fresh (or no) token cache"""
+    security.jwt, security._jwt_error = security._load_jwt_backend(backend)
+    security._token_cache = LocalCache("jwt-benchmark", 10000, 1800) if cached else None
+    return security.jwt.__name__
+
+
+def measure(tokens, requests):
+    """Return per-call authenticate_token latencies in microseconds"""
+    samples = []
+    for i in range(requests):
+        token = tokens[i % len(tokens)]
+        start = time.perf_counter()
+        security.authenticate_token(token)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def main(args):
+    tokens = [
+        security.create_access_token(data={"sub": f"user{i}"})
+        for i in range(args.tokens)
+    ]
+
+    for backend in ("jose", "pyjwt"):
+        for cached in (False, True):
+            module = configure(backend, cached)
+            if backend == "pyjwt" and module != "jwt":
+                print("pyjwt      (not installed, skipped)")
+                break
+            samples = measure(tokens, args.requests)
+            ordered = sorted(samples)
+            print(
+                f"{backend:<6} cache={'on ' if cached else 'off'} "
+                f"mean={statistics.fmean(samples):7.2f}us "
+                f"p50={ordered[len(ordered) // 2]:7.2f}us "
+                f"p99={ordered[int(len(ordered) * 0.99)]:7.2f}us"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=50)
+    main(parser.parse_args())
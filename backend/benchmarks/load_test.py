@@ -0,0 +1,238 @@
+"""
+Throughput and latency of the API under a mixed workload.
+
+Runs the ASGI app in-process against the fakes in benchmarks.fakes: SQLite
+in place of MySQL and an in-memory Kubernetes API with configurable pod
+start and exec latencies, so it needs no cluster, database or network.
+Each virtual user signs up, logs in, then sends a weighted mix of execute,
+status and terminate requests. Every concurrency level is run in turn and
+reported with throughput and p50/p95/p99 per route.
+
+With --baseline, results are compared against an earlier --json report and
+the exit status is 1 when a route got slower or lost throughput beyond
+--tolerance, so the harness can gate CI.
+
+Usage (from backend/):
+    python -m benchmarks.load_test --concurrency 1,10,50 --requests 20
+    python -m benchmarks.load_test --json current.json --baseline main.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+for _var in ("SECRET_KEY", "DB_HOST", "DB_USER", "DB_PASSWORD", "DB_NAME"):
+    os.environ.setdefault(_var, "benchmark")
+# Measure raw capacity: no rate limits, no background pods, one-shot execs
+for _var in ("RATE_LIMIT_PER_MINUTE", "RATE_LIMIT_IP_PER_MINUTE", "RATE_LIMIT_AUTH_PER_MINUTE",
+             "RATE_LIMIT_POD_CREATE_PER_MINUTE", "WARM_POOL_SIZE"):
+    os.environ.setdefault(_var, "0")
+os.environ.setdefault("EXEC_SESSIONS_ENABLED", "false")
+
+from app.main import app
+from app.api.v1 import shell
+from app.core.concurrency import shutdown_executors, warm_hash_pool
+from benchmarks import fakes
+
+PASSWORD = "Bench#Pass123"
+
+
+async def call(method, path, token=None, body=None):
+    """Send one HTTP request straight to the ASGI app and return (status, json body)"""
+    headers = [(b"content-type", b"application/json")]
+    if token:
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    sent = False
+    status_code = None
+    chunks = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    try:
+        return status_code, json.loads(b"".join(chunks) or b"null")
+    except ValueError:
+        return status_code, None
+
+
+class Recorder:
+    """Per-route latency samples and status counts"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def timed(self, route, method, path, token=None, body=None):
+        start = time.perf_counter()
+        status_code, data = await call(method, path, token, body)
+        self.samples[route].append(time.perf_counter() - start)
+        if not 200 <= status_code < 300:
+            self.errors[route] += 1
+        return status_code, data
+
+
+def parse_mix(text):
+    """Parse "execute=70,status=20,terminate=10" into routes and weights"""
+    routes, weights = [], []
+    for part in text.split(","):
+        route, _, weight = part.partition("=")
+        if route not in ("execute", "status", "terminate"):
+            raise argparse.ArgumentTypeError(f"unknown route in mix: {route}")
+        routes.append(route)
+        weights.append(float(weight or 1))
+    return routes, weights
+
+
+async def virtual_user(recorder, name, mix, requests, rng):
+    """Sign up, log in and send a random mix of shell requests"""
+    await recorder.timed("signup", "POST", "/api/v1/auth/signup", body={
+        "username": name, "password": PASSWORD, "email": f"{name}@bench.example"
+    })
+    status_code, data = await recorder.timed("login", "POST", "/api/v1/auth/login", body={
+        "username": name, "password": PASSWORD
+    })
+    if status_code != 200:
+        return
+    token = data["access_token"]
+
+    routes, weights = mix
+    for route in rng.choices(routes, weights, k=requests):
+        if route == "execute":
+            await recorder.timed("execute", "POST", "/api/v1/shell/execute", token, {"command": "echo hi"})
+        elif route == "status":
+            await recorder.timed("status", "GET", "/api/v1/shell/status", token)
+        else:
+            await recorder.timed("terminate", "DELETE", "/api/v1/shell/terminate", token)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(recorder, elapsed):
+    summary = {}
+    for route, samples in sorted(recorder.samples.items()):
+        summary[route] = {
+            "count": len(samples),
+            "errors": recorder.errors[route],
+            "throughput": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p95_ms": percentile(samples, 95) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+        }
+    return summary
+
+
+def report(concurrency, elapsed, summary):
+    print(f"concurrency={concurrency} elapsed={elapsed:.2f}s")
+    for route, stats in summary.items():
+        print(
+            f"  {route:<10} n={stats['count']:<6} err={stats['errors']:<4} "
+            f"{stats['throughput']:8.1f} req/s "
+            f"p50={stats['p50_ms']:8.2f}ms p95={stats['p95_ms']:8.2f}ms p99={stats['p99_ms']:8.2f}ms"
+        )
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of results against baseline, as printable lines"""
+    regressions = []
+    for level, routes in results.items():
+        for route, stats in routes.items():
+            base = baseline.get(level, {}).get(route)
+            if base is None:
+                continue
+            if stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"c={level} {route}: p95 {base['p95_ms']:.2f}ms -> {stats['p95_ms']:.2f}ms"
+                )
+            if stats["throughput"] < base["throughput"] * (1 - tolerance):
+                regressions.append(
+                    f"c={level} {route}: throughput {base['throughput']:.1f} -> {stats['throughput']:.1f} req/s"
+                )
+    return regressions
+
+
+async def main(args):
+    fakes.install(
+        shell.k8s_service,
+        pod_start_latency=args.pod_start_latency,
+        exec_latency=args.exec_latency,
+        api_latency=args.api_latency,
+        db_latency=args.db_latency
+    )
+    warm_hash_pool()
+    rng = random.Random(args.seed)
+
+    results = {}
+    for concurrency in args.concurrency:
+        recorder = Recorder()
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            virtual_user(recorder, f"bench{concurrency}x{i}", args.mix, args.requests, rng)
+            for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+        results[str(concurrency)] = summarize(recorder, elapsed)
+        report(concurrency, elapsed, results[str(concurrency)])
+
+    shutdown_executors()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=20, help="shell requests per virtual user")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("execute=70,status=25,terminate=5"))
+    parser.add_argument("--pod-start-latency", type=float, default=2.0)
+    parser.add_argument("--exec-latency", type=float, default=0.05)
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    parser.add_argument("--db-latency", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against a report written by --json")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(asyncio.run(main(parser.parse_args())))
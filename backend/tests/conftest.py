@@ -0,0 +1,15 @@
+"""
+Shared setup for the API tests.
+
+Like the benchmarks, the tests run the ASGI app in-process against the fakes
+in benchmarks.fakes, so they need no database, cluster or network.
+
+Run from backend/:
+    python -m pytest tests
+"""
+import os
+
+for _var in ("SECRET_KEY", "DB_HOST", "DB_USER", "DB_PASSWORD", "DB_NAME"):
+    os.environ.setdefault(_var, "test")
+os.environ.setdefault("WARM_POOL_SIZE", "0")
+os.environ.setdefault("EXEC_SESSIONS_ENABLED", "false")
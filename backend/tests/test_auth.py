@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from benchmarks import fakes
+from benchmarks.load_test import call, PASSWORD
+from app.api.v1 import shell
+from app.core.config import settings
+from app.core.security import get_password_hash
+from app.db.database import Database
+
+
+@pytest.fixture(autouse=True)
+def backend():
+    """A fresh fake database and Kubernetes API for each test"""
+    fakes.install(shell.k8s_service, pod_start_latency=0, exec_latency=0, api_latency=0, db_latency=0)
+
+
+def test_signup_sheds_load_when_hashing_is_saturated(monkeypatch):
+    # run_hash rejects every call, as when HASH_MAX_PENDING hashes are already queued
+    monkeypatch.setattr(settings, "HASH_MAX_PENDING", 0)
+    status_code, data = asyncio.run(call("POST", "/api/v1/auth/signup", body={
+        "username": "shedsignup", "password": PASSWORD, "email": "shedsignup@test.example"
+    }))
+    assert status_code == 503
+    assert "Registration failed" not in str(data)
+
+
+def test_login_sheds_load_when_hashing_is_saturated(monkeypatch):
+    conn = Database._connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO users (username, password, email) VALUES (%s, %s, %s)",
+        ("shedlogin", get_password_hash(PASSWORD), "shedlogin@test.example")
+    )
+    monkeypatch.setattr(settings, "HASH_MAX_PENDING", 0)
+
+    status_code, data = asyncio.run(call("POST", "/api/v1/auth/login", body={
+        "username": "shedlogin", "password": PASSWORD
+    }))
+    assert status_code == 503
+    assert "Login failed" not in str(data)
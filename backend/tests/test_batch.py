@@ -0,0 +1,69 @@
+import pytest
+
+from benchmarks import fakes
+from app.api.v1 import shell
+from app.core.config import settings
+
+
+class ScriptedCommands:
+    """Outcomes of commands by text, as (exit code, interrupted), and the timeouts they ran with"""
+
+    def __init__(self):
+        self.outcomes = {}
+        self.timeouts = []
+
+    def run(self, pod_id, command, on_output, timeout, session, command_id):
+        self.timeouts.append(timeout)
+        return self.outcomes.get(command, (0, None))
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    fakes.install(shell.k8s_service, pod_start_latency=0, exec_latency=0, api_latency=0, db_latency=0)
+    monkeypatch.setattr(shell.k8s_service, "sessions", object())  # No per-batch shell to open
+    monkeypatch.setattr(settings, "BATCH_TIMEOUT_SECONDS", 60)
+    scripted = ScriptedCommands()
+    monkeypatch.setattr(shell.k8s_service, "_run_command", scripted.run)
+    return scripted
+
+
+def batch(*commands, timeout=None):
+    return [(command, timeout, None) for command in commands]
+
+
+def test_exit_codes_alone_do_not_stop_the_batch(commands):
+    # A script trapping SIGINT exits 130, and timeout(1) exits 124, without any interruption
+    commands.outcomes.update({"trap": (130, None), "timeout 1 sleep 5": (124, None)})
+    results, status = shell.k8s_service.execute_batch("pod", batch("trap", "timeout 1 sleep 5", "true"))
+    assert status == "completed"
+    assert [r["exit_code"] for r in results] == [130, 124, 0]
+
+
+def test_cancelled_command_stops_the_batch(commands):
+    commands.outcomes["sleep 60"] = (130, "cancelled")
+    results, status = shell.k8s_service.execute_batch("pod", batch("true", "sleep 60", "true"))
+    assert status == "cancelled"
+    assert len(results) == 2
+
+
+def test_batch_deadline_cuts_the_last_command_short(commands, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_TIMEOUT_SECONDS", 5)
+    commands.outcomes["sleep 60"] = (124, "timeout")
+    results, status = shell.k8s_service.execute_batch("pod", batch("sleep 60", "true", timeout=30))
+    assert status == "timed_out"
+    assert commands.timeouts == [5]
+    assert results[0]["interrupted"] == "timeout"
+
+
+def test_command_timeout_within_the_deadline_continues(commands):
+    commands.outcomes["sleep 60"] = (124, "timeout")
+    results, status = shell.k8s_service.execute_batch("pod", batch("sleep 60", "true", timeout=2))
+    assert status == "completed"
+    assert len(results) == 2
+
+
+def test_stop_on_error(commands):
+    commands.outcomes["false"] = (1, None)
+    results, status = shell.k8s_service.execute_batch("pod", batch("false", "true"), stop_on_error=True)
+    assert status == "failed"
+    assert len(results) == 1
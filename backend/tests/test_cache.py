@@ -0,0 +1,103 @@
+import pytest
+
+from app.services.cache import Cache, RedisCache
+
+
+class StubRedis:
+    """In-memory stand-in for the redis-py client calls RedisCache makes, with a settable clock"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.data = {}
+        self.failing = False
+
+    def _check(self):
+        if self.failing:
+            raise ConnectionError("Redis unavailable")
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] <= self.now:
+            del self.data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        self._check()
+        entry = self._live(key)
+        return entry and entry[0]
+
+    def set(self, key, value, ex=None, nx=False):
+        self._check()
+        if nx and self._live(key) is not None:
+            return None
+        self.data[key] = (value.encode(), self.now + ex if ex else float("inf"))
+        return True
+
+    def delete(self, key):
+        self._check()
+        return int(self.data.pop(key, None) is not None)
+
+
+@pytest.fixture
+def redis():
+    return StubRedis()
+
+
+def test_cache_requires_the_storage_operations():
+    with pytest.raises(TypeError):
+        Cache("incomplete")
+
+
+def test_get_set_delete(redis):
+    cache = RedisCache("user-pod", redis, ttl=60)
+    assert cache.get("alice") is None
+    cache.set("alice", "pod-1")
+    assert cache.get("alice") == "pod-1"
+    assert "tempshell:user-pod:alice" in redis.data
+    cache.delete("alice")
+    assert cache.get("alice") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_entries_expire_after_their_ttl(redis):
+    cache = RedisCache("user-pod", redis, ttl=60)
+    cache.set("alice", "pod-1")
+    cache.set("bob", "pod-2", ttl=5)
+    redis.now = 30
+    assert cache.get("alice") == "pod-1"
+    assert cache.get("bob") is None
+    redis.now = 61
+    assert cache.get("alice") is None
+
+
+def test_add_only_sets_absent_keys(redis):
+    cache = RedisCache("revoked-token", redis, ttl=60)
+    assert cache.add("jti", "1")
+    assert not cache.add("jti", "1")
+    redis.now = 61
+    assert cache.add("jti", "1")
+
+
+def test_delete_invalidates_every_replica(redis):
+    # Two replicas share the server, so one delete drops the entry for both
+    first = RedisCache("user-pod", redis, ttl=60)
+    second = RedisCache("user-pod", redis, ttl=60)
+    first.set("alice", "pod-1")
+    assert second.get("alice") == "pod-1"
+    first.delete("alice")
+    assert second.get("alice") is None
+
+
+def test_outage_reads_as_misses_but_add_fails(redis):
+    cache = RedisCache("user-pod", redis, ttl=60)
+    cache.set("alice", "pod-1")
+    redis.failing = True
+    assert cache.get("alice") is None
+    cache.set("alice", "pod-2")
+    cache.delete("alice")
+    with pytest.raises(ConnectionError):
+        cache.add("jti", "1")
+    redis.failing = False
+    assert cache.get("alice") == "pod-1"
@@ -0,0 +1,89 @@
+import os
+import re
+
+import pytest
+
+from app.core.command_policy import DEFAULT_DENY_RULES, CommandPolicy, compile_rules
+
+
+def reference(rules, command):
+    """The decision of one re.search per rule, which RuleMatcher must reproduce"""
+    return any(re.search(rule, command, re.IGNORECASE) for rule in rules)
+
+
+DENIED = [
+    # Chaining with ;, && and pipes
+    "ls; rm -rf /",
+    "cd /tmp && mkfs.ext4 /dev/sda1",
+    "true || dd if=/dev/zero of=/dev/sda",
+    "cat notes.txt | chmod -R 777 /home",
+    "echo ok;mkfs /dev/sdb",
+    # Subshells and command substitution
+    "(rm -rf /)",
+    "echo $(rm -rf /home)",
+    "echo `mkfs /dev/sda`",
+    "bash -c 'dd if=/dev/zero of=x'",
+    # Leading environment assignments
+    "LC_ALL=C rm -rf /",
+    "A=1 B=2 mkfs /dev/sda",
+    "env DEBUG=1 chmod -R 777 .",
+    # Quoted arguments: rules match the raw text, quotes included
+    "echo 'rm -rf /'",
+    'sh -c "echo > /dev/sda"',
+    "RM -RF /",
+]
+
+ALLOWED = [
+    "ls -la",
+    "grep -rn 'TODO' src/ | head -20",
+    "echo \"a; b && c\" | wc -c",
+    "(cd src && make)",
+    "FOO='rm -rf' ls",
+    "rm -r ./build",
+    "dd if=input.img of=copy.img",
+    "chmod -R 755 ~/project",
+    "echo $(date) > /dev/null",
+]
+
+
+@pytest.mark.parametrize("command", DENIED)
+def test_denied(command):
+    assert compile_rules(DEFAULT_DENY_RULES).search(command)
+    assert reference(DEFAULT_DENY_RULES, command)
+
+
+@pytest.mark.parametrize("command", ALLOWED)
+def test_allowed(command):
+    assert not compile_rules(DEFAULT_DENY_RULES).search(command)
+    assert not reference(DEFAULT_DENY_RULES, command)
+
+
+def test_overlapping_prefixes_match_like_the_reference():
+    rules = [r"rm\s+-rf", r"rmdir\s+/", r"r\w+\s+--force", r"(sudo|doas)\s+", r"ch(mod|own)\s+-R"]
+    matcher = compile_rules(rules)
+    for command in ["rmdir /", "rrm -rf x", "remove --force", "x; doas ls", "chown -R a b",
+                    "rm -r -f", "chmod 644 f", "armdir /tmp", "İrm -rf x"]:
+        assert matcher.search(command) == reference(rules, command), command
+
+
+def test_policy_reloads_rules_when_the_file_changes(tmp_path):
+    path = tmp_path / "policy.txt"
+    path.write_text("# no curl\ncurl\\s+\n")
+    policy = CommandPolicy(str(path), reload_interval=0)
+    assert policy.is_denied("x && curl http://example.com")
+    assert not policy.is_denied("mkfs /dev/sda")
+
+    path.write_text("wget\\s+\n")
+    os.utime(path, (1, 1))  # A new mtime even within the filesystem's timestamp resolution
+    assert policy.is_denied("(wget http://example.com)")
+    assert not policy.is_denied("curl http://example.com")
+
+
+def test_policy_keeps_its_rules_when_the_file_is_invalid(tmp_path):
+    path = tmp_path / "policy.txt"
+    path.write_text("curl\\s+\n")
+    policy = CommandPolicy(str(path), reload_interval=0)
+
+    path.write_text("curl(\n")
+    os.utime(path, (1, 1))
+    assert policy.is_denied("curl http://example.com")
@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+
+from app.core.concurrency import AdmissionQueue, Overloaded, SingleFlight
+
+
+async def settle():
+    """Let every ready task run until it blocks again"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_admission_queue_admits_waiters_in_arrival_order():
+    async def run():
+        queue = AdmissionQueue("test", limit=1, max_waiting=10)
+        release = asyncio.Event()
+        order = []
+
+        async def worker(name):
+            async with queue:
+                order.append(name)
+                await release.wait()
+
+        holder = asyncio.ensure_future(worker("holder"))
+        await settle()
+        waiters = []
+        for name in ["a", "b", "c", "d"]:
+            waiters.append(asyncio.ensure_future(worker(name)))
+            await settle()
+        assert queue.pending == 5
+
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        return order, queue.pending
+
+    order, pending = asyncio.run(run())
+    assert order == ["holder", "a", "b", "c", "d"]
+    assert pending == 0
+
+
+def test_late_arrivals_cannot_jump_the_queue():
+    async def run():
+        queue = AdmissionQueue("test", limit=1, max_waiting=10)
+        order = []
+        await queue.__aenter__()
+
+        async def worker(name):
+            async with queue:
+                order.append(name)
+
+        waiter = asyncio.ensure_future(worker("waiter"))
+        await settle()
+        # The slot is handed to the waiter before a newcomer can take it
+        await queue.__aexit__(None, None, None)
+        late = asyncio.ensure_future(worker("late"))
+        await asyncio.gather(waiter, late)
+        return order
+
+    assert asyncio.run(run()) == ["waiter", "late"]
+
+
+def test_full_admission_queue_raises_overloaded():
+    async def run():
+        queue = AdmissionQueue("test", limit=1, max_waiting=2, retry_after=7)
+        release = asyncio.Event()
+
+        async def worker():
+            async with queue:
+                await release.wait()
+
+        admitted = [asyncio.ensure_future(worker()) for _ in range(3)]
+        await settle()
+        with pytest.raises(Overloaded) as rejected:
+            async with queue:
+                pass
+        release.set()
+        await asyncio.gather(*admitted)
+        async with queue:  # Room again once the queue drains
+            pass
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.kind == "test"
+    assert rejected.retry_after == 7
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        queue = AdmissionQueue("test", limit=1, max_waiting=1)
+        await queue.__aenter__()
+
+        async def worker():
+            async with queue:
+                pass
+
+        waiter = asyncio.ensure_future(worker())
+        await settle()
+        waiter.cancel()
+        await settle()
+        pending = queue.pending
+        await queue.__aexit__(None, None, None)
+        return waiter.cancelled(), pending, queue.pending
+
+    assert asyncio.run(run()) == (True, 1, 0)
+
+
+def test_single_flight_shares_one_call():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return "pod-1"
+
+        callers = [asyncio.ensure_future(flight.do("alice", fetch)) for _ in range(5)]
+        await settle()
+        release.set()
+        return await asyncio.gather(*callers), len(calls)
+
+    assert asyncio.run(run()) == (["pod-1"] * 5, 1)
+
+
+def test_single_flight_leader_failure_reaches_every_caller_and_clears_the_key():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+        error = RuntimeError("pod creation failed")
+
+        async def failing():
+            calls.append(1)
+            await release.wait()
+            raise error
+
+        callers = [asyncio.ensure_future(flight.do("alice", failing)) for _ in range(3)]
+        await settle()
+        release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        cleared = "alice" not in flight._calls
+
+        # The next call starts afresh instead of replaying the failure
+        async def succeeding():
+            return "pod-2"
+        retried = await flight.do("alice", succeeding)
+        return results, len(calls), error, cleared, retried
+
+    results, calls, error, cleared, retried = asyncio.run(run())
+    assert calls == 1
+    assert all(result is error for result in results)
+    assert cleared
+    assert retried == "pod-2"
+
+
+def test_single_flight_survives_a_cancelled_caller():
+    async def run():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return "pod-1"
+
+        first = asyncio.ensure_future(flight.do("alice", fetch))
+        second = asyncio.ensure_future(flight.do("alice", fetch))
+        await settle()
+        first.cancel()
+        await settle()
+        release.set()
+        return first.cancelled(), await second
+
+    assert asyncio.run(run()) == (True, "pod-1")
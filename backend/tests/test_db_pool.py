@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from benchmarks import fakes
+from benchmarks.load_test import call
+from app.api.v1 import shell
+from app.core.concurrency import shutdown_executors
+from app.core.config import settings
+from app.core.security import create_access_token
+from app.db.database import Database
+
+
+async def sample_pool(peak, stop):
+    """Record the most connections in use at once until stop is set"""
+    pool = Database.get_pool()
+    while not stop.is_set():
+        peak["in_use"] = max(peak["in_use"], pool.stats()["in_use"])
+        await asyncio.sleep(0.001)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """The fakes with a pool free to grow to 100 connections and 4 DB threads"""
+    for name, value in (("DB_POOL_MIN_SIZE", 1), ("DB_POOL_MAX_SIZE", 100), ("DB_THREADS", 4),
+                        ("EXEC_THREADS", 100), ("RATE_LIMIT_PER_MINUTE", 0), ("RATE_LIMIT_IP_PER_MINUTE", 0),
+                        ("RATE_LIMIT_POD_CREATE_PER_MINUTE", 0)):
+        monkeypatch.setattr(settings, name, value)
+    monkeypatch.setattr(shell.pod_create_admission, "max_waiting", 1000)
+    shutdown_executors()  # Pools are sized when first used
+    fakes.install(shell.k8s_service, pod_start_latency=0.2, exec_latency=1.0, api_latency=0, db_latency=0.001)
+    yield
+    shutdown_executors()
+
+
+def test_long_commands_hold_only_a_handful_of_connections(backend):
+    usernames = [f"dbpool{i}" for i in range(100)]
+    cursor = Database._connect().cursor()
+    for username in usernames:
+        cursor.execute(
+            "INSERT INTO users (username, password, email) VALUES (%s, %s, %s)",
+            (username, "unused", f"{username}@test.example")
+        )
+    tokens = [create_access_token({"sub": username}) for username in usernames]
+
+    async def run():
+        peak = {"in_use": 0}
+        stop = asyncio.Event()
+        sampler = asyncio.ensure_future(sample_pool(peak, stop))
+        responses = await asyncio.gather(*(
+            call("POST", "/api/v1/shell/execute", token, {"command": "sleep 1", "timeout": 30})
+            for token in tokens
+        ))
+        stop.set()
+        await sampler
+        return responses, peak["in_use"]
+
+    responses, peak = asyncio.run(run())
+    assert [status_code for status_code, _ in responses] == [200] * 100
+    # Connections are held only inside the DB threads, never across an exec
+    assert 0 < peak <= settings.DB_THREADS
+    assert Database.get_pool().stats()["size"] <= settings.DB_THREADS + settings.DB_POOL_MIN_SIZE
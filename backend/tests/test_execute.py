@@ -0,0 +1,43 @@
+import pytest
+
+from benchmarks import fakes
+from app.api.v1 import shell
+from app.core.config import settings
+from app.models.schemas import CommandResponse
+
+
+def writes(*frames):
+    """A _run_command that emits (channel, data) frames and exits 0"""
+    def run(pod_id, command, on_output, timeout, session, command_id):
+        for channel, data in frames:
+            on_output(channel, data)
+        return 0, None
+    return run
+
+
+@pytest.fixture
+def service(monkeypatch):
+    fakes.install(shell.k8s_service, pod_start_latency=0, exec_latency=0, api_latency=0, db_latency=0)
+    monkeypatch.setattr(settings, "MAX_OUTPUT_BYTES", 64)
+    return shell.k8s_service
+
+
+def test_streams_are_returned_separately(service, monkeypatch):
+    monkeypatch.setattr(service, "_run_command", writes(("stdout", "out\n"), ("stderr", "err\n")))
+    result = service.execute_command("pod", "cmd")
+    assert result["stdout"] == "out\n"
+    assert result["stderr"] == "err\n"
+    assert result["output"] == "out\n\nerr"
+    assert not result["truncated"]
+    CommandResponse(**result, executed_at="2024-01-01T00:00:00")
+
+
+def test_each_stream_has_its_own_truncation(service, monkeypatch):
+    monkeypatch.setattr(service, "_run_command", writes(("stdout", "x" * 1000), ("stderr", "short")))
+    result = service.execute_command("pod", "cmd")
+    assert result["stdout_truncated"]
+    assert not result["stderr_truncated"]
+    assert result["truncated"]
+    assert result["stderr"] == "short"
+    assert result["stdout"].startswith("x" * 32) and result["stdout"].endswith("x" * 32)
+    assert result["bytes_total"] == 1005
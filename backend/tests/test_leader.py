@@ -0,0 +1,31 @@
+import pytest
+
+from benchmarks import fakes
+from app.api.v1 import shell
+from app.core.config import settings
+
+
+@pytest.fixture
+def k8s(monkeypatch):
+    fakes.install(shell.k8s_service, pod_start_latency=0, exec_latency=0, api_latency=0, db_latency=0)
+    monkeypatch.setattr(shell.k8s_service, "leader", None)
+    return shell.k8s_service
+
+
+class DecidedElector:
+    def __init__(self, leading):
+        self.is_leader = leading
+
+
+def test_not_leader_before_the_election_decides(k8s, monkeypatch):
+    monkeypatch.setattr(settings, "LEADER_ELECTION_ENABLED", True)
+    assert not k8s.is_leader()
+    monkeypatch.setattr(k8s, "leader", DecidedElector(False))
+    assert not k8s.is_leader()
+    monkeypatch.setattr(k8s, "leader", DecidedElector(True))
+    assert k8s.is_leader()
+
+
+def test_sole_replica_leads_without_election(k8s, monkeypatch):
+    monkeypatch.setattr(settings, "LEADER_ELECTION_ENABLED", False)
+    assert k8s.is_leader()
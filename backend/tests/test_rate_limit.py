@@ -0,0 +1,193 @@
+import asyncio
+
+import pytest
+
+from benchmarks import fakes
+from benchmarks.load_test import call, PASSWORD
+from app.api.v1 import shell
+from app.core import rate_limit
+from app.core.config import settings
+from app.core.rate_limit import LocalBuckets, RateLimited, RateLimiter, RateLimitMiddleware, RedisBuckets
+
+
+class Clock:
+    """Stands in for the time module in app.core.rate_limit"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+class LuaRedis:
+    """
+    Runs RedisBuckets' Lua script in an embedded Lua interpreter.
+
+    Implements the hash and expiry commands the script calls, on the same
+    clock as the buckets, so refill and expiry follow the script's own logic.
+    """
+
+    def __init__(self, lupa, clock):
+        self.lua = lupa.LuaRuntime()
+        self.clock = clock
+        self.hashes = {}
+        self.expires = {}
+        self.failing = False
+
+    def _hash(self, key):
+        if key in self.expires and self.expires[key] <= self.clock.now:
+            self.hashes.pop(key, None)
+            del self.expires[key]
+        return self.hashes.get(key)
+
+    def _call(self, command, key, *args):
+        command = command.upper()
+        if command == "HMGET":
+            values = self._hash(key) or {}
+            return self.lua.table_from([values.get(field, False) for field in args])
+        if command == "HSET":
+            values = self._hash(key) or self.hashes.setdefault(key, {})
+            values.update(zip(args[::2], args[1::2]))
+            return len(args) // 2
+        if command == "PEXPIRE":
+            self.expires[key] = self.clock.now + int(args[0]) / 1000
+            return 1
+        raise NotImplementedError(command)
+
+    def register_script(self, source):
+        function = self.lua.eval(f"function(KEYS, ARGV, redis) {source} end")
+        redis = self.lua.table_from({"call": self._call})
+
+        def run(keys, args):
+            if self.failing:
+                raise ConnectionError("Redis unavailable")
+            result = function(self.lua.table_from(keys), self.lua.table_from([str(arg) for arg in args]), redis)
+            return [value.encode() if isinstance(value, str) else value for value in result.values()]
+        return run
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def lua_redis(clock):
+    return LuaRedis(pytest.importorskip("lupa"), clock)
+
+
+@pytest.fixture(params=["local", "redis"])
+def buckets(request, clock):
+    if request.param == "local":
+        return LocalBuckets()
+    return RedisBuckets(request.getfixturevalue("lua_redis"))
+
+
+def test_bursts_up_to_the_budget(buckets):
+    decisions = [buckets.take("user:alice", 5) for _ in range(6)]
+    assert [d.allowed for d in decisions] == [True] * 5 + [False]
+    assert [d.remaining for d in decisions[:5]] == [4, 3, 2, 1, 0]
+    assert decisions[-1].retry_after == 12  # One token per 60 / 5 seconds
+    assert decisions[-1].headers["Retry-After"] == "12"
+
+
+def test_refills_over_time(buckets, clock):
+    for _ in range(5):
+        buckets.take("user:alice", 5)
+    clock.now += 6
+    assert not buckets.take("user:alice", 5).allowed
+
+    clock.now += 6
+    assert buckets.take("user:alice", 5).allowed
+    assert not buckets.take("user:alice", 5).allowed
+
+    # A long idle period refills to the budget and no further
+    clock.now += 3600
+    assert [buckets.take("user:alice", 5).allowed for _ in range(6)] == [True] * 5 + [False]
+
+
+def test_buckets_are_per_key(buckets):
+    for _ in range(5):
+        buckets.take("user:alice", 5)
+    assert buckets.take("user:bob", 5).allowed
+
+
+def test_redis_bucket_expires_once_full_again(lua_redis, clock):
+    buckets = RedisBuckets(lua_redis)
+    buckets.take("user:alice", 60)
+    assert lua_redis._hash("tempshell:ratelimit:user:alice") is not None
+    clock.now += 2  # Refilled after 1s, plus a second of slack
+    assert lua_redis._hash("tempshell:ratelimit:user:alice") is None
+
+
+def test_redis_outage_lets_requests_through(lua_redis):
+    lua_redis.failing = True
+    limiter = RateLimiter(RedisBuckets(lua_redis))
+    assert asyncio.run(limiter.take("execute", "alice", "10.0.0.1")) is None
+    asyncio.run(limiter.check("execute", "alice", "10.0.0.1"))
+
+
+def test_limiter_rejects_on_the_tightest_bucket(clock, monkeypatch):
+    monkeypatch.setattr(settings, "RATE_LIMIT_PER_MINUTE", 2)
+    monkeypatch.setattr(settings, "RATE_LIMIT_IP_PER_MINUTE", 100)
+    limiter = RateLimiter(LocalBuckets())
+    asyncio.run(limiter.check("execute", "alice", "10.0.0.1"))
+    asyncio.run(limiter.check("execute", "alice", "10.0.0.1"))
+    with pytest.raises(RateLimited) as rejected:
+        asyncio.run(limiter.check("execute", "alice", "10.0.0.1"))
+    assert rejected.value.retry_after == 30
+    # The per-IP bucket still admits other users from the same address
+    asyncio.run(limiter.check("execute", "bob", "10.0.0.1"))
+
+
+@pytest.fixture
+def limited(monkeypatch):
+    """The app with a fresh in-process limiter allowing two auth requests per IP"""
+    fakes.install(shell.k8s_service, pod_start_latency=0, exec_latency=0, api_latency=0, db_latency=0)
+    monkeypatch.setattr(settings, "RATE_LIMIT_AUTH_PER_MINUTE", 2)
+    monkeypatch.setattr(rate_limit.rate_limiter, "store", LocalBuckets())
+
+
+def test_middleware_answers_429_once_the_budget_is_spent(limited):
+    body = {"username": "nobody", "password": PASSWORD}
+
+    async def logins():
+        return [await call("POST", "/api/v1/auth/login", body=body) for _ in range(3)]
+
+    responses = asyncio.run(logins())
+    assert [status_code for status_code, _ in responses] == [401, 401, 429]
+    assert responses[-1][1] == {"detail": "Rate limit exceeded, please retry later"}
+
+
+def test_middleware_sets_headers_and_skips_the_route_when_limited(limited):
+    calls = []
+
+    async def route(scope, receive, send):
+        calls.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    middleware = RateLimitMiddleware(route)
+    scope = {"type": "http", "method": "POST", "path": "/api/v1/auth/login", "headers": [],
+             "client": ("10.0.0.2", 50000)}
+
+    async def request():
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+        await middleware(scope, None, send)
+        start = messages[0]
+        return start["status"], dict(start["headers"])
+
+    responses = [asyncio.run(request()) for _ in range(3)]
+    assert [status_code for status_code, _ in responses] == [200, 200, 429]
+    assert responses[0][1][b"x-ratelimit-remaining"] == b"1"
+    assert responses[2][1][b"retry-after"] == b"30"
+    assert calls == ["/api/v1/auth/login"] * 2
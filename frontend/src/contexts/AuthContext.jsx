@@ -28,6 +28,55 @@ export const AuthProvider = ({ children }) => {
     setLoading(false);
   }, []);
 
+  // When the access token expires, trade the refresh token for a new pair
+  // and retry the request once instead of sending the user back to login
+  useEffect(() => {
+    let refreshing = null;
+
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const refreshToken = localStorage.getItem("refresh_token");
+        if (
+          error.response?.status !== 401 ||
+          !refreshToken ||
+          !original ||
+          original._retried ||
+          original.url?.includes("/api/v1/auth/")
+        ) {
+          return Promise.reject(error);
+        }
+        original._retried = true;
+
+        // Concurrent 401s share one refresh, since each refresh token is single-use
+        refreshing =
+          refreshing ||
+          axios
+            .post(`${API_URL}/api/v1/auth/refresh`, {
+              refresh_token: refreshToken,
+            })
+            .finally(() => {
+              refreshing = null;
+            });
+
+        try {
+          const { data } = await refreshing;
+          localStorage.setItem("access_token", data.access_token);
+          localStorage.setItem("refresh_token", data.refresh_token);
+          axios.defaults.headers.common["Authorization"] = `Bearer ${data.access_token}`;
+          setUser((current) => current && { ...current, token: data.access_token });
+          original.headers["Authorization"] = `Bearer ${data.access_token}`;
+          return axios(original);
+        } catch (refreshError) {
+          return Promise.reject(error);
+        }
+      }
+    );
+
+    return () => axios.interceptors.response.eject(interceptor);
+  }, [API_URL]);
+
   const login = async (username, password) => {
     try {
       const response = await axios.post(`${API_URL}/api/v1/auth/login`, {
@@ -90,6 +139,17 @@ export const AuthProvider = ({ children }) => {
       console.error("Error terminating shell:", error);
     }
 
+    const refreshToken = localStorage.getItem("refresh_token");
+    if (refreshToken) {
+      try {
+        await axios.post(`${API_URL}/api/v1/auth/logout`, {
+          refresh_token: refreshToken,
+        });
+      } catch (error) {
+        console.error("Error revoking session:", error);
+      }
+    }
+
     localStorage.removeItem("access_token");
     localStorage.removeItem("refresh_token");
     localStorage.removeItem("username");
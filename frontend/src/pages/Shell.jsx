@@ -3,15 +3,39 @@ import axios from "axios";
 import { useAuth } from "../contexts/AuthContext";
 import "./Shell.css";
 
+// Readable startup steps for the pod phases and container reasons the backend reports
+const STARTUP_STEPS = {
+  not_created: "Your environment will start with your first command",
+  Pending: "Waiting for room in the cluster",
+  ContainerCreating: "Starting your environment",
+  PodInitializing: "Starting your environment",
+  ErrImagePull: "Downloading the environment image",
+  ImagePullBackOff: "Downloading the environment image",
+  Restoring: "Restoring your files",
+};
+
+const describeStartup = (status) =>
+  status === "not_created"
+    ? STARTUP_STEPS.not_created
+    : `${STARTUP_STEPS[status] || "Starting your environment"}...`;
+
 const Shell = () => {
   const [command, setCommand] = useState("");
   const [history, setHistory] = useState([]);
   const [loading, setLoading] = useState(false);
   const [commandHistory, setCommandHistory] = useState([]);
   const [historyIndex, setHistoryIndex] = useState(-1);
+  const [streaming, setStreaming] = useState(
+    localStorage.getItem("shell_streaming") === "true"
+  );
+  const [podStatus, setPodStatus] = useState("Pending");
 
   const terminalRef = useRef(null);
   const inputRef = useRef(null);
+  const socketRef = useRef(null);
+  const pendingRef = useRef(null);
+  // Id of the running command, so Cancel stops that command only
+  const commandIdRef = useRef(null);
 
   const { API_URL } = useAuth();
 
@@ -41,12 +65,136 @@ const Shell = () => {
     ]);
   }, []);
 
+  // Start the pod while the user types; progress is pushed over server-sent events
+  useEffect(() => {
+    let source = null;
+    const finished = (status) => ["Running", "Failed", "not_created"].includes(status);
+
+    const provision = async () => {
+      try {
+        const res = await axios.post(`${API_URL}/api/v1/shell/provision`);
+        setPodStatus(res.data.status);
+        if (finished(res.data.status)) return;
+
+        const base = API_URL || window.location.origin;
+        const token = localStorage.getItem("access_token");
+        source = new EventSource(
+          `${base}/api/v1/shell/provision/events?token=${encodeURIComponent(token)}`
+        );
+        source.addEventListener("status", (event) => {
+          const state = JSON.parse(event.data);
+          setPodStatus(state.status);
+          if (finished(state.status)) source.close();
+        });
+        // The first command still creates the pod if provisioning can't be followed
+        source.onerror = () => source.close();
+      } catch (error) {
+        setPodStatus("Failed");
+      }
+    };
+
+    provision();
+    return () => {
+      if (source) source.close();
+    };
+  }, [API_URL]);
+
+  // Close the streaming connection when leaving the page
+  useEffect(() => {
+    return () => {
+      if (socketRef.current) socketRef.current.close();
+    };
+  }, []);
+
+  const toggleStreaming = () => {
+    setStreaming((prev) => {
+      localStorage.setItem("shell_streaming", String(!prev));
+      return !prev;
+    });
+  };
+
+  const streamUrl = () => {
+    const base = API_URL || window.location.origin;
+    const token = localStorage.getItem("access_token");
+    return `${base.replace(/^http/, "ws")}/api/v1/shell/stream?token=${encodeURIComponent(token)}`;
+  };
+
+  // Append output frames to the in-progress output entry as they arrive
+  const handleStreamFrame = (event) => {
+    const frame = JSON.parse(event.data);
+
+    if (frame.type === "stdout" || frame.type === "stderr") {
+      setHistory((prev) => {
+        const last = prev[prev.length - 1];
+        if (!last || !last.streaming) return prev;
+        return [...prev.slice(0, -1), { ...last, content: last.content + frame.data }];
+      });
+      return;
+    }
+
+    const pending = pendingRef.current;
+    pendingRef.current = null;
+    if (!pending) return;
+
+    if (frame.type === "exit") {
+      pending.resolve(frame.exit_code);
+    } else {
+      pending.reject(new Error(frame.detail || "Command execution failed."));
+    }
+  };
+
+  const getSocket = () =>
+    new Promise((resolve, reject) => {
+      const existing = socketRef.current;
+      if (existing && existing.readyState === WebSocket.OPEN) {
+        resolve(existing);
+        return;
+      }
+
+      const ws = new WebSocket(streamUrl());
+      ws.onopen = () => resolve(ws);
+      ws.onerror = () => reject(new Error("Could not open streaming connection."));
+      ws.onmessage = handleStreamFrame;
+      ws.onclose = () => {
+        socketRef.current = null;
+        if (pendingRef.current) {
+          pendingRef.current.reject(new Error("Streaming connection closed."));
+          pendingRef.current = null;
+        }
+      };
+      socketRef.current = ws;
+    });
+
+  const streamCommand = async (trimmed) => {
+    const ws = await getSocket();
+
+    setHistory((prev) => [...prev, { type: "output", content: "", streaming: true }]);
+
+    try {
+      const exitCode = await new Promise((resolve, reject) => {
+        pendingRef.current = { resolve, reject };
+        ws.send(JSON.stringify({ command: trimmed, command_id: commandIdRef.current }));
+      });
+      setHistory((prev) =>
+        prev.map((h) =>
+          h.streaming ? { ...h, streaming: false, exit_code: exitCode } : h
+        )
+      );
+    } catch (error) {
+      setHistory((prev) => [
+        ...prev.map((h) => (h.streaming ? { ...h, streaming: false } : h)),
+        { type: "error", content: error.message },
+      ]);
+    }
+  };
+
   const executeCommand = async (e) => {
     e.preventDefault();
     const trimmed = command.trim();
     if (!trimmed || loading) return;
 
     setLoading(true);
+    commandIdRef.current = Math.random().toString(36).slice(2);
 
     // Add to local command history for navigation
     setCommandHistory((prev) => [...prev, trimmed]);
@@ -58,16 +206,33 @@ const Shell = () => {
       { type: "input", content: trimmed },
     ]);
 
+    if (streaming) {
+      try {
+        await streamCommand(trimmed);
+      } catch (error) {
+        setHistory((prev) => [...prev, { type: "error", content: error.message }]);
+      } finally {
+        setLoading(false);
+        setCommand("");
+        if (inputRef.current) inputRef.current.focus();
+      }
+      return;
+    }
+
     try {
       const res = await axios.post(`${API_URL}/api/v1/shell/execute`, {
         command: trimmed,
+        command_id: commandIdRef.current,
       });
 
+      const output = res.data?.output ?? "";
       setHistory((prev) => [
         ...prev,
         {
           type: "output",
-          content: res.data?.output ?? "",
+          content: res.data?.truncated
+            ? `${output}\n[output truncated: ${res.data.bytes_total} bytes produced]`
+            : output,
           exit_code: res.data?.exit_code,
         },
       ]);
@@ -88,6 +253,23 @@ const Shell = () => {
     }
   };
 
+  // Stop the running command; its request then finishes with exit code 130
+  const cancelCommand = async () => {
+    try {
+      await axios.post(`${API_URL}/api/v1/shell/cancel`, null, {
+        params: { command_id: commandIdRef.current },
+      });
+    } catch (error) {
+      setHistory((prev) => [
+        ...prev,
+        {
+          type: "error",
+          content: error.response?.data?.detail || "Failed to cancel command.",
+        },
+      ]);
+    }
+  };
+
   const handleKeyDown = (e) => {
     if (e.key === "ArrowUp") {
       e.preventDefault();
@@ -125,15 +307,26 @@ const Shell = () => {
               <span className="terminal-icon">⚡</span>
               <span>Terminal</span>
             </div>
-            <button
-              onClick={clearTerminal}
-              className="clear-btn"
-              title="Clear terminal"
-              type="button"
-            >
-              <span>🗑️</span>
-              <span>Clear</span>
-            </button>
+            <div className="terminal-actions">
+              <button
+                onClick={toggleStreaming}
+                className="clear-btn"
+                title="Show output as it is produced"
+                type="button"
+              >
+                <span>{streaming ? "📡" : "📦"}</span>
+                <span>{streaming ? "Streaming" : "Buffered"}</span>
+              </button>
+              <button
+                onClick={clearTerminal}
+                className="clear-btn"
+                title="Clear terminal"
+                type="button"
+              >
+                <span>🗑️</span>
+                <span>Clear</span>
+              </button>
+            </div>
           </div>
 
           <div className="shell-terminal" ref={terminalRef}>
@@ -197,20 +390,32 @@ const Shell = () => {
                 autoFocus
               />
             </div>
-            <button
-              type="submit"
-              disabled={loading || !command.trim()}
-              className="execute-btn"
-            >
-              {loading ? "Executing..." : "Execute"}
-            </button>
+            {loading ? (
+              <button type="button" onClick={cancelCommand} className="execute-btn">
+                Cancel
+              </button>
+            ) : (
+              <button
+                type="submit"
+                disabled={!command.trim()}
+                className="execute-btn"
+              >
+                Execute
+              </button>
+            )}
           </form>
         </div>
 
         <div className="shell-footer">
           <span className="footer-status">
-            <span className="status-dot"></span>
-            Connected to Kubernetes Pod
+            <span
+              className={`status-dot ${podStatus === "Running" ? "" : "status-dot-pending"}`}
+            ></span>
+            {podStatus === "Running"
+              ? "Connected to Kubernetes Pod"
+              : podStatus === "Failed"
+              ? "Environment unavailable, it will be retried on your first command"
+              : describeStartup(podStatus)}
           </span>
           <span className="footer-hint">
             💡 Pro tip: Use arrow keys to navigate history